@@ -439,13 +439,20 @@ def chat():
                 limit=limit,
                 use_hybrid=True,
                 vector_similarity_threshold=vector_similarity_threshold,
-                rrf_similarity_threshold=rrf_similarity_threshold
+                rrf_similarity_threshold=rrf_similarity_threshold,
+                # 只取构建上下文和来源信息所需的字段
+                output_fields=['file_name', 'content', 'source'],
+                # 检索超出时间预算时使用已有结果，保证首字延迟有上限
+                time_budget_ms=config.get('retrieval_budget', {}).get('chat_ms', None)
             )
+            if isinstance(doc_results, dict) and doc_results.get('degraded'):
+                logger.warning(f"素材库检索降级: {doc_results.get('degraded_reasons')}，query={question[:100]}")
             
-            # 只使用DOC结果
+            # 只使用DOC结果（补齐字段超时的结果没有内容，跳过）
             all_entities = []
             if isinstance(doc_results, dict) and doc_results.get('entities'):
-                all_entities.extend(doc_results['entities'][0] if doc_results['entities'] else [])
+                all_entities.extend(e for e in (doc_results['entities'][0] if doc_results['entities'] else [])
+                                    if e.get('content') or e.get('answer'))
             
             # 格式化来源信息
             sources_info = format_sources(all_entities)
@@ -82,3 +82,12 @@ def setup_chat_service_logging():
         log_file='logs/chat_service.log',
         log_level=logging.INFO
     )
+
+
+def setup_embedding_service_logging():
+    """配置向量化服务的日志（向量化相关模块统一使用vector_db日志器）"""
+    return setup_logging(
+        service_name='vector_db',
+        log_file='logs/embedding_server.log',
+        log_level=logging.INFO
+    )
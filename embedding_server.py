@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+向量化服务
+独立进程常驻加载bge模型，对外提供批量/embed接口；
+API进程将embedding_backend.type配置为remote后通过RemoteEmbeddings调用本服务，
+多个API worker共享同一份模型，启动时无需加载模型
+"""
+import logging
+import json
+from flask import Flask, request, jsonify
+from config.log_config import setup_embedding_service_logging
+
+# 配置向量化服务日志
+setup_embedding_service_logging()
+logger = logging.getLogger('vector_db')
+
+# 加载配置文件
+with open('./config/config.json', 'r', encoding='utf-8') as f:
+    config = json.load(f)
+
+embedding_server_config = config.get('embedding_server', {})
+
+app = Flask(__name__)
+app.json.ensure_ascii = False
+
+# 启动时加载模型（在main中初始化）
+embedding_model = None
+embedding_model_id = None
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    if embedding_model is None:
+        return jsonify({'status': 'fail', 'msg': '向量模型未加载', 'code': 503, 'data': ''})
+    return jsonify({'status': 'success', 'code': 200, 'msg': '向量化服务正常',
+                    'data': {'model': embedding_model_id}})
+
+
+@app.route('/embed', methods=['POST'])
+def embed():
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({'status': 'fail', 'msg': 'texts必须是字符串列表', 'code': 400, 'data': ''})
+    max_texts = embedding_server_config.get('max_texts_per_request', 1024)
+    if len(texts) > max_texts:
+        return jsonify({'status': 'fail', 'msg': f'单次请求最多{max_texts}条文本', 'code': 400, 'data': ''})
+    if embedding_model is None:
+        return jsonify({'status': 'fail', 'msg': '向量模型未加载', 'code': 503, 'data': ''})
+
+    try:
+        # 并发请求由BatchingEmbeddings在服务端合批
+        embeddings = embedding_model.embed_documents(texts) if texts else []
+    except Exception:
+        import traceback
+        logger.exception(f"向量化异常: {traceback.format_exc()}")
+        return jsonify({'status': 'fail', 'msg': traceback.format_exc(), 'code': 400, 'data': ''})
+    return jsonify({'status': 'success', 'code': 200, 'msg': '向量化成功',
+                    'data': {'embeddings': embeddings, 'model': embedding_model_id}})
+
+
+def main():
+    global embedding_model, embedding_model_id
+    from embedding_utils.backends import build_embedding_model
+
+    backend_type = embedding_server_config.get('backend', 'torch')
+    if backend_type == 'remote':
+        logger.error("向量化服务的backend不能为remote")
+        return
+    logger.info(f"向量化服务启动，加载向量模型，backend={backend_type}")
+    embedding_model, embedding_model_id = build_embedding_model(config, backend_type)
+    # 预热一次，避免首个请求承担初始化开销
+    embedding_model.embed_documents(['预热'])
+    logger.info(f"向量模型加载完成: {embedding_model_id}")
+
+    host = embedding_server_config.get('host', '0.0.0.0')
+    port = embedding_server_config.get('port', 8004)
+    logger.info(f"向量化服务监听地址: {host}:{port}")
+    try:
+        app.run(host=host, port=port, debug=False, threaded=True)
+    except KeyboardInterrupt:
+        logger.info("收到停止信号，正在关闭服务...")
+
+
+if __name__ == '__main__':
+    main()
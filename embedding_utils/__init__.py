@@ -0,0 +1 @@
+# 向量化工具模块
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+向量模型后端工厂
+根据config['embedding_backend']['type']创建向量模型：
+    torch: HuggingFaceBgeEmbeddings（默认，有GPU时使用cuda）
+    onnx:  onnxruntime CPU推理，可选int8动态量化
+    remote: 调用embedding_server.py提供的向量化服务，本进程不加载模型
+所有后端输出相同维度、L2归一化的向量，切换后端无需重建collection
+"""
+import logging
+
+logger = logging.getLogger('vector_db')
+
+
+def detect_device():
+    """检测可用设备"""
+    try:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        logger.info(f"检测到设备: {device}")
+    except ImportError:
+        device = 'cpu'
+        logger.warning("未安装torch，使用CPU设备")
+    return device
+
+
+def create_torch_embedding_model(model_path, device=None):
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+    return HuggingFaceBgeEmbeddings(
+        model_name=model_path,
+        # model_name="BAAI/bge-large-zh-v1.5",
+        model_kwargs={'device': device or detect_device()},
+        encode_kwargs={'normalize_embeddings': True}  # set True to compute cosine similarity
+    )
+
+
+def create_embedding_model(config, backend_type=None):
+    """按配置创建向量模型
+
+    Args:
+        backend_type: 指定后端类型，为None时使用config['embedding_backend']['type']
+
+    Returns:
+        (向量模型, 模型标识)；模型标识区分不同后端/量化方式，用作持久化向量缓存的键
+    """
+    model_path = config['embedding_model_path']
+    backend_config = config.get('embedding_backend', {})
+    backend_type = backend_type or backend_config.get('type', 'torch')
+
+    if backend_type == 'remote':
+        from embedding_utils.remote_client import RemoteEmbeddings
+        base_url = backend_config.get('remote_url', 'http://127.0.0.1:8004')
+        model = RemoteEmbeddings(base_url, timeout=backend_config.get('remote_timeout', 60),
+                                 batch_size=backend_config.get('remote_batch_size', 256))
+        logger.info(f"使用远程向量化服务: {base_url}")
+        return model, f"remote:{base_url}"
+
+    if backend_type == 'onnx':
+        from embedding_utils.onnx_backend import OnnxBgeEmbeddings
+        quantize = backend_config.get('quantize', True)
+        model = OnnxBgeEmbeddings(
+            model_path,
+            backend_config.get('onnx_dir', './models/bge-large-zh-v1.5-onnx'),
+            quantize=quantize,
+            normalize=True,
+            max_length=backend_config.get('max_length', 512),
+            batch_size=backend_config.get('batch_size', 32),
+            intra_op_num_threads=backend_config.get('intra_op_num_threads', 0)
+        )
+        logger.info(f"使用ONNX向量模型后端，int8量化={quantize}")
+        return model, f"{model_path}#onnx{'-int8' if quantize else ''}"
+
+    if backend_type != 'torch':
+        raise ValueError(f"不支持的向量模型后端: {backend_type}，可选[torch, onnx, remote]")
+    return create_torch_embedding_model(model_path), model_path
+
+
+def build_embedding_model(config, backend_type=None):
+    """创建向量模型并按配置包装动态合批与持久化向量缓存
+
+    远程后端的合批与缓存由向量化服务进程负责，本进程不再重复包装
+
+    Returns:
+        (向量模型, 模型标识)
+    """
+    from embedding_utils.batch_dispatcher import BatchingEmbeddings
+    from embedding_utils.embedding_cache import EmbeddingCache, CachedEmbeddings
+
+    backend_type = backend_type or config.get('embedding_backend', {}).get('type', 'torch')
+    embedding_model, embedding_model_id = create_embedding_model(config, backend_type)
+    if backend_type == 'remote':
+        return embedding_model, embedding_model_id
+
+    # 动态合批：并发的查询/入库向量化请求在短时间窗口内合并为一次批量前向计算
+    embedding_batching_config = config.get('embedding_batching', {})
+    if embedding_batching_config.get('enabled', False):
+        embedding_model = BatchingEmbeddings(
+            embedding_model,
+            max_batch_size=embedding_batching_config.get('max_batch_size', 64),
+            max_wait_ms=embedding_batching_config.get('max_wait_ms', 8)
+        )
+        logger.info(f"已启用向量化动态合批，max_batch_size={embedding_batching_config.get('max_batch_size', 64)}, "
+                    f"max_wait_ms={embedding_batching_config.get('max_wait_ms', 8)}")
+
+    # 持久化向量缓存：相同文本（同一模型、同一归一化方式）只计算一次
+    embedding_cache_config = config.get('embedding_cache', {})
+    if embedding_cache_config.get('enabled', False):
+        embedding_model = CachedEmbeddings(
+            embedding_model,
+            EmbeddingCache(embedding_cache_config.get('path', './cache/embedding_cache.sqlite'),
+                           max_bytes=int(embedding_cache_config.get('max_size_mb', 2048)) * 1024 * 1024),
+            model_name=embedding_model_id,
+            normalize=True
+        )
+        logger.info(f"已启用持久化向量缓存: {embedding_cache_config.get('path', './cache/embedding_cache.sqlite')}")
+    return embedding_model, embedding_model_id
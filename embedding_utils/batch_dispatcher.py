@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+向量化动态合批调度
+并发请求的embed_documents调用先进入队列，由单个工作线程在很短的时间窗口内收集，
+合并成一次批量前向计算后再把结果分发回各调用方；吞吐随批大小而不是请求数增长
+"""
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger('vector_db')
+
+
+class _EmbedRequest:
+    __slots__ = ('texts', 'future')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+
+
+class BatchingEmbeddings:
+    """在向量模型外包装动态合批，接口与embed_documents/embed_query保持一致"""
+
+    def __init__(self, model, max_batch_size=64, max_wait_ms=8):
+        """
+        Args:
+            model: 底层向量模型
+            max_batch_size: 单次前向计算最多合并的文本条数，超过该值的单个请求独立计算
+            max_wait_ms: 收到第一个请求后最多等待多少毫秒来收集其他请求
+        """
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._worker.start()
+
+    def _collect(self, first):
+        """以first为起点，在时间窗口内收集可合并的请求，返回(本批请求, 放不下的请求)"""
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request.texts) > self.max_batch_size:
+                return batch, request
+            batch.append(request)
+            size += len(request.texts)
+        return batch, None
+
+    def _run(self):
+        pending = None
+        while True:
+            first = pending if pending is not None else self._queue.get()
+            pending = None
+            if len(first.texts) >= self.max_batch_size:
+                batch = [first]
+            else:
+                batch, pending = self._collect(first)
+            self._execute(batch)
+
+    def _execute(self, batch):
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = self.model.embed_documents(texts)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        self.texts += len(texts)
+        if len(batch) > 1:
+            logger.debug(f"向量化合批：合并{len(batch)}个请求，共{len(texts)}条文本")
+        start = 0
+        for request in batch:
+            end = start + len(request.texts)
+            request.future.set_result(vectors[start:end])
+            start = end
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        self._ensure_worker()
+        request = _EmbedRequest(texts)
+        self._queue.put(request)
+        return request.future.result()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        """返回合批统计"""
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'texts': self.texts,
+            'avg_requests_per_batch': round(self.requests / self.batches, 2) if self.batches else 0.0,
+            'avg_texts_per_batch': round(self.texts / self.batches, 2) if self.batches else 0.0
+        }
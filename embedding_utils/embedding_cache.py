@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+持久化向量缓存
+以(模型路径, 是否归一化, 文本sha256)为键，把float32向量存入SQLite，
+按总大小淘汰最久未访问的条目；入库和查询向量化都先读缓存，未变化的文本不再重复计算
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+
+def text_sha256(text):
+    """文本的sha256摘要"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """基于SQLite的向量缓存，支持多线程访问"""
+
+    def __init__(self, path, max_bytes=2 * 1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'model TEXT NOT NULL, normalize INTEGER NOT NULL, text_hash TEXT NOT NULL, '
+            'vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, '
+            'PRIMARY KEY (model, normalize, text_hash))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM embeddings').fetchone()[0]
+
+    def get_many(self, model, normalize, text_hashes):
+        """批量读取，返回{text_hash: np.ndarray}"""
+        result = {}
+        if not text_hashes:
+            return result
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        now = time.time()
+        with self._lock:
+            # SQLite单条语句变量数有限，分批查询
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE model = ? AND normalize = ? '
+                    f'AND text_hash IN ({placeholders})', [model, int(normalize)] + batch
+                ).fetchall()
+                for text_hash, blob in rows:
+                    result[text_hash] = np.frombuffer(blob, dtype=np.float32)
+                if rows:
+                    hit_hashes = [row[0] for row in rows]
+                    self._conn.execute(
+                        f'UPDATE embeddings SET last_access = ? WHERE model = ? AND normalize = ? '
+                        f'AND text_hash IN ({",".join("?" * len(hit_hashes))})',
+                        [now, model, int(normalize)] + hit_hashes
+                    )
+            self._conn.commit()
+        return result
+
+    def put_many(self, model, normalize, items):
+        """批量写入，items为[(text_hash, vector)]"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for text_hash, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((model, int(normalize), text_hash, blob, len(blob), now))
+        with self._lock:
+            for row in rows:
+                old = self._conn.execute(
+                    'SELECT size FROM embeddings WHERE model = ? AND normalize = ? AND text_hash = ?', row[:3]
+                ).fetchone()
+                self._conn.execute('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)', row)
+                self._total_bytes += row[4] - (old[0] if old else 0)
+            self._conn.commit()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到总大小降到上限的90%"""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                'SELECT rowid, size FROM embeddings ORDER BY last_access LIMIT 1000').fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            delete_ids = []
+            for rowid, size in rows:
+                delete_ids.append(rowid)
+                self._total_bytes -= size
+                if self._total_bytes <= target:
+                    break
+            self._conn.execute(f'DELETE FROM embeddings WHERE rowid IN ({",".join("?" * len(delete_ids))})',
+                               delete_ids)
+            evicted += len(delete_ids)
+        self._conn.commit()
+        logger.info(f"向量缓存超过上限，淘汰{evicted}条，当前大小{self._total_bytes}字节")
+
+
+class CachedEmbeddings:
+    """在向量模型外包装持久化缓存，接口与embed_documents/embed_query保持一致"""
+
+    def __init__(self, model, cache, model_name, normalize=True):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+        self.normalize = normalize
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        hashes = [text_sha256(t) for t in texts]
+        try:
+            cached = self.cache.get_many(self.model_name, self.normalize, hashes)
+        except Exception as e:
+            logger.warning(f"读取向量缓存失败，直接计算: {e}")
+            cached = {}
+
+        # 未命中的文本去重后一次性计算
+        miss = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in miss:
+                miss[text_hash] = text
+        if miss:
+            vectors = self.model.embed_documents(list(miss.values()))
+            new_items = list(zip(miss.keys(), vectors))
+            for text_hash, vector in new_items:
+                cached[text_hash] = np.asarray(vector, dtype=np.float32)
+            try:
+                self.cache.put_many(self.model_name, self.normalize, new_items)
+            except Exception as e:
+                logger.warning(f"写入向量缓存失败: {e}")
+        logger.info(f"向量缓存：共{len(texts)}条文本，命中{len(texts) - len(miss)}条，新计算{len(miss)}条")
+        return [cached[h].tolist() for h in hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+bge-large-zh的ONNX Runtime CPU推理后端
+把embedding_model_path下的模型导出为ONNX（可选int8动态量化），用onnxruntime推理；
+与HuggingFaceBgeEmbeddings保持一致：CLS池化、L2归一化、换行替换为空格、维度1024
+
+命令行用法:
+    python -m embedding_utils.onnx_backend export [--no-quantize]
+    python -m embedding_utils.onnx_backend parity [--texts-file 文本文件] [--min-cosine 0.98]
+    python -m embedding_utils.onnx_backend bench [--texts-file 文本文件] [--rounds 3]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import traceback
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_FILE = 'model_int8.onnx'
+
+# 未提供文本文件时用于一致性校验和性能测试的样例
+SAMPLE_TEXTS = [
+    '产品的核心优势是什么？',
+    '如何申请发票，需要提供哪些材料',
+    '公司成立于2010年，总部位于上海，主要从事企业服务软件的研发与销售。',
+    '退款一般在3到5个工作日内原路退回，如遇节假日顺延。',
+    '高管个人IP打造需要持续输出专业内容，并保持稳定的更新频率。',
+    '请介绍一下你们的售后服务流程\n包括保修期和上门服务',
+    '向量数据库适合存储非结构化数据的语义表示，用于相似度检索。',
+    '会议纪要：本周完成了检索模块的性能优化，下周开始压测。',
+]
+
+
+def onnx_model_file(onnx_dir, quantize=True):
+    return os.path.join(onnx_dir, ONNX_QUANTIZED_FILE if quantize else ONNX_MODEL_FILE)
+
+
+def export_onnx(model_path, onnx_dir, quantize=True, opset=14):
+    """把HuggingFace模型导出为ONNX，并可选做int8动态量化
+
+    Returns:
+        最终供推理使用的onnx文件路径
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(onnx_dir, exist_ok=True)
+    fp32_path = onnx_model_file(onnx_dir, quantize=False)
+    if not os.path.exists(fp32_path):
+        logger.info(f"开始导出ONNX模型: {model_path} -> {fp32_path}")
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModel.from_pretrained(model_path)
+        model.eval()
+        inputs = tokenizer(['导出示例文本'], padding=True, truncation=True, return_tensors='pt')
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in inputs]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        with torch.no_grad():
+            # 使用TorchScript导出器（dynamo导出器额外依赖onnxscript，且不使用dynamic_axes）
+            torch.onnx.export(
+                model,
+                tuple(inputs[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=opset,
+                do_constant_folding=True,
+                dynamo=False
+            )
+        tokenizer.save_pretrained(onnx_dir)
+        logger.info(f"ONNX模型导出完成: {fp32_path}")
+
+    if not quantize:
+        return fp32_path
+
+    int8_path = onnx_model_file(onnx_dir, quantize=True)
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        logger.info(f"开始int8动态量化: {int8_path}")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"int8动态量化完成: {int8_path}")
+    return int8_path
+
+
+class OnnxBgeEmbeddings:
+    """基于onnxruntime的bge向量模型，接口与embed_documents/embed_query保持一致"""
+
+    def __init__(self, model_path, onnx_dir, quantize=True, normalize=True, max_length=512, batch_size=32,
+                 intra_op_num_threads=0):
+        """
+        Args:
+            model_path: 原始HuggingFace模型目录，onnx文件不存在时从这里导出
+            onnx_dir: onnx文件及分词器所在目录
+            quantize: 是否使用int8动态量化模型
+            normalize: 是否对向量做L2归一化（需与入库时保持一致）
+            max_length: 最大token长度
+            batch_size: 单次推理的最大文本条数
+            intra_op_num_threads: onnxruntime算子内线程数，0表示由onnxruntime决定
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_file = onnx_model_file(onnx_dir, quantize)
+        if not os.path.exists(model_file):
+            model_file = export_onnx(model_path, onnx_dir, quantize=quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_num_threads:
+            options.intra_op_num_threads = int(intra_op_num_threads)
+        self.session = ort.InferenceSession(model_file, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        tokenizer_dir = onnx_dir if os.path.exists(os.path.join(onnx_dir, 'tokenizer_config.json')) else model_path
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self.normalize = normalize
+        self.max_length = max_length
+        self.batch_size = max(1, int(batch_size))
+        logger.info(f"已加载ONNX向量模型: {model_file}")
+
+    def _encode(self, texts):
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors='np')
+        feeds = {name: inputs[name].astype(np.int64) for name in inputs if name in self.input_names}
+        last_hidden_state = self.session.run(['last_hidden_state'], feeds)[0]
+        # bge使用[CLS]向量作为句向量
+        vectors = last_hidden_state[:, 0].astype(np.float32)
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.clip(norms, 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts):
+        texts = [t.replace('\n', ' ') for t in texts]
+        if not texts:
+            return []
+        # 按长度排序后分批，减少padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            batch_vectors = self._encode([texts[i] for i in batch_ids])
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+            vectors[batch_ids] = batch_vectors
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def check_parity(reference_model, candidate_model, texts):
+    """比较两个后端生成的向量，返回维度、范数与余弦相似度统计"""
+    ref = np.asarray(reference_model.embed_documents(texts), dtype=np.float32)
+    cand = np.asarray(candidate_model.embed_documents(texts), dtype=np.float32)
+    ref_norm = np.linalg.norm(ref, axis=1)
+    cand_norm = np.linalg.norm(cand, axis=1)
+    cosine = (ref * cand).sum(axis=1) / np.clip(ref_norm * cand_norm, 1e-12, None)
+    return {
+        'texts': len(texts),
+        'reference_dim': int(ref.shape[1]),
+        'candidate_dim': int(cand.shape[1]),
+        'reference_norm_mean': float(ref_norm.mean()),
+        'candidate_norm_mean': float(cand_norm.mean()),
+        'cosine_min': float(cosine.min()),
+        'cosine_mean': float(cosine.mean())
+    }
+
+
+def benchmark(model, texts, rounds=3):
+    """测量embed_documents的耗时，返回每轮耗时和吞吐"""
+    model.embed_documents(texts[:1])  # 预热
+    costs = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        model.embed_documents(texts)
+        costs.append(time.perf_counter() - start)
+    best = min(costs)
+    return {'texts': len(texts), 'rounds': rounds, 'best_seconds': round(best, 4),
+            'texts_per_second': round(len(texts) / best, 2) if best else 0.0}
+
+
+def _load_texts(texts_file, repeat=1):
+    if texts_file:
+        with open(texts_file, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = list(SAMPLE_TEXTS)
+    return texts * max(1, repeat)
+
+
+def _torch_model(model_path):
+    from embedding_utils.backends import create_torch_embedding_model
+    return create_torch_embedding_model(model_path)
+
+
+def main():
+    with open('./config/config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    backend_config = config.get('embedding_backend', {})
+
+    parser = argparse.ArgumentParser(description='bge向量模型ONNX导出、一致性校验与性能测试')
+    parser.add_argument('command', choices=['export', 'parity', 'bench'])
+    parser.add_argument('--model-path', default=config['embedding_model_path'])
+    parser.add_argument('--onnx-dir', default=backend_config.get('onnx_dir', './models/bge-large-zh-v1.5-onnx'))
+    parser.add_argument('--no-quantize', action='store_true', help='使用fp32模型，不做int8量化')
+    parser.add_argument('--texts-file', default='', help='每行一条文本，不传则使用内置样例')
+    parser.add_argument('--repeat', type=int, default=16, help='性能测试时样例文本重复次数')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--min-cosine', type=float, default=0.98,
+                        help='一致性校验时要求的最小余弦相似度，低于该值返回非0')
+    args = parser.parse_args()
+    quantize = not args.no_quantize
+
+    try:
+        if args.command == 'export':
+            print(f"导出完成: {export_onnx(args.model_path, args.onnx_dir, quantize=quantize)}")
+            return 0
+
+        onnx_model = OnnxBgeEmbeddings(args.model_path, args.onnx_dir, quantize=quantize,
+                                       batch_size=backend_config.get('batch_size', 32),
+                                       intra_op_num_threads=backend_config.get('intra_op_num_threads', 0))
+        torch_model = _torch_model(args.model_path)
+
+        if args.command == 'parity':
+            report = check_parity(torch_model, onnx_model, _load_texts(args.texts_file))
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            passed = (report['candidate_dim'] == report['reference_dim']
+                      and report['cosine_min'] >= args.min_cosine)
+            if not passed:
+                print(f"一致性校验未通过：维度{report['candidate_dim']}/{report['reference_dim']}，"
+                      f"最小余弦相似度{report['cosine_min']:.4f}，要求不低于{args.min_cosine}")
+            return 0 if passed else 1
+
+        texts = _load_texts(args.texts_file, args.repeat)
+        torch_report = benchmark(torch_model, texts, args.rounds)
+        onnx_report = benchmark(onnx_model, texts, args.rounds)
+        speedup = torch_report['best_seconds'] / onnx_report['best_seconds'] if onnx_report['best_seconds'] else 0.0
+        print(json.dumps({'torch': torch_report, 'onnx': onnx_report, 'speedup': round(speedup, 2)},
+                         ensure_ascii=False, indent=2))
+        return 0
+    except Exception as e:
+        print(f"执行失败: {e}")
+        print(traceback.format_exc())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
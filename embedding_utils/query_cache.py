@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+查询向量进程内缓存
+按查询文本缓存向量，LRU淘汰并支持过期时间，多线程安全；
+高频重复的问题（FAQ、推荐问题）直接命中缓存，不再调用向量模型
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('vector_db')
+
+
+class QueryEmbeddingCache:
+    """线程安全的LRU/TTL查询向量缓存，带命中统计"""
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600):
+        """
+        Args:
+            max_entries: 最多缓存的查询条数
+            ttl_seconds: 缓存有效期（秒），小于等于0表示不过期
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at, now):
+        return self.ttl_seconds and self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def get(self, text):
+        """读取缓存，未命中或已过期返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is not None and self._expired(entry[1], now):
+                del self._entries[text]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, text, vector):
+        now = time.time()
+        with self._lock:
+            self._entries[text] = (vector, now)
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def embed(self, texts, embed_fn):
+        """批量获取查询向量，只对未命中的文本（去重后）调用embed_fn
+
+        Args:
+            texts: 查询文本列表
+            embed_fn: 向量化函数，输入文本列表，返回向量列表
+
+        Returns:
+            与texts一一对应的向量列表
+        """
+        vectors = [self.get(text) for text in texts]
+        miss_texts = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if miss_texts:
+            new_vectors = dict(zip(miss_texts, embed_fn(miss_texts)))
+            for text, vector in new_vectors.items():
+                self.put(text, vector)
+            vectors = [new_vectors[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+向量化服务客户端
+调用embedding_server.py提供的/embed接口，接口与embed_documents/embed_query保持一致，
+API进程无需加载模型即可替换本地embedding_model
+"""
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger('vector_db')
+
+
+class RemoteEmbeddings:
+    """远程向量化服务适配器"""
+
+    def __init__(self, base_url, timeout=60, batch_size=256):
+        """
+        Args:
+            base_url: 向量化服务地址，例如 http://127.0.0.1:8004
+            timeout: 单次请求超时时间（秒）
+            batch_size: 单次请求最多发送的文本条数，超过时拆分为多次请求
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.batch_size = max(1, int(batch_size))
+        self._local = threading.local()
+
+    def _session(self):
+        # requests.Session不保证线程安全，每个线程使用独立的会话以复用连接
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _post(self, texts):
+        response = self._session().post(f"{self.base_url}/embed", json={'texts': texts}, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        if body.get('status') != 'success':
+            raise RuntimeError(f"向量化服务返回失败: {body.get('msg')}")
+        embeddings = body['data']['embeddings']
+        if len(embeddings) != len(texts):
+            raise RuntimeError(f"向量化服务返回数量不一致: 请求{len(texts)}条，返回{len(embeddings)}条")
+        return embeddings
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._post(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def health(self):
+        """返回向量化服务状态（模型标识、向量维度）"""
+        response = self._session().get(f"{self.base_url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get('data')
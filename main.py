@@ -34,6 +34,13 @@ def main():
     # 配置 JSON 编码器，确保中文字符不被转义
     app.json.ensure_ascii = False
     
+    # 预加载jieba词典（序列化缓存到文件），避免首个混合检索请求承担词典加载开销
+    try:
+        from milvus.token_cache import preload_jieba
+        preload_jieba(config.get('bm25_index', {}).get('jieba_cache_file', ''))
+    except Exception as e:
+        logger.warning(f"预加载jieba词典失败: {e}")
+    
     # 初始化素材库（如果需要）
     try:
         logger.info("初始化素材库...")
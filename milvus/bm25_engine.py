@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+稀疏矩阵BM25打分引擎
+使用CSR格式的词-文档权重矩阵和词表字典，查询打分为一次稀疏点积，
+计算量只与查询词的倒排长度相关；参数与打分结果与rank_bm25.BM25Okapi一致
+"""
+from collections import Counter
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class SparseBM25:
+    """BM25Okapi的向量化实现"""
+
+    def __init__(self, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        """
+        Args:
+            corpus: 分词后的文档列表，每个文档是token列表
+            k1, b, epsilon: 与BM25Okapi含义和默认值相同
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(corpus)
+        self.vocab = {}
+
+        term_ids = []
+        doc_ids = []
+        term_freqs = []
+        doc_len = np.zeros(self.corpus_size, dtype=np.float64)
+        for doc_id, document in enumerate(corpus):
+            doc_len[doc_id] = len(document)
+            for term, freq in Counter(document).items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                term_ids.append(term_id)
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        tf = np.asarray(term_freqs, dtype=np.float64)
+        vocab_size = len(self.vocab)
+
+        self.avgdl = doc_len.sum() / self.corpus_size
+
+        # idf计算与BM25Okapi相同：负idf替换为epsilon * 平均idf
+        doc_freq = np.bincount(term_ids, minlength=vocab_size).astype(np.float64)
+        idf = np.log(self.corpus_size - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        self.average_idf = idf.sum() / vocab_size
+        idf[idf < 0] = self.epsilon * self.average_idf
+        self.idf = idf
+
+        # 预先计算每个(词, 文档)的完整BM25分量，查询时只需按词累加
+        norm = self.k1 * (1 - self.b + self.b * doc_len[doc_ids] / self.avgdl)
+        weights = idf[term_ids] * (tf * (self.k1 + 1) / (tf + norm))
+        self.matrix = csr_matrix((weights, (term_ids, doc_ids)), shape=(vocab_size, self.corpus_size))
+
+    def _sparse_scores(self, query):
+        """返回(文档下标, 分数)，只包含至少命中一个查询词的文档"""
+        counts = Counter(term for term in query if term in self.vocab)
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        rows = np.fromiter((self.vocab[term] for term in counts), dtype=np.int64, count=len(counts))
+        query_vec = csr_matrix(
+            (np.fromiter(counts.values(), dtype=np.float64, count=len(counts)),
+             (np.zeros(len(counts), dtype=np.int64), rows)),
+            shape=(1, self.matrix.shape[0])
+        )
+        scores = (query_vec @ self.matrix).tocsr()
+        return scores.indices.astype(np.int64), scores.data
+
+    def get_scores(self, query):
+        """与BM25Okapi.get_scores相同，返回所有文档的分数"""
+        scores = np.zeros(self.corpus_size, dtype=np.float64)
+        indices, values = self._sparse_scores(query)
+        scores[indices] = values
+        return scores
+
+    def top_k(self, query, k):
+        """返回分数最高的k个文档(下标数组, 分数数组)
+
+        排序结果与 sorted(range(N), key=lambda i: scores[i], reverse=True)[:k] 完全一致：
+        分数相同按文档下标升序，未命中任何查询词的文档分数为0，按下标顺序补齐
+        """
+        k = min(k, self.corpus_size)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        indices, values = self._sparse_scores(query)
+        positive = values > 0
+        pos_idx, pos_val = indices[positive], values[positive]
+
+        if len(pos_idx) > k:
+            # argpartition选出第k大的分数，再按下标补齐并列项，保证与稳定排序一致
+            kth = np.partition(pos_val, len(pos_val) - k)[len(pos_val) - k]
+            above = pos_val > kth
+            tied = np.flatnonzero(pos_val == kth)
+            tied = tied[np.argsort(pos_idx[tied], kind='stable')][:k - int(above.sum())]
+            keep = np.concatenate([np.flatnonzero(above), tied])
+            pos_idx, pos_val = pos_idx[keep], pos_val[keep]
+        order = np.lexsort((pos_idx, -pos_val))
+        top_idx = [pos_idx[order]]
+        top_val = [pos_val[order]]
+        need = k - len(pos_idx)
+
+        if need > 0:
+            # 分数为0的文档按下标顺序补齐
+            nonzero = set(indices[values != 0].tolist())
+            zero_idx = []
+            doc_id = 0
+            while len(zero_idx) < need and doc_id < self.corpus_size:
+                if doc_id not in nonzero:
+                    zero_idx.append(doc_id)
+                doc_id += 1
+            top_idx.append(np.asarray(zero_idx, dtype=np.int64))
+            top_val.append(np.zeros(len(zero_idx), dtype=np.float64))
+            need -= len(zero_idx)
+
+        if need > 0:
+            # 极小语料下idf可能为负，负分文档排在最后
+            negative = values < 0
+            neg_idx, neg_val = indices[negative], values[negative]
+            order = np.lexsort((neg_idx, -neg_val))[:need]
+            top_idx.append(neg_idx[order])
+            top_val.append(neg_val[order])
+
+        return np.concatenate(top_idx), np.concatenate(top_val)
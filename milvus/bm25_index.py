@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+BM25索引管理模块
+按(collection, 租户/组织范围)在进程内常驻BM25索引，由写入/删除接口增量维护，
+混合检索时只需要对查询本身分词；启用持久化时构建完成后立即写盘，增量修改只标记为待持久化，
+由后台线程定期（以及进程退出时）写盘
+"""
+import os
+import time
+import atexit
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from milvus.bm25_engine import SparseBM25
+
+logger = logging.getLogger('vector_db')
+
+
+class BM25ScopeIndex:
+    """单个(collection, tenant_code, org_code, filter_expr)范围内的BM25索引"""
+
+    def __init__(self, collection_name, text_field, tenant_code='', org_code='', filter_expr=''):
+        self.collection_name = collection_name
+        self.text_field = text_field
+        self.tenant_code = tenant_code or ''
+        self.org_code = org_code or ''
+        self.filter_expr = filter_expr or ''
+        self.entities = []
+        self.tokens = []
+        self.loaded = False
+        # 有未持久化的增量修改；version每次修改递增，用于判断写盘期间是否又被修改
+        self.dirty = False
+        self.version = 0
+        # 索引加载完成前收到的增量修改，加载完成后按顺序重放
+        self.pending = []
+        # 已被invalidate，不再写盘
+        self.dropped = False
+        self._ids = set()
+        self._bm25 = None
+        self._lock = threading.RLock()
+
+    def covers(self, tenant_code, org_code):
+        """判断(tenant_code, org_code)下的数据是否属于本索引范围"""
+        if self.tenant_code and self.tenant_code != (tenant_code or ''):
+            return False
+        if self.org_code and self.org_code != (org_code or ''):
+            return False
+        return True
+
+    def reset(self, entities, tokens):
+        """用完整语料重置索引，并重放加载期间收到的增量修改"""
+        with self._lock:
+            self.entities = list(entities)
+            self.tokens = list(tokens)
+            self._ids = {entity.get('id') for entity in self.entities}
+            self._bm25 = None
+            self.dirty = False
+            self.loaded = True
+            pending, self.pending = self.pending, []
+            for op, args in pending:
+                if op == 'add':
+                    self.add(*args)
+                else:
+                    self.remove(*args)
+
+    def defer(self, op, *args):
+        """索引尚未加载完成时暂存增量修改（op为'add'或'remove'）"""
+        with self._lock:
+            self.pending.append((op, args))
+
+    def add(self, entities, tokens):
+        """增量追加文档，主键已在索引中的文档（加载语料时已读到）跳过，返回追加数量"""
+        with self._lock:
+            added = 0
+            for entity, entity_tokens in zip(entities, tokens):
+                pk = entity.get('id')
+                if pk is not None and pk in self._ids:
+                    continue
+                self._ids.add(pk)
+                self.entities.append(entity)
+                self.tokens.append(entity_tokens)
+                added += 1
+            if added:
+                self._bm25 = None
+                self.dirty = True
+                self.version += 1
+            return added
+
+    def remove(self, conditions):
+        """删除满足conditions的文档，conditions为{字段名: 取值集合}，返回删除数量"""
+        with self._lock:
+            keep_entities = []
+            keep_tokens = []
+            for entity, tokens in zip(self.entities, self.tokens):
+                if all(entity.get(field) in values for field, values in conditions.items()):
+                    continue
+                keep_entities.append(entity)
+                keep_tokens.append(tokens)
+            removed = len(self.entities) - len(keep_entities)
+            if removed:
+                self.entities = keep_entities
+                self.tokens = keep_tokens
+                self._ids = {entity.get('id') for entity in keep_entities}
+                self._bm25 = None
+                self.dirty = True
+                self.version += 1
+            return removed
+
+    def search(self, query_tokens, limit):
+        """BM25检索，返回带bm25_score的实体列表"""
+        with self._lock:
+            if len(self.entities) == 0:
+                return []
+            if self._bm25 is None:
+                # 语料变化后只重建词-文档矩阵，不重新分词、不回查Milvus
+                self._bm25 = SparseBM25(self.tokens)
+            bm25 = self._bm25
+            entities = self.entities
+
+        top_indices, top_scores = bm25.top_k(query_tokens, limit)
+
+        results = []
+        for idx, score in zip(top_indices, top_scores):
+            result = entities[idx].copy()
+            result['bm25_score'] = float(score)
+            results.append(result)
+        return results
+
+    def __len__(self):
+        return len(self.entities)
+
+
+class BM25IndexManager:
+    """进程内BM25索引管理器，按LRU保留最多max_scopes个范围的索引，可选持久化到磁盘"""
+
+    def __init__(self, tokenizer, max_scopes=64, persist_dir='', batch_tokenizer=None, save_interval=60):
+        """
+        Args:
+            tokenizer: 单条文本分词函数
+            batch_tokenizer: 批量分词函数（如带分词缓存的CorpusTokenizer.tokenize_many），为None时逐条调用tokenizer
+            save_interval: 增量修改的持久化间隔（秒），小于等于0时只在进程退出和索引被淘汰时写盘
+        """
+        self.tokenizer = tokenizer
+        self.batch_tokenizer = batch_tokenizer or (lambda texts: [tokenizer(text) for text in texts])
+        self.max_scopes = max_scopes
+        self.persist_dir = persist_dir
+        self.save_interval = save_interval
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        # 串行化索引文件的写入和删除
+        self._persist_lock = threading.Lock()
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            atexit.register(self.flush)
+            if self.save_interval > 0:
+                threading.Thread(target=self._flush_loop, name='bm25-persist', daemon=True).start()
+
+    @staticmethod
+    def _scope_key(collection_name, tenant_code, org_code, filter_expr):
+        return (collection_name, tenant_code or '', org_code or '', filter_expr or '')
+
+    def _persist_path(self, key):
+        digest = hashlib.md5('\x1f'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.persist_dir, f'bm25_{digest}.pkl')
+
+    def _save(self, key, index):
+        if not self.persist_dir:
+            return
+        # 先在索引锁内取快照，写盘时不阻塞检索和增量更新
+        with index._lock:
+            if not index.loaded:
+                return
+            payload = {'key': key, 'entities': list(index.entities), 'tokens': list(index.tokens)}
+            version = index.version
+            index.dirty = False
+        path = self._persist_path(key)
+        with self._persist_lock:
+            if index.dropped:
+                return
+            try:
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except Exception:
+                import traceback
+                logger.warning(f"持久化BM25索引失败: {traceback.format_exc()}")
+                index.dirty = True
+                return
+            if index.version != version:
+                # 写盘期间索引又被修改，文件已过期，等下次持久化
+                self._remove_file(key)
+
+    def flush(self):
+        """把有未持久化修改的索引写入磁盘"""
+        with self._lock:
+            items = list(self._indexes.items())
+        for key, index in items:
+            if index.dirty:
+                self._save(key, index)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.flush()
+
+    def _mark_dirty(self, key, was_dirty):
+        """索引出现未持久化修改时删除磁盘上的旧文件，避免进程异常退出后加载过期索引"""
+        if self.persist_dir and not was_dirty:
+            with self._persist_lock:
+                self._remove_file(key)
+
+    def _load(self, key):
+        if not self.persist_dir:
+            return None
+        path = self._persist_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+            if tuple(payload.get('key', ())) != key:
+                return None
+            return payload
+        except Exception:
+            import traceback
+            logger.warning(f"加载BM25索引文件[{path}]失败: {traceback.format_exc()}")
+            return None
+
+    def _remove_file(self, key):
+        if not self.persist_dir:
+            return
+        path = self._persist_path(key)
+        if os.path.exists(path):
+            try:
+                os.unlink(path)
+            except Exception as e:
+                logger.warning(f"删除BM25索引文件[{path}]失败: {e}")
+
+    def get_loaded(self, collection_name, tenant_code, org_code, filter_expr):
+        """返回范围内已加载完成的BM25索引，未加载（或正在加载）时返回None，不触发加载"""
+        key = self._scope_key(collection_name, tenant_code, org_code, filter_expr)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None or not index.loaded:
+                return None
+            self._indexes.move_to_end(key)
+            return index
+
+    def get_index(self, collection_name, text_field, tenant_code, org_code, filter_expr, corpus_loader,
+                  count_loader=None):
+        """获取范围内的BM25索引，首次访问时从磁盘或Milvus加载
+
+        Args:
+            corpus_loader: 无参函数，返回(entities, tokenized_texts)，用于从Milvus构建索引
+            count_loader: 无参函数，返回Milvus中该范围的行数，用于校验磁盘索引是否过期
+        """
+        key = self._scope_key(collection_name, tenant_code, org_code, filter_expr)
+        evicted = []
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = BM25ScopeIndex(collection_name, text_field, tenant_code, org_code, filter_expr)
+                self._indexes[key] = index
+                while len(self._indexes) > self.max_scopes:
+                    evicted_key, evicted_index = self._indexes.popitem(last=False)
+                    evicted.append((evicted_key, evicted_index))
+                    logger.info(f"BM25索引数量超过上限{self.max_scopes}，淘汰: {evicted_key}")
+            else:
+                self._indexes.move_to_end(key)
+        for evicted_key, evicted_index in evicted:
+            if evicted_index.dirty:
+                self._save(evicted_key, evicted_index)
+
+        with index._lock:
+            if index.loaded:
+                return index
+
+            payload = self._load(key)
+            if payload is not None and count_loader is not None:
+                try:
+                    if count_loader() != len(payload['entities']):
+                        logger.info(f"磁盘BM25索引与Milvus行数不一致，重新构建: {key}")
+                        payload = None
+                except Exception as e:
+                    logger.warning(f"校验磁盘BM25索引失败，重新构建: {e}")
+                    payload = None
+            if payload is not None:
+                index.reset(payload['entities'], payload['tokens'])
+                if index.dirty:
+                    # 重放了加载前收到的增量修改，磁盘文件已过期
+                    self._mark_dirty(key, False)
+                logger.info(f"从磁盘加载BM25索引完成，共{len(index)}个文档: {key}")
+                return index
+
+            entities, tokens = corpus_loader()
+            index.reset(entities, tokens)
+            logger.info(f"BM25索引构建完成，共{len(index)}个文档: {key}")
+        self._save(key, index)
+        return index
+
+    def _indexes_of(self, collection_name):
+        with self._lock:
+            return [(key, index) for key, index in self._indexes.items() if key[0] == collection_name]
+
+    def on_insert(self, collection_name, tenant_code, org_code, entities, tokens=None):
+        """新数据写入Milvus后，追加到覆盖该租户/组织的已加载索引
+
+        Args:
+            tokens: 与entities一一对应的分词结果（入库时已分词则直接传入），为None时按需分词
+        """
+        if not entities:
+            return
+        token_cache = tokens
+        for key, index in self._indexes_of(collection_name):
+            if not index.covers(tenant_code, org_code):
+                continue
+            if index.filter_expr:
+                # 带自定义过滤条件的索引无法在本地判断新数据是否命中，直接失效
+                self.invalidate(key)
+                continue
+            if token_cache is None:
+                token_cache = self.batch_tokenizer([entity.get(index.text_field, '') or '' for entity in entities])
+            valid = [(entity, tokens) for entity, tokens in zip(entities, token_cache)
+                     if entity.get(index.text_field)]
+            # 与get_index的加载过程互斥：加载中的索引等加载完成后再追加，尚未开始加载的暂存到加载完成后重放
+            with index._lock:
+                if not index.loaded:
+                    index.defer('add', [e for e, _ in valid], [t for _, t in valid])
+                    continue
+                was_dirty = index.dirty
+                added = index.add([e for e, _ in valid], [t for _, t in valid])
+            if added:
+                self._mark_dirty(key, was_dirty)
+                logger.info(f"BM25索引增量新增{added}个文档，当前共{len(index)}个文档: {key}")
+
+    def on_delete(self, collection_name, conditions):
+        """Milvus删除数据后，从已加载索引中移除满足conditions的文档
+
+        Args:
+            conditions: {字段名: 取值集合}，所有字段同时满足才删除
+        """
+        conditions = {field: set(values) for field, values in conditions.items()}
+        for key, index in self._indexes_of(collection_name):
+            with index._lock:
+                if not index.loaded:
+                    index.defer('remove', conditions)
+                    continue
+                was_dirty = index.dirty
+                removed = index.remove(conditions)
+            if removed:
+                self._mark_dirty(key, was_dirty)
+                logger.info(f"BM25索引增量删除{removed}个文档，当前共{len(index)}个文档: {key}")
+
+    def invalidate(self, key):
+        """使单个范围的索引失效"""
+        with self._lock:
+            index = self._indexes.pop(key, None)
+        if index is not None:
+            # 阻止后台线程把已失效的索引重新写盘
+            index.dropped = True
+        with self._persist_lock:
+            self._remove_file(key)
+
+    def drop(self, collection_name=None):
+        """使某个collection（或全部）的索引失效"""
+        with self._lock:
+            keys = [key for key in self._indexes if collection_name is None or key[0] == collection_name]
+        for key in keys:
+            self.invalidate(key)
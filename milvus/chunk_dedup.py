@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+入库近重复分块检测
+每个分块按字符n-gram计算64位SimHash签名，按(collection, tenant_code, org_code)范围在进程内维护LSH索引：
+相似度阈值threshold对应最大汉明距离d = floor((1 - threshold) * 64)，签名切成d + 1段，
+两个签名的汉明距离不超过d时至少有一段完全相同（抽屉原理），只需对同段的候选计算精确汉明距离。
+只与其他文件的分块比较，同一文件内重复的分块和同名文件重新上传不算重复。
+重复分块与来源分块的对应关系记录在SQLite中（skip模式同时保存未写入分块的内容），来源分块被删除或替换前
+由调用方把每个来源的一个重复分块提升为新的来源，其余重复分块改为引用它，重复分块的内容不会随来源一起丢失
+"""
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+SIGNATURE_BITS = 64
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _splitmix64(values):
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def simhash(text, ngram=3):
+    """计算文本的64位SimHash签名（空白归一化、转小写后按字符n-gram计算）"""
+    text = _WHITESPACE.sub(' ', text or '').strip().lower()
+    if not text:
+        return 0
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    count = max(1, len(codepoints) - ngram + 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(min(ngram, len(codepoints))):
+        hashes = _splitmix64(hashes ^ codepoints[offset:offset + count])
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(count, SIGNATURE_BITS)
+    signature = np.packbits(bits.sum(axis=0, dtype=np.int64) * 2 > count)
+    return int.from_bytes(signature.tobytes(), 'big')
+
+
+def max_distance(threshold):
+    """相似度阈值对应的最大汉明距离"""
+    return max(0, min(SIGNATURE_BITS - 1, int((1 - threshold) * SIGNATURE_BITS)))
+
+
+class DedupScopeIndex:
+    """单个(collection, tenant_code, org_code)范围内的SimHash LSH索引，键为(file_name, block_id)"""
+
+    def __init__(self, collection_name, tenant_code='', org_code='', threshold=0.95):
+        self.collection_name = collection_name
+        self.tenant_code = tenant_code or ''
+        self.org_code = org_code or ''
+        self.max_distance = max_distance(threshold)
+        bands = self.max_distance + 1
+        widths = [SIGNATURE_BITS // bands + (1 if i < SIGNATURE_BITS % bands else 0) for i in range(bands)]
+        self._bands = []
+        shift = 0
+        for width in widths:
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        self.signatures = {}
+        self._buckets = [{} for _ in self._bands]
+        self.loaded = False
+        self._lock = threading.RLock()
+
+    def covers(self, tenant_code, org_code):
+        """判断(tenant_code, org_code)下的数据是否属于本索引范围，为空的条件不限制"""
+        if tenant_code and self.tenant_code != tenant_code:
+            return False
+        if org_code and self.org_code != org_code:
+            return False
+        return True
+
+    def _band_values(self, signature):
+        return [(signature >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, key, signature):
+        with self._lock:
+            if key in self.signatures:
+                self._discard(key)
+            self.signatures[key] = signature
+            for buckets, value in zip(self._buckets, self._band_values(signature)):
+                buckets.setdefault(value, set()).add(key)
+
+    def _discard(self, key):
+        signature = self.signatures.pop(key)
+        for buckets, value in zip(self._buckets, self._band_values(signature)):
+            bucket = buckets.get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del buckets[value]
+
+    def remove(self, file_names=None, keys=None):
+        """按文件名或(file_name, block_id)删除，返回删除数量"""
+        with self._lock:
+            targets = set(keys or []) & self.signatures.keys()
+            if file_names:
+                file_names = set(file_names)
+                targets.update(key for key in self.signatures if key[0] in file_names)
+            for key in targets:
+                self._discard(key)
+            return len(targets)
+
+    def find(self, signature, exclude_file=None):
+        """查找与签名最相似的其他文件的分块，返回((file_name, block_id), 相似度)，没有时返回None"""
+        with self._lock:
+            candidates = set()
+            for buckets, value in zip(self._buckets, self._band_values(signature)):
+                candidates.update(buckets.get(value, ()))
+            best = None
+            for key in candidates:
+                if key[0] == exclude_file:
+                    continue
+                distance = (self.signatures[key] ^ signature).bit_count()
+                if distance <= self.max_distance and (best is None or (distance, key) < best):
+                    best = (distance, key)
+        if best is None:
+            return None
+        return best[1], 1 - best[0] / SIGNATURE_BITS
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+def _scope_clause(tenant_code, org_code, exact=False):
+    """租户/组织条件，为空的条件不限制；exact为True时只匹配完全相同的范围"""
+    clauses, params = [], []
+    if tenant_code or exact:
+        clauses.append('tenant_code = ?')
+        params.append(tenant_code or '')
+    if org_code or exact:
+        clauses.append('org_code = ?')
+        params.append(org_code or '')
+    return clauses, params
+
+
+class DedupRefStore:
+    """基于SQLite的重复分块引用记录，键为(collection, tenant_code, org_code, file_name, block_id)，支持多线程访问
+
+    每行记录一个重复分块引用的来源分块(dup_file, dup_block)；skip模式的分块未写入collection，
+    chunk列保存其content、source、metadata，link模式的分块已写入collection，chunk列为空
+    """
+
+    _COLUMNS = ('tenant_code', 'org_code', 'file_name', 'block_id', 'dup_file', 'dup_block', 'similarity', 'chunk')
+
+    def __init__(self, path):
+        self.path = path
+        ref_dir = os.path.dirname(path)
+        if ref_dir:
+            os.makedirs(ref_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS refs ('
+            'collection TEXT NOT NULL, tenant_code TEXT NOT NULL, org_code TEXT NOT NULL, '
+            'file_name TEXT NOT NULL, block_id INTEGER NOT NULL, dup_file TEXT NOT NULL, dup_block INTEGER NOT NULL, '
+            'similarity REAL NOT NULL, chunk TEXT, '
+            'PRIMARY KEY (collection, tenant_code, org_code, file_name, block_id))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS refs_dup ON refs (collection, dup_file, dup_block)')
+        self._conn.commit()
+
+    def add(self, collection_name, tenant_code, org_code, refs):
+        """写入引用，refs为[(重复分块, (dup_file, dup_block), 相似度, 是否保存分块内容)]"""
+        if not refs:
+            return
+        rows = [(collection_name, tenant_code or '', org_code or '', chunk['file_name'], chunk['block_id'],
+                 key[0], key[1], similarity,
+                 json.dumps({'content': chunk['content'], 'source': chunk['source'], 'metadata': chunk['metadata']},
+                            ensure_ascii=False) if keep_chunk else None)
+                for chunk, key, similarity, keep_chunk in refs]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+
+    def _select(self, collection_name, tenant_code, org_code, key_column, block_column, file_names, keys, exact):
+        """按文件名或(文件名, block_id)查询，key_column/block_column为file_name/block_id或dup_file/dup_block"""
+        clauses, params = _scope_clause(tenant_code, org_code, exact)
+        conditions = []
+        for file_name in dict.fromkeys(file_names or []):
+            conditions.append((f'{key_column} = ?', [file_name]))
+        block_ids_by_file = {}
+        for file_name, block_id in keys or []:
+            block_ids_by_file.setdefault(file_name, []).append(block_id)
+        for file_name, block_ids in block_ids_by_file.items():
+            # SQLite单条语句变量数有限，分批查询
+            for start in range(0, len(block_ids), 500):
+                batch = block_ids[start:start + 500]
+                conditions.append((f'{key_column} = ? AND {block_column} IN ({",".join("?" * len(batch))})',
+                                   [file_name] + batch))
+        for condition, condition_params in conditions:
+            yield ' AND '.join(['collection = ?'] + clauses + [condition]), [collection_name] + params + condition_params
+
+    def dependents(self, collection_name, tenant_code, org_code, file_names=None, keys=None, exact=False):
+        """引用了给定文件（或分块）的重复分块记录，tenant_code/org_code为空且exact为False时不限制范围"""
+        result = []
+        with self._lock:
+            for where, params in self._select(collection_name, tenant_code, org_code, 'dup_file', 'dup_block',
+                                              file_names, keys, exact):
+                for row in self._conn.execute(f'SELECT {", ".join(self._COLUMNS)} FROM refs WHERE {where}', params):
+                    ref = dict(zip(self._COLUMNS, row))
+                    ref['chunk'] = json.loads(ref['chunk']) if ref['chunk'] is not None else None
+                    result.append(ref)
+        return result
+
+    def remove(self, collection_name, tenant_code, org_code, file_names=None, keys=None, exact=False,
+               skipped_only=False):
+        """删除给定文件（或分块）作为重复分块的记录，tenant_code/org_code为空且exact为False时不限制范围
+
+        Args:
+            skipped_only: 只删除skip模式（未写入collection）的记录
+        """
+        removed = 0
+        with self._lock:
+            for where, params in self._select(collection_name, tenant_code, org_code, 'file_name', 'block_id',
+                                              file_names, keys, exact):
+                if skipped_only:
+                    where += ' AND chunk IS NOT NULL'
+                removed += self._conn.execute(f'DELETE FROM refs WHERE {where}', params).rowcount
+            self._conn.commit()
+        return removed
+
+    def remove_scope(self, collection_name, tenant_code, org_code):
+        """删除租户/组织范围内的全部记录，tenant_code/org_code为空时不限制范围"""
+        clauses, params = _scope_clause(tenant_code, org_code)
+        with self._lock:
+            removed = self._conn.execute(f'DELETE FROM refs WHERE {" AND ".join(["collection = ?"] + clauses)}',
+                                         [collection_name] + params).rowcount
+            self._conn.commit()
+        return removed
+
+    def repoint(self, collection_name, tenant_code, org_code, old_key, new_key):
+        """引用old_key的记录改为引用new_key"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE refs SET dup_file = ?, dup_block = ? WHERE collection = ? AND tenant_code = ? '
+                'AND org_code = ? AND dup_file = ? AND dup_block = ?',
+                [new_key[0], new_key[1], collection_name, tenant_code or '', org_code or '', old_key[0], old_key[1]])
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM refs').fetchone()[0]
+
+
+class ChunkDedupManager:
+    """进程内近重复分块检测，按LRU保留最多max_scopes个范围的索引，首次访问某个范围时从collection加载签名"""
+
+    def __init__(self, threshold=0.95, ngram=3, max_scopes=64, ref_store=None):
+        """
+        Args:
+            ref_store: DedupRefStore，记录重复分块与来源分块的对应关系
+        """
+        self.threshold = threshold
+        self.ngram = ngram
+        self.max_scopes = max_scopes
+        self.ref_store = ref_store
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+
+    def signature(self, text):
+        return simhash(text, self.ngram)
+
+    def get_scope(self, collection_name, tenant_code, org_code, row_loader):
+        """获取范围内的索引，首次访问时加载
+
+        Args:
+            row_loader: 无参函数，逐批返回该范围已存储的分块(字典列表，包含file_name、block_id、content、metadata)，
+                        metadata中带duplicate_of的分块是已链接的重复分块，不加入索引
+        """
+        key = (collection_name, tenant_code or '', org_code or '')
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = DedupScopeIndex(collection_name, tenant_code, org_code, self.threshold)
+                self._indexes[key] = index
+                while len(self._indexes) > self.max_scopes:
+                    evicted_key, _ = self._indexes.popitem(last=False)
+                    logger.info(f"近重复检测索引数量超过上限{self.max_scopes}，淘汰: {evicted_key}")
+            else:
+                self._indexes.move_to_end(key)
+
+        with index._lock:
+            if not index.loaded:
+                for rows in row_loader():
+                    for row in rows:
+                        metadata = row.get('metadata')
+                        if isinstance(metadata, dict) and 'duplicate_of' in metadata:
+                            continue
+                        index.add((row['file_name'], row['block_id']), self.signature(row.get('content')))
+                index.loaded = True
+                logger.info(f"近重复检测索引加载完成，共{len(index)}个分块: {key}")
+        return index
+
+    def filter_chunks(self, index, chunks, on_duplicate):
+        """逐个检查分块：非重复的分块加入索引并产出，重复的分块交给on_duplicate(chunk, (file_name, block_id), 相似度)"""
+        for chunk in chunks:
+            signature = self.signature(chunk['content'])
+            match = index.find(signature, exclude_file=chunk['file_name'])
+            with self._stats_lock:
+                self._checked += 1
+                if match is not None:
+                    self._duplicates += 1
+            if match is None:
+                index.add((chunk['file_name'], chunk['block_id']), signature)
+                yield chunk
+            else:
+                on_duplicate(chunk, *match)
+
+    def register(self, collection_name, tenant_code, org_code, key, content):
+        """分块成为新的来源分块后加入已加载的索引（未加载的范围首次访问时从collection读取）"""
+        with self._lock:
+            index = self._indexes.get((collection_name, tenant_code or '', org_code or ''))
+        if index is not None and index.loaded:
+            index.add(key, self.signature(content))
+
+    def on_delete(self, collection_name, tenant_code, org_code, file_names=None, keys=None):
+        """collection删除数据后同步删除已加载索引中的分块，tenant_code/org_code为空时不限制范围"""
+        for index_key, index in self._indexes_of(collection_name):
+            if index.loaded and index.covers(tenant_code, org_code):
+                removed = index.remove(file_names=file_names, keys=keys)
+                if removed:
+                    logger.info(f"近重复检测索引删除{removed}个分块，当前共{len(index)}个分块: {index_key}")
+
+    def _indexes_of(self, collection_name):
+        with self._lock:
+            return [(key, index) for key, index in self._indexes.items() if key[0] == collection_name]
+
+    def invalidate(self, collection_name=None, tenant_code=None, org_code=None):
+        """使匹配的范围失效，下次访问时重新加载"""
+        with self._lock:
+            for key in [key for key, index in self._indexes.items()
+                        if (collection_name is None or key[0] == collection_name)
+                        and index.covers(tenant_code, org_code)]:
+                del self._indexes[key]
+
+    def stats(self):
+        with self._lock:
+            scopes = len(self._indexes)
+            signatures = sum(len(index) for index in self._indexes.values())
+        with self._stats_lock:
+            checked, duplicates = self._checked, self._duplicates
+        return {'threshold': self.threshold, 'max_distance': max_distance(self.threshold), 'scopes': scopes,
+                'signatures': signatures, 'references': self.ref_store.count() if self.ref_store else 0,
+                'checked_chunks': checked, 'duplicate_chunks': duplicates,
+                'dedup_ratio': round(duplicates / checked, 4) if checked else 0.0}
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Milvus连接与collection句柄注册表
+进程内每个数据库只建立一次连接，缓存collection句柄、字段列表、是否存在及加载状态，
+检索请求无需再重复connect/list_collections/describe
+"""
+import logging
+import threading
+
+from pymilvus import connections, utility, Collection, DataType, db
+from pymilvus.client.types import LoadState
+
+logger = logging.getLogger('vector_db')
+
+
+class MilvusCollectionRegistry:
+    """进程级Milvus连接与collection句柄缓存"""
+
+    def __init__(self, milvus_config):
+        self.milvus_config = milvus_config
+        self._lock = threading.RLock()
+        self._connected = set()
+        self._collection_names = {}
+        self._collections = {}
+        self._fields = {}
+        self._sparse_fields = {}
+        self._partition_keys = {}
+        self._loaded = set()
+
+    @staticmethod
+    def alias_of(db_name=None):
+        """每个数据库使用独立的连接别名"""
+        return f"vector_db_{db_name}" if db_name else "vector_db_default"
+
+    def connect(self, db_name=None):
+        """连接到指定数据库（每个别名只连接一次），返回连接别名"""
+        alias = self.alias_of(db_name)
+        if alias in self._connected:
+            return alias
+        with self._lock:
+            if alias not in self._connected:
+                # 配置了uri时（如Milvus Lite本地文件）优先使用uri
+                if self.milvus_config.get('uri'):
+                    params = {'uri': self.milvus_config['uri']}
+                else:
+                    params = {'host': self.milvus_config['host'], 'port': self.milvus_config['port']}
+                if db_name:
+                    params['db_name'] = db_name
+                connections.connect(alias=alias, **params)
+                self._connected.add(alias)
+                logger.info(f"已建立Milvus连接，alias={alias}")
+        return alias
+
+    def ensure_database(self, db_name):
+        """数据库不存在时创建，返回是否新建"""
+        alias = self.connect()
+        if db_name in db.list_database(using=alias):
+            return False
+        db.create_database(db_name, using=alias)
+        return True
+
+    def list_collections(self, db_name=None):
+        """返回数据库中的collection名称集合（缓存）"""
+        alias = self.connect(db_name)
+        names = self._collection_names.get(alias)
+        if names is None:
+            with self._lock:
+                names = self._collection_names.get(alias)
+                if names is None:
+                    names = set(utility.list_collections(using=alias))
+                    self._collection_names[alias] = names
+        return names
+
+    def has_collection(self, db_name, collection_name):
+        return collection_name in self.list_collections(db_name)
+
+    def get_collection(self, db_name, collection_name, ensure_loaded=True):
+        """获取collection句柄，collection不存在时返回None
+
+        Args:
+            ensure_loaded: 是否确保collection已加载到内存（检索、按表达式删除需要）
+        """
+        if not self.has_collection(db_name, collection_name):
+            return None
+        alias = self.connect(db_name)
+        key = (alias, collection_name)
+        collection = self._collections.get(key)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(key)
+                if collection is None:
+                    collection = Collection(collection_name, using=alias)
+                    self._fields[key] = [f.name for f in collection.schema.fields]
+                    self._sparse_fields[key] = [f.name for f in collection.schema.fields
+                                                if f.dtype == DataType.SPARSE_FLOAT_VECTOR]
+                    partition_key_field = collection.schema.partition_key_field
+                    self._partition_keys[key] = partition_key_field.name if partition_key_field else None
+                    self._collections[key] = collection
+        if ensure_loaded and key not in self._loaded:
+            with self._lock:
+                if key not in self._loaded:
+                    if utility.load_state(collection_name, using=alias) != LoadState.Loaded:
+                        logger.info(f"collection[{collection_name}]未加载，开始加载")
+                        collection.load()
+                    self._loaded.add(key)
+        return collection
+
+    def open_collection(self, db_name, collection_name):
+        """获取不经缓存的collection句柄（不加载），用于初始化时检查schema和索引"""
+        return Collection(collection_name, using=self.connect(db_name))
+
+    def create_collection(self, db_name, collection_name, schema, **kwargs):
+        """按schema新建collection，kwargs为Collection的额外参数（如num_partitions）"""
+        return Collection(collection_name, schema=schema, using=self.connect(db_name), **kwargs)
+
+    def field_names(self, db_name, collection_name, exclude=('embedding', 'embedding_coarse')):
+        """返回collection的字段列表（缓存），默认排除向量字段，稀疏向量字段始终排除"""
+        key = (self.alias_of(db_name), collection_name)
+        if key not in self._fields:
+            self.get_collection(db_name, collection_name, ensure_loaded=False)
+        sparse_fields = self._sparse_fields.get(key, [])
+        return [f for f in self._fields.get(key, []) if f not in exclude and f not in sparse_fields]
+
+    def sparse_field(self, db_name, collection_name):
+        """返回collection的稀疏向量字段名（缓存），没有时返回None"""
+        key = (self.alias_of(db_name), collection_name)
+        if key not in self._fields:
+            self.get_collection(db_name, collection_name, ensure_loaded=False)
+        sparse_fields = self._sparse_fields.get(key, [])
+        return sparse_fields[0] if sparse_fields else None
+
+    def partition_key_field(self, db_name, collection_name):
+        """返回collection的partition key字段名（缓存），没有时返回None"""
+        key = (self.alias_of(db_name), collection_name)
+        if key not in self._fields:
+            self.get_collection(db_name, collection_name, ensure_loaded=False)
+        return self._partition_keys.get(key)
+
+    def invalidate(self, db_name=None, collection_name=None):
+        """清除缓存的collection列表、句柄、字段及加载状态
+
+        Args:
+            db_name: 为None时清除所有数据库的缓存
+            collection_name: 为None时清除该数据库下所有collection的缓存
+        """
+        with self._lock:
+            aliases = {self.alias_of(db_name)} if db_name is not None else set(self._collection_names) | {
+                key[0] for key in self._collections}
+            for alias in aliases:
+                self._collection_names.pop(alias, None)
+            for cache in (self._collections, self._fields, self._sparse_fields, self._partition_keys):
+                for key in [k for k in cache if k[0] in aliases and collection_name in (None, k[1])]:
+                    cache.pop(key, None)
+            self._loaded = {k for k in self._loaded if not (k[0] in aliases and collection_name in (None, k[1]))}
+        logger.info(f"已清除Milvus collection缓存，db_name={db_name}, collection_name={collection_name}")
+
+    def reconnect(self, db_name=None):
+        """断开并重建连接，同时清除相关缓存"""
+        with self._lock:
+            aliases = [self.alias_of(db_name)] if db_name is not None else list(self._connected)
+            for alias in aliases:
+                try:
+                    connections.disconnect(alias)
+                except Exception as e:
+                    logger.warning(f"断开Milvus连接[{alias}]失败: {e}")
+                self._connected.discard(alias)
+            self.invalidate(db_name)
+        if db_name is not None:
+            self.connect(db_name)
+        logger.info(f"已重建Milvus连接，db_name={db_name}")
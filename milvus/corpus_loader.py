@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+分页语料加载模块
+基于pymilvus的query_iterator按批次流式读取collection数据，
+不受单次query最多16384行的限制，峰值内存只与批次大小相关
+"""
+import logging
+
+logger = logging.getLogger('vector_db')
+
+# Milvus单批次最多返回16384行
+MAX_BATCH_SIZE = 16384
+
+
+def iter_collection_batches(collection, expr='', output_fields=None, batch_size=1000, limit=-1):
+    """按批次迭代读取collection中满足expr的数据
+
+    Args:
+        collection: pymilvus Collection对象
+        expr: 过滤表达式，为空时读取全部数据
+        output_fields: 输出字段列表
+        batch_size: 每批读取的行数
+        limit: 最多读取的总行数，-1表示不限制
+
+    Yields:
+        每批数据，为字典列表
+    """
+    batch_size = max(1, min(int(batch_size), MAX_BATCH_SIZE))
+    iterator = collection.query_iterator(
+        batch_size=batch_size,
+        limit=limit,
+        expr=expr if expr else 'id >= 0',
+        output_fields=output_fields
+    )
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            yield batch
+    finally:
+        iterator.close()
@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""
+向量索引参数评测工具
+从QA/DOC collection采样向量（或生成合成数据），在临时collection上依次构建FLAT、HNSW、IVF_FLAT、IVF_SQ8索引
+并扫描构建/检索参数，以numpy精确余弦检索（与FLAT等价）为基准计算recall@k，同时统计单条查询的p50/p99延迟，
+输出满足召回率目标且p99最低的index_params/search_params配置块
+
+命令行用法:
+    python -m milvus.index_benchmark run [--type DOC|QA] [--sample 20000] [--queries 200] [--k 10]
+                                        [--recall-target 0.95] [--index-types HNSW,IVF_FLAT] [--output 报告.json]
+    python -m milvus.index_benchmark run --synthetic 50000 [--dim 1024]
+    python -m milvus.index_benchmark dtype [--type DOC|QA] [--sample 20000] [--oversample 4] [--max-recall-drop 0.02]
+    python -m milvus.index_benchmark coarse [--type DOC|QA] [--sample 20000] [--methods pca,random]
+                                           [--coarse-dims 128,256] [--candidates 50,100,200] [--max-recall-drop 0.02]
+    python -m milvus.index_benchmark backend [--type DOC|QA] [--sample 20000] [--tenants 8]
+
+把输出的配置块写入config.json后，将index_rebuild.mode设为online并调用初始化接口（或执行
+python -m milvus.migrate_tool reindex），即可在不中断检索的情况下完成索引切换
+
+dtype命令评估向量存储类型（FLOAT/FLOAT16/BFLOAT16/INT8）的精度损失：以float32精确检索为基准，
+计算各类型存储后精确检索（与FLAT等价，不含索引近似误差）及float32精排后的recall@k和每条向量占用的内存，
+输出满足召回率容差且内存最小的vector_storage配置块，确认后执行 python -m milvus.migrate_tool vector_dtype 迁移
+
+coarse命令对比单级检索（完整向量）与两级检索（低维向量召回候选后用完整向量精排）的recall@k和p50/p99延迟，
+延迟包含精排耗时；输出满足召回率容差且p99最低的coarse_search配置块，确认后执行 python -m milvus.migrate_tool coarse
+
+backend命令在同一语料上对比Milvus与进程内后端（vector_backend=local）：写入耗时、按config['index_params']构建索引的耗时、
+不过滤及按单个租户过滤（向量按行号轮流分配给--tenants个租户）检索的recall@k和p50/p99延迟
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import logging
+import argparse
+import traceback
+
+import numpy as np
+from pymilvus import FieldSchema, CollectionSchema, DataType, Collection, utility
+
+from milvus.collection_registry import MilvusCollectionRegistry
+from milvus.corpus_loader import iter_collection_batches
+from milvus.vector_storage import (VECTOR_DTYPES, BYTES_PER_DIM, mode_of, decode_vector, simulate_storage,
+                                   cosine_scores, rescore_hits)
+from milvus.projection import Projection, COARSE_FIELD
+from milvus.local_backend import LocalCollection
+
+logger = logging.getLogger('vector_db')
+
+BENCH_COLLECTION = 'index_benchmark__tmp'
+
+# 参数扫描范围：(索引类型, 构建参数列表, 检索参数列表)
+SWEEP = [
+    ('FLAT', [{}], [{}]),
+    ('HNSW', [{'M': 16, 'efConstruction': 200}, {'M': 32, 'efConstruction': 200}],
+     [{'ef': 32}, {'ef': 64}, {'ef': 128}, {'ef': 256}]),
+    ('IVF_FLAT', [{'nlist': 128}, {'nlist': 1024}], [{'nprobe': 8}, {'nprobe': 16}, {'nprobe': 32}, {'nprobe': 64}]),
+    ('IVF_SQ8', [{'nlist': 128}, {'nlist': 1024}], [{'nprobe': 8}, {'nprobe': 16}, {'nprobe': 32}, {'nprobe': 64}]),
+]
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+def sample_collection_vectors(registry, db_name, collection_name, sample, batch_size=1000):
+    """从collection中读取最多sample条向量"""
+    collection = registry.get_collection(db_name, collection_name)
+    if collection is None:
+        raise ValueError(f"collection[{collection_name}]不存在")
+    mode = mode_of(next(f.dtype for f in collection.schema.fields if f.name == 'embedding'))
+    vectors = []
+    for rows in iter_collection_batches(collection, output_fields=['embedding'], batch_size=batch_size, limit=sample):
+        vectors.extend(decode_vector(row['embedding'], mode) for row in rows)
+    if not vectors:
+        raise ValueError(f"collection[{collection_name}]中没有数据")
+    return _normalize(np.asarray(vectors, dtype=np.float32))
+
+
+def synthetic_vectors(count, dim, clusters=64, seed=42):
+    """生成带聚类结构的归一化向量，近似真实语义向量的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return _normalize(vectors)
+
+
+def exact_top_k(base, queries, k):
+    """精确余弦检索，返回每个查询的top-k下标（向量均已归一化，内积即余弦相似度）"""
+    scores = queries @ base.T
+    top = np.argpartition(-scores, kth=min(k, base.shape[0] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _create_bench_collection(alias, base, batch_size=1000, coarse=None):
+    """创建评测用的临时collection，coarse不为None时增加低维向量字段"""
+    if utility.has_collection(BENCH_COLLECTION, using=alias):
+        utility.drop_collection(BENCH_COLLECTION, using=alias)
+    fields = [
+        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=base.shape[1])
+    ]
+    if coarse is not None:
+        fields.append(FieldSchema(name=COARSE_FIELD, dtype=DataType.FLOAT_VECTOR, dim=coarse.shape[1]))
+    collection = Collection(BENCH_COLLECTION, schema=CollectionSchema(fields=fields), using=alias)
+    for start in range(0, base.shape[0], batch_size):
+        end = min(start + batch_size, base.shape[0])
+        data = [list(range(start, end)), base[start:end].tolist()]
+        if coarse is not None:
+            data.append(coarse[start:end].tolist())
+        collection.insert(data)
+    collection.flush()
+    return collection
+
+
+def _build_index(collection, index_params, field_names=('embedding',)):
+    collection.release()
+    for index in list(collection.indexes):
+        collection.drop_index(index_name=index.index_name)
+    start = time.perf_counter()
+    for field_name in field_names:
+        collection.create_index(field_name=field_name, index_params=index_params)
+    collection.load()
+    return time.perf_counter() - start
+
+
+def _measure(collection, queries, ground_truth, k, search_params, expr=None):
+    """逐条查询，返回recall@k和延迟分位数（毫秒）"""
+    collection.search(data=[queries[0].tolist()], anns_field='embedding', param=search_params, limit=k,
+                      expr=expr)  # 预热
+    latencies = []
+    hit_count = 0
+    for query, truth in zip(queries, ground_truth):
+        start = time.perf_counter()
+        res = collection.search(data=[query.tolist()], anns_field='embedding', param=search_params, limit=k,
+                                expr=expr)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hit_count += len(set(res[0].ids) & set(truth.tolist()))
+    latencies = np.asarray(latencies)
+    return {
+        'recall': round(hit_count / (len(queries) * k), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3)
+    }
+
+
+def run_benchmark(alias, base, queries, k=10, metric_type='COSINE', index_types=None, batch_size=1000):
+    """在临时collection上执行参数扫描，返回每组参数的评测结果"""
+    ground_truth = exact_top_k(base, queries, k)
+    collection = _create_bench_collection(alias, base, batch_size)
+    results = []
+    try:
+        for index_type, build_params_list, search_params_list in SWEEP:
+            if index_types and index_type not in index_types:
+                continue
+            for build_params in build_params_list:
+                index_params = {'index_type': index_type, 'metric_type': metric_type, 'params': build_params}
+                try:
+                    build_seconds = _build_index(collection, index_params)
+                except Exception as e:
+                    logger.warning(f"索引{index_params}构建失败，跳过: {e}")
+                    results.append({'index_params': index_params, 'error': str(e)})
+                    continue
+                for params in search_params_list:
+                    search_params = {'metric_type': metric_type, 'params': params}
+                    result = {'index_params': index_params, 'search_params': search_params,
+                              'build_seconds': round(build_seconds, 3)}
+                    result.update(_measure(collection, queries, ground_truth, k, search_params))
+                    logger.info(f"索引评测: {result}")
+                    results.append(result)
+    finally:
+        utility.drop_collection(BENCH_COLLECTION, using=alias)
+    return results
+
+
+def recommend(results, recall_target):
+    """在recall达到目标的配置中选p99最低的；都未达到时选recall最高的"""
+    measured = [r for r in results if 'error' not in r]
+    if not measured:
+        return None
+    qualified = [r for r in measured if r['recall'] >= recall_target]
+    if qualified:
+        return min(qualified, key=lambda r: (r['p99_ms'], -r['recall']))
+    return max(measured, key=lambda r: (r['recall'], -r['p99_ms']))
+
+
+def config_block(result):
+    """把评测结果转换为可直接写入config.json的配置块"""
+    index_type = result['index_params']['index_type']
+    return {
+        'index_params': result['index_params'],
+        'search_params': result['search_params'],
+        'search_params_by_index': {index_type: result['search_params']['params']}
+    }
+
+
+def _measure_two_tier(collection, queries, ground_truth, k, projection, candidates, search_params):
+    """两级检索：低维向量召回candidates条候选，取回完整向量后精排，返回recall@k和延迟分位数（毫秒）"""
+    coarse_queries = projection.project(queries)
+    collection.search(data=[coarse_queries[0].tolist()], anns_field=COARSE_FIELD, param=search_params,
+                      limit=candidates, output_fields=['embedding'])  # 预热
+    latencies = []
+    hit_count = 0
+    for query, coarse_query, truth in zip(queries, coarse_queries, ground_truth):
+        start = time.perf_counter()
+        res = collection.search(data=[coarse_query.tolist()], anns_field=COARSE_FIELD, param=search_params,
+                                limit=candidates, output_fields=['embedding'])
+        top = rescore_hits(res[0], query, 'FLOAT', k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hit_count += len({hit.id for hit in top} & set(truth.tolist()))
+    latencies = np.asarray(latencies)
+    return {
+        'recall': round(hit_count / (len(queries) * k), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3)
+    }
+
+
+def run_coarse_benchmark(alias, base, queries, k, index_params, search_params, methods=('pca', 'random'),
+                         dims=(128, 256), candidates_list=(50, 100, 200), batch_size=1000):
+    """对比单级检索与各投影方式/维度/候选数下两级检索的recall@k和延迟
+
+    单级检索的结果tier为single，两级检索为two_tier；投影在样本（不含查询）上拟合
+    """
+    ground_truth = exact_top_k(base, queries, k)
+    results = []
+    try:
+        collection = _create_bench_collection(alias, base, batch_size)
+        _build_index(collection, index_params)
+        result = {'tier': 'single', 'dim': int(base.shape[1])}
+        result.update(_measure(collection, queries, ground_truth, k, search_params))
+        logger.info(f"两级检索评测: {result}")
+        results.append(result)
+        for method in methods:
+            for dim in dims:
+                projection = Projection.random(base.shape[1], dim) if method == 'random' else Projection.fit(base, dim)
+                collection = _create_bench_collection(alias, base, batch_size, coarse=projection.project(base))
+                _build_index(collection, index_params, field_names=('embedding', COARSE_FIELD))
+                for candidates in candidates_list:
+                    result = {'tier': 'two_tier', 'method': method, 'dim': dim, 'candidates': candidates,
+                              'explained_variance': projection.explained_variance}
+                    result.update(_measure_two_tier(collection, queries, ground_truth, k, projection,
+                                                    min(candidates, base.shape[0]), search_params))
+                    logger.info(f"两级检索评测: {result}")
+                    results.append(result)
+    finally:
+        if utility.has_collection(BENCH_COLLECTION, using=alias):
+            utility.drop_collection(BENCH_COLLECTION, using=alias)
+    return results
+
+
+def recommend_coarse(results, max_recall_drop):
+    """在recall不低于单级检索recall - max_recall_drop的两级检索配置中选p99最低的，不如单级检索快时返回None"""
+    single = next(r for r in results if r['tier'] == 'single')
+    qualified = [r for r in results if r['tier'] == 'two_tier' and r['recall'] >= single['recall'] - max_recall_drop]
+    if not qualified:
+        return None
+    best = min(qualified, key=lambda r: (r['p99_ms'], -r['recall']))
+    return best if best['p99_ms'] < single['p99_ms'] else None
+
+
+def _backend_bench_schema(dim):
+    return CollectionSchema(fields=[
+        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=64),
+        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=dim)
+    ])
+
+
+def _measure_backend(collection, base, queries, k, index_params, search_params, tenants, ground_truth, tenant_truth,
+                     batch_size):
+    """写入并构建索引，返回写入耗时、索引构建耗时及不过滤/按租户t0过滤检索的recall@k和延迟"""
+    start = time.perf_counter()
+    for begin in range(0, base.shape[0], batch_size):
+        end = min(begin + batch_size, base.shape[0])
+        collection.insert([list(range(begin, end)), [f"t{i % tenants}" for i in range(begin, end)],
+                           base[begin:end].tolist()])
+    collection.flush()
+    result = {'insert_s': round(time.perf_counter() - start, 3),
+              'build_s': round(_build_index(collection, index_params), 3)}
+    result.update(_measure(collection, queries, ground_truth, k, search_params))
+    filtered = _measure(collection, queries, tenant_truth, k, search_params, expr="tenant_code == 't0'")
+    result.update({f'filtered_{key}': value for key, value in filtered.items()})
+    return result
+
+
+def run_backend_benchmark(alias, base, queries, k, index_params, search_params, tenants=8, batch_size=1000,
+                          local_config=None):
+    """在同一语料上对比Milvus与进程内后端的写入、索引构建及检索性能
+
+    向量按行号轮流分配给tenants个租户，租户t0的数据为行号能被tenants整除的行
+    """
+    local_config = local_config or {}
+    ground_truth = exact_top_k(base, queries, k)
+    tenant_rows = np.arange(0, base.shape[0], tenants)
+    tenant_truth = tenant_rows[exact_top_k(base[tenant_rows], queries, k)]
+    schema = _backend_bench_schema(base.shape[1])
+    results = []
+    try:
+        if utility.has_collection(BENCH_COLLECTION, using=alias):
+            utility.drop_collection(BENCH_COLLECTION, using=alias)
+        collection = Collection(BENCH_COLLECTION, schema=schema, using=alias)
+        result = {'backend': 'milvus'}
+        result.update(_measure_backend(collection, base, queries, k, index_params, search_params, tenants,
+                                       ground_truth, tenant_truth, batch_size))
+        logger.info(f"后端评测: {result}")
+        results.append(result)
+    finally:
+        if utility.has_collection(BENCH_COLLECTION, using=alias):
+            utility.drop_collection(BENCH_COLLECTION, using=alias)
+    tmp_dir = tempfile.mkdtemp(prefix='local_backend_bench_')
+    try:
+        collection = LocalCollection.create(os.path.join(tmp_dir, BENCH_COLLECTION), BENCH_COLLECTION, schema,
+                                            brute_force_threshold=local_config.get('brute_force_threshold', 20000),
+                                            compact_ratio=local_config.get('compact_ratio', 0.3))
+        result = {'backend': 'local'}
+        result.update(_measure_backend(collection, base, queries, k, index_params, search_params, tenants,
+                                       ground_truth, tenant_truth, batch_size))
+        logger.info(f"后端评测: {result}")
+        results.append(result)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def compare_vector_dtypes(base, queries, k=10, oversample=4, modes=None):
+    """评估各向量存储类型的recall@k（基准为float32精确检索）
+
+    查询向量与存储向量同精度检索（Milvus中二者类型一致），召回k * oversample条候选后用float32查询向量精排
+    """
+    ground_truth = exact_top_k(base, queries, k)
+    dim = base.shape[1]
+    candidates = min(k * oversample, base.shape[0])
+    results = []
+    for mode in modes or list(VECTOR_DTYPES):
+        stored = simulate_storage(base, mode)
+        top = exact_top_k(_normalize(stored), _normalize(simulate_storage(queries, mode)), candidates)
+        rescored = [cand[np.argsort(-cosine_scores(query, stored[cand]), kind='stable')[:k]]
+                    for query, cand in zip(queries, top)]
+        hits = sum(len(set(t[:k].tolist()) & set(g.tolist())) for t, g in zip(top, ground_truth))
+        rescored_hits = sum(len(set(t.tolist()) & set(g.tolist())) for t, g in zip(rescored, ground_truth))
+        result = {
+            'dtype': mode,
+            'bytes_per_vector': dim * BYTES_PER_DIM[mode],
+            'memory_ratio': round(BYTES_PER_DIM['FLOAT'] / BYTES_PER_DIM[mode], 2),
+            'recall': round(hits / (len(queries) * k), 4),
+            'recall_rescored': round(rescored_hits / (len(queries) * k), 4)
+        }
+        logger.info(f"向量存储类型评测: {result}")
+        results.append(result)
+    return results
+
+
+def recommend_dtype(results, max_recall_drop):
+    """在recall（取精排前后的较高值）下降不超过max_recall_drop的类型中选内存最小的"""
+    qualified = [r for r in results if max(r['recall'], r['recall_rescored']) >= 1 - max_recall_drop]
+    if not qualified:
+        return None
+    return min(qualified, key=lambda r: (r['bytes_per_vector'], -max(r['recall'], r['recall_rescored'])))
+
+
+def _print_table(results):
+    print(f"{'index_type':<10} {'build_params':<34} {'search_params':<16} {'recall':>7} {'p50_ms':>8} {'p99_ms':>8}")
+    for r in results:
+        index_params = r['index_params']
+        if 'error' in r:
+            print(f"{index_params['index_type']:<10} {json.dumps(index_params['params']):<34} 构建失败: {r['error']}")
+            continue
+        print(f"{index_params['index_type']:<10} {json.dumps(index_params['params']):<34} "
+              f"{json.dumps(r['search_params']['params']):<16} {r['recall']:>7.4f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+
+
+def _config_search_params(config):
+    """与miluvs_helper.vector_search_params相同：按当前索引类型取search_params_by_index，没有时用search_params"""
+    index_params = config['index_params']
+    params = config.get('search_params_by_index', {}).get(index_params.get('index_type'))
+    return {'metric_type': index_params.get('metric_type', 'COSINE'), 'params': dict(params)} \
+        if params is not None else config['search_params']
+
+
+def _run_backend_report(args, config, base, queries):
+    results = run_backend_benchmark(args.alias, base, queries, args.k, config['index_params'],
+                                    _config_search_params(config), tenants=args.tenants,
+                                    batch_size=config.get('corpus_loader', {}).get('batch_size', 1000),
+                                    local_config=config.get('local_backend', {}))
+    print(f"索引参数: {config['index_params']}")
+    print(f"{'backend':<8} {'insert_s':>9} {'build_s':>8} {'recall':>7} {'p50_ms':>8} {'p99_ms':>8} "
+          f"{'t0_recall':>9} {'t0_p50':>8} {'t0_p99':>8}")
+    for r in results:
+        print(f"{r['backend']:<8} {r['insert_s']:>9.3f} {r['build_s']:>8.3f} {r['recall']:>7.4f} {r['p50_ms']:>8.3f} "
+              f"{r['p99_ms']:>8.3f} {r['filtered_recall']:>9.4f} {r['filtered_p50_ms']:>8.3f} "
+              f"{r['filtered_p99_ms']:>8.3f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'sample': int(base.shape[0]), 'queries': int(queries.shape[0]), 'k': args.k,
+                       'tenants': args.tenants, 'index_params': config['index_params'], 'results': results},
+                      f, ensure_ascii=False, indent=2)
+    return 0
+
+
+def _run_coarse_report(args, config, base, queries):
+    index_params = config['index_params']
+    search_params = _config_search_params(config)
+    results = run_coarse_benchmark(
+        args.alias, base, queries, args.k, index_params, search_params,
+        methods=[m.strip() for m in args.methods.split(',') if m.strip()],
+        dims=[int(d) for d in args.coarse_dims.split(',') if d.strip()],
+        candidates_list=[int(c) for c in args.candidates.split(',') if c.strip()],
+        batch_size=config.get('corpus_loader', {}).get('batch_size', 1000))
+    print(f"{'tier':<9} {'method':<7} {'dim':>5} {'candidates':>10} {'recall':>7} {'p50_ms':>8} {'p99_ms':>8}")
+    for r in results:
+        print(f"{r['tier']:<9} {r.get('method', '-'):<7} {r['dim']:>5} {r.get('candidates', '-'):>10} "
+              f"{r['recall']:>7.4f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+    best = recommend_coarse(results, args.max_recall_drop)
+    report = {'sample': int(base.shape[0]), 'queries': int(queries.shape[0]), 'k': args.k,
+              'max_recall_drop': args.max_recall_drop, 'results': results,
+              'recommended': {'coarse_search': {'enabled': True, 'method': best['method'], 'dim': best['dim'],
+                                                'candidates': best['candidates']}} if best else None}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if best is None:
+        print(f"没有两级检索配置在recall下降不超过{args.max_recall_drop}的前提下比单级检索更快，建议保持单级检索")
+        return 0
+    print("推荐配置（写入config.json后执行 python -m milvus.migrate_tool coarse 拟合投影并迁移）:")
+    print(json.dumps(report['recommended'], ensure_ascii=False, indent=4))
+    return 0
+
+
+def _run_dtype_report(args, base, queries):
+    results = compare_vector_dtypes(base, queries, args.k, args.oversample)
+    print(f"{'dtype':<9} {'bytes/vec':>9} {'memory':>7} {'recall':>7} {'rescored':>9} {'MB/样本':>9}")
+    for r in results:
+        print(f"{r['dtype']:<9} {r['bytes_per_vector']:>9} {r['memory_ratio']:>6.1f}x {r['recall']:>7.4f} "
+              f"{r['recall_rescored']:>9.4f} {r['bytes_per_vector'] * base.shape[0] / 1024 / 1024:>9.1f}")
+    best = recommend_dtype(results, args.max_recall_drop)
+    report = {'sample': int(base.shape[0]), 'queries': int(queries.shape[0]), 'k': args.k,
+              'oversample': args.oversample, 'max_recall_drop': args.max_recall_drop, 'results': results,
+              'recommended': {'vector_storage': {'dtype': best['dtype'],
+                                                 'rescore': best['recall_rescored'] > best['recall'],
+                                                 'rescore_oversample': args.oversample}} if best else None}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if best is None:
+        print(f"没有存储类型满足recall下降不超过{args.max_recall_drop}")
+        return 1
+    print("推荐配置（写入config.json后执行 python -m milvus.migrate_tool vector_dtype 迁移）:")
+    print(json.dumps(report['recommended'], ensure_ascii=False, indent=4))
+    return 0
+
+
+def main():
+    with open('./config/config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    parser = argparse.ArgumentParser(description='向量索引召回率与延迟评测')
+    parser.add_argument('command', choices=['run', 'dtype', 'coarse', 'backend'])
+    parser.add_argument('--type', default='DOC', choices=['DOC', 'QA'], help='采样的collection类型')
+    parser.add_argument('--sample', type=int, default=20000, help='最多采样的向量条数')
+    parser.add_argument('--synthetic', type=int, default=0, help='大于0时使用指定条数的合成向量，不读取collection')
+    parser.add_argument('--dim', type=int, default=1024, help='合成向量维度')
+    parser.add_argument('--queries', type=int, default=200, help='查询条数，从样本中留出，不参与建索引')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--recall-target', type=float, default=0.95)
+    parser.add_argument('--index-types', default='', help='只评测指定索引类型，逗号分隔，例如HNSW,IVF_FLAT')
+    parser.add_argument('--output', default='', help='评测报告输出的json文件')
+    parser.add_argument('--oversample', type=int,
+                        default=config.get('vector_storage', {}).get('rescore_oversample', 4), help='dtype命令：精排候选倍数')
+    parser.add_argument('--max-recall-drop', type=float, default=0.02, help='dtype/coarse命令：允许的recall@k下降')
+    parser.add_argument('--methods', default='pca,random', help='coarse命令：投影方式，逗号分隔')
+    parser.add_argument('--coarse-dims', default='128,256', help='coarse命令：低维向量维度，逗号分隔')
+    parser.add_argument('--candidates', default='50,100,200', help='coarse命令：低维向量召回的候选数，逗号分隔')
+    parser.add_argument('--tenants', type=int, default=8, help='backend命令：向量轮流分配的租户数')
+    args = parser.parse_args()
+
+    try:
+        registry = MilvusCollectionRegistry(config['milvus'])
+        name_convention = config['name_convention']
+        db_name = name_convention['global_database']
+        alias = registry.connect(db_name)
+        if args.synthetic > 0:
+            vectors = synthetic_vectors(args.synthetic + args.queries, args.dim)
+        else:
+            collection_name = name_convention['global_collection_qa' if args.type == 'QA' else 'global_collection_doc']
+            vectors = sample_collection_vectors(registry, db_name, collection_name, args.sample + args.queries)
+        if vectors.shape[0] <= args.queries + args.k:
+            print(f"样本数量{vectors.shape[0]}过少，至少需要{args.queries + args.k + 1}条")
+            return 1
+        order = np.random.default_rng(7).permutation(vectors.shape[0])
+        queries, base = vectors[order[:args.queries]], vectors[order[args.queries:]]
+        print(f"样本{base.shape[0]}条，查询{queries.shape[0]}条，维度{base.shape[1]}，k={args.k}")
+        if args.command == 'dtype':
+            return _run_dtype_report(args, base, queries)
+        if args.command == 'coarse':
+            args.alias = alias
+            return _run_coarse_report(args, config, base, queries)
+        if args.command == 'backend':
+            args.alias = alias
+            return _run_backend_report(args, config, base, queries)
+        index_types = [t.strip() for t in args.index_types.split(',') if t.strip()]
+
+        results = run_benchmark(alias, base, queries, args.k, config['index_params'].get('metric_type', 'COSINE'),
+                                index_types, config.get('corpus_loader', {}).get('batch_size', 1000))
+        _print_table(results)
+        best = recommend(results, args.recall_target)
+        report = {'sample': int(base.shape[0]), 'queries': int(queries.shape[0]), 'k': args.k,
+                  'recall_target': args.recall_target, 'results': results,
+                  'recommended': config_block(best) if best else None}
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if best is None:
+            print("没有可用的索引配置")
+            return 1
+        if best['recall'] < args.recall_target:
+            print(f"没有配置达到recall目标{args.recall_target}，以下为recall最高的配置")
+        print("推荐配置（写入config.json后按index_rebuild在线重建索引）:")
+        print(json.dumps(report['recommended'], ensure_ascii=False, indent=4))
+        return 0
+    except Exception as e:
+        print(f"评测失败: {e}")
+        print(traceback.format_exc())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+流式入库流水线
+分块 -> 向量化 -> 写入Milvus 三个阶段通过有界队列串联并行执行，
+任意时刻内存中只保留少量批次，峰值内存与文档总量无关
+"""
+import zlib
+import queue
+import logging
+import threading
+
+logger = logging.getLogger('vector_db')
+
+_END = object()
+
+
+def iter_doc_segments(content, segment_chars, anchor_modulus=8):
+    """按内容定义的边界把文档切成段，段内再交给分块器处理
+
+    累计长度达到segment_chars后，在下一个“锚点行”（非空行且内容crc32对anchor_modulus取模为0）之后切段。
+    切段位置只取决于附近的行内容，文档局部修改后后续段落的边界会很快重新对齐，
+    未修改部分的分块保持不变，便于按分块哈希做增量更新
+    """
+    if not segment_chars or segment_chars <= 0:
+        yield content
+        return
+    segment = []
+    length = 0
+    for line in content.split('\n'):
+        segment.append(line)
+        length += len(line) + 1
+        if length >= segment_chars and line.strip() and zlib.crc32(line.encode('utf-8')) % anchor_modulus == 0:
+            yield '\n'.join(segment)
+            segment = []
+            length = 0
+    if segment:
+        yield '\n'.join(segment)
+
+
+def iter_doc_chunks(text_splitter, doc_name_list, doc_content_list, source_list, metadata_list, segment_chars=0):
+    """逐个文档分块，按顺序产出分块字典(file_name, block_id, content, source, metadata)
+
+    Args:
+        segment_chars: 大于0时先按内容定义的边界切段再分块（见iter_doc_segments）
+    """
+    for dname, cnt, dsource, metadata in zip(doc_name_list, doc_content_list, source_list, metadata_list):
+        k = 0
+        for segment in iter_doc_segments(cnt, segment_chars):
+            for block in text_splitter.split_text(segment):
+                yield {'file_name': dname, 'block_id': k, 'content': block, 'source': dsource, 'metadata': metadata}
+                k += 1
+
+
+def iter_batches(items, batch_size):
+    """将迭代器按batch_size分批"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _StageError(Exception):
+    pass
+
+
+def _put(q, item, stop_event):
+    """向有界队列放入数据，下游失败时放弃等待"""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop_event):
+    """从队列取数据，上游失败时放弃等待"""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    raise _StageError()
+
+
+def run_ingest_pipeline(chunks, embed_fn, insert_fn, batch_size=32, queue_size=2, text_field='content'):
+    """执行流式入库
+
+    Args:
+        chunks: 分块迭代器（可以是生成器），元素为字典
+        embed_fn: 向量化函数，输入文本列表，返回向量列表
+        insert_fn: 写入函数，输入(分块批次, 向量批次)，调用方负责最终flush
+        batch_size: 每批向量化/写入的分块数
+        queue_size: 阶段之间的队列长度，决定最多有多少批次同时驻留内存
+        text_field: 分块中用于向量化的字段
+
+    Returns:
+        写入的分块总数
+    """
+    split_queue = queue.Queue(maxsize=queue_size)
+    embed_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+
+    def split_stage():
+        try:
+            for batch in iter_batches(chunks, batch_size):
+                if not _put(split_queue, batch, stop_event):
+                    return
+            _put(split_queue, _END, stop_event)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+
+    def embed_stage():
+        try:
+            while True:
+                batch = _get(split_queue, stop_event)
+                if batch is _END:
+                    _put(embed_queue, _END, stop_event)
+                    return
+                vectors = embed_fn([chunk[text_field] for chunk in batch])
+                if not _put(embed_queue, (batch, vectors), stop_event):
+                    return
+        except _StageError:
+            return
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+
+    workers = [threading.Thread(target=split_stage, name='ingest-split', daemon=True),
+               threading.Thread(target=embed_stage, name='ingest-embed', daemon=True)]
+    for worker in workers:
+        worker.start()
+
+    total = 0
+    try:
+        while True:
+            try:
+                item = _get(embed_queue, stop_event)
+            except _StageError:
+                break
+            if item is _END:
+                break
+            batch, vectors = item
+            insert_fn(batch, vectors)
+            total += len(batch)
+            logger.info(f"流式入库：已写入{total}个分块")
+    except Exception:
+        stop_event.set()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+
+    if errors:
+        raise errors[0]
+    return total
@@ -0,0 +1,874 @@
+# -*- coding: utf-8 -*-
+"""
+进程内向量库后端
+config['vector_backend']为local时替代Milvus：collection_registry返回LocalCollection，接口与pymilvus的Collection一致
+（insert/delete/query/query_iterator/search/create_index/load/flush），create_collection、insert_*、delete_*、
+search_from_collection无需修改即可使用，适合小租户、本地开发和离线测试，不需要部署Milvus standalone。
+
+每个collection的数据保存在{data_dir}/{数据库}/{collection}/目录：
+    meta.json               schema、索引参数、当前数据代数
+    {向量字段}.{代数}.f32    向量按行追加写入的float32文件，读取时内存映射
+    rows.{代数}.jsonl        标量字段（含主键）按行追加写入，加载后按列组织用于tenant_code/org_code等过滤
+    deleted.{代数}.log       已删除的行号
+写入即落盘，已删除的行数超过local_backend.compact_ratio时flush重写为新一代文件。
+向量索引类型为HNSW时使用hnswlib（可选依赖，见requirements-local.txt，加载时在内存中构建），其余索引类型均为精确检索；
+过滤后的候选行数不超过local_backend.brute_force_threshold时直接精确检索。
+不支持BM25稀疏向量字段（混合检索使用进程内BM25），也不支持migrate_tool的迁移命令
+"""
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import operator
+import threading
+import functools
+
+import numpy as np
+from pymilvus import FieldSchema, CollectionSchema, DataType
+
+logger = logging.getLogger('vector_db')
+
+VECTOR_TYPES = {DataType.FLOAT_VECTOR, DataType.FLOAT16_VECTOR, DataType.BFLOAT16_VECTOR, DataType.INT8_VECTOR}
+INT_TYPES = {DataType.INT8, DataType.INT16, DataType.INT32, DataType.INT64}
+FLOAT_TYPES = {DataType.FLOAT, DataType.DOUBLE}
+
+# hnswlib的距离类型及距离到Milvus分数的换算（COSINE/IP分数越大越相似，L2为距离平方，越小越相似）
+_HNSW_SPACES = {'COSINE': 'cosine', 'IP': 'ip', 'L2': 'l2'}
+
+
+def _hnswlib():
+    try:
+        import hnswlib
+    except ImportError:
+        raise ImportError("本地后端的HNSW索引需要安装hnswlib: pip install -r requirements-local.txt")
+    return hnswlib
+
+
+# ---------------------------------------------------------------- 过滤表达式
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|
+    (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)|
+    (?P<op>==|!=|>=|<=|&&|\|\||[<>!()\[\],])|
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+)""", re.VERBOSE)
+
+_COMPARE = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt,
+            '>=': operator.ge}
+_REVERSED = {'==': '==', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+def _tokenize_expr(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        match = _TOKEN_RE.match(expr, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f"无法解析的过滤表达式: {expr}（位置{pos}）")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'number':
+            value = float(value) if any(c in value for c in '.eE') else int(value)
+        elif kind == 'name' and value.lower() in ('and', 'or', 'not', 'in', 'like', 'true', 'false'):
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _ExprParser:
+    """把Milvus布尔表达式的常用子集编译为按列计算的函数
+
+    支持 ==、!=、<、<=、>、>=、in [...]、not in [...]、like、&&/and、||/or、!/not、括号及JSON字段取值（metadata["key"]）；
+    编译结果为fn(column) -> bool数组，column(字段名)返回该字段的列
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = _tokenize_expr(expr)
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self, kind=None, value=None):
+        token = self._peek()
+        if token[0] is None or (kind and token[0] != kind) or (value is not None and token[1] != value):
+            raise ValueError(f"过滤表达式语法错误: {self.expr}（第{self.pos + 1}个词附近）")
+        self.pos += 1
+        return token
+
+    def _accept(self, kind, *values):
+        token = self._peek()
+        if token[0] == kind and token[1] in values:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"过滤表达式语法错误: {self.expr}（第{self.pos + 1}个词附近）")
+        return node
+
+    def _or(self):
+        node = self._and()
+        while self._accept('op', '||') or self._accept('keyword', 'or'):
+            left, right = node, self._and()
+            node = lambda column, l=left, r=right: l(column) | r(column)
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._accept('op', '&&') or self._accept('keyword', 'and'):
+            left, right = node, self._not()
+            node = lambda column, l=left, r=right: l(column) & r(column)
+        return node
+
+    def _not(self):
+        if self._accept('op', '!') or self._accept('keyword', 'not'):
+            inner = self._not()
+            return lambda column: ~inner(column)
+        if self._accept('op', '('):
+            node = self._or()
+            self._take('op', ')')
+            return node
+        return self._comparison()
+
+    def _operand(self):
+        kind, value = self._peek()
+        if kind in ('string', 'number'):
+            self.pos += 1
+            return 'literal', value
+        if kind == 'keyword' and value in ('true', 'false'):
+            self.pos += 1
+            return 'literal', value == 'true'
+        if kind == 'op' and value == '[':
+            return 'literal', self._list()
+        name = self._take('name')[1]
+        keys = []
+        while self._accept('op', '['):
+            keys.append(self._take()[1])
+            self._take('op', ']')
+        return 'field', (name, tuple(keys))
+
+    def _list(self):
+        self._take('op', '[')
+        values = []
+        if not self._accept('op', ']'):
+            while True:
+                kind, value = self._take()
+                if kind == 'keyword' and value in ('true', 'false'):
+                    value = value == 'true'
+                elif kind not in ('string', 'number'):
+                    raise ValueError(f"过滤表达式的列表只能包含常量: {self.expr}")
+                values.append(value)
+                if self._accept('op', ']'):
+                    break
+                self._take('op', ',')
+        return values
+
+    def _comparison(self):
+        left_kind, left = self._operand()
+        negate = self._accept('keyword', 'not')
+        if self._accept('keyword', 'in'):
+            kind, values = self._operand()
+            if left_kind != 'field' or kind != 'literal' or not isinstance(values, list):
+                raise ValueError(f"in的左侧必须是字段、右侧必须是常量列表: {self.expr}")
+            node = functools.partial(_in_mask, left, values)
+            return (lambda column: ~node(column)) if negate else node
+        if negate:
+            raise ValueError(f"过滤表达式语法错误: {self.expr}（not之后应为in）")
+        if self._accept('keyword', 'like'):
+            kind, pattern = self._operand()
+            if left_kind != 'field' or not isinstance(pattern, str):
+                raise ValueError(f"like的左侧必须是字段、右侧必须是字符串: {self.expr}")
+            regex = re.compile('^' + '.*'.join(re.escape(part) for part in pattern.split('%')) + '$', re.S)
+            return functools.partial(_like_mask, left, regex)
+        op = self._take('op')[1]
+        if op not in _COMPARE:
+            raise ValueError(f"不支持的比较运算符{op}: {self.expr}")
+        right_kind, right = self._operand()
+        if left_kind == 'literal' and right_kind == 'field':
+            left, right, op = right, left, _REVERSED[op]
+        elif left_kind != 'field' or right_kind != 'literal':
+            raise ValueError(f"比较运算的一侧必须是字段、另一侧必须是常量: {self.expr}")
+        return functools.partial(_compare_mask, left, op, right)
+
+
+def _field_values(field, column):
+    name, keys = field
+    values = column(name)
+    if not keys:
+        return values
+    result = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else (
+                value[key] if isinstance(value, list) and isinstance(key, int) and -len(value) <= key < len(value)
+                else None)
+        result[i] = value
+    return result
+
+
+def _compare_mask(field, op, literal, column):
+    values = _field_values(field, column)
+    if values.dtype != object:
+        if isinstance(literal, str):
+            return np.full(len(values), op == '!=')
+        return np.asarray(_COMPARE[op](values, literal), dtype=bool)
+    if op in ('==', '!=') and isinstance(literal, (str, bool, int, float)):
+        # 对象数组逐元素比较在numpy内部循环完成，tenant_code/org_code等等值过滤无需逐行调用Python函数
+        return np.asarray(_COMPARE[op](values, literal), dtype=bool)
+    compare = _COMPARE[op]
+
+    def safe_compare(value):
+        try:
+            return value is not None and bool(compare(value, literal))
+        except TypeError:
+            return op == '!='
+    return np.fromiter((safe_compare(v) for v in values), dtype=bool, count=len(values))
+
+
+def _in_mask(field, literals, column):
+    values = _field_values(field, column)
+    if values.dtype != object:
+        return np.isin(values, [v for v in literals if not isinstance(v, str)])
+    if len(literals) <= 16:
+        mask = np.zeros(len(values), dtype=bool)
+        for literal in literals:
+            mask |= np.asarray(values == literal, dtype=bool)
+        return mask
+    literal_set = set(literals)
+    return np.fromiter((not isinstance(v, (dict, list)) and v in literal_set for v in values),
+                       dtype=bool, count=len(values))
+
+
+def _like_mask(field, regex, column):
+    values = _field_values(field, column)
+    return np.fromiter((isinstance(v, str) and regex.match(v) is not None for v in values),
+                       dtype=bool, count=len(values))
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_filter(expr):
+    """编译过滤表达式（结果缓存），返回fn(column) -> bool数组"""
+    return _ExprParser(expr).parse()
+
+
+# ---------------------------------------------------------------- schema序列化
+
+def _field_to_dict(field):
+    return {'name': field.name, 'dtype': field.dtype.name, 'params': dict(field.params),
+            'is_primary': field.is_primary, 'auto_id': bool(field.auto_id) if field.is_primary else False,
+            'is_partition_key': bool(field.is_partition_key)}
+
+
+def _field_from_dict(item):
+    kwargs = {'is_primary': item['is_primary']}
+    if item['is_primary']:
+        kwargs['auto_id'] = item['auto_id']
+    if item.get('is_partition_key'):
+        kwargs['is_partition_key'] = True
+    return FieldSchema(name=item['name'], dtype=DataType[item['dtype']], **kwargs, **item['params'])
+
+
+# ---------------------------------------------------------------- 检索结果
+
+class LocalHit:
+    """单条检索结果，接口与pymilvus的Hit一致（id、score、distance、get）"""
+
+    __slots__ = ('id', 'score', 'entity')
+
+    def __init__(self, pk, score, entity):
+        self.id = pk
+        self.score = score
+        self.entity = entity
+
+    @property
+    def distance(self):
+        return self.score
+
+    def get(self, field_name, default=None):
+        value = self.entity.get(field_name)
+        return default if value is None else value
+
+
+class LocalHits(list):
+    """单个查询的检索结果列表，接口与pymilvus的Hits一致（ids、distances）"""
+
+    @property
+    def ids(self):
+        return [hit.id for hit in self]
+
+    @property
+    def distances(self):
+        return [hit.score for hit in self]
+
+
+class LocalMutationResult:
+    def __init__(self, primary_keys=None, delete_count=0):
+        self.primary_keys = primary_keys or []
+        self.insert_count = len(self.primary_keys)
+        self.delete_count = delete_count
+
+
+class LocalIndex:
+    """索引描述，接口与pymilvus的Index一致（field_name、index_name、params）"""
+
+    def __init__(self, field_name, params):
+        self.field_name = field_name
+        self.index_name = field_name
+        self.params = dict(params)
+
+
+class _LocalQueryIterator:
+    """query_iterator的结果，接口与pymilvus的QueryIterator一致（next、close）"""
+
+    def __init__(self, rows, offsets, vectors, fields, batch_size):
+        self._rows = rows
+        self._offsets = offsets
+        self._vectors = vectors
+        self._fields = fields
+        self._batch_size = batch_size
+        self._pos = 0
+
+    def next(self):
+        batch = self._offsets[self._pos:self._pos + self._batch_size]
+        self._pos += len(batch)
+        return [_entity(self._rows, self._vectors, i, self._fields) for i in batch]
+
+    def close(self):
+        self._offsets = self._offsets[:0]
+
+
+def _entity(rows, vectors, offset, fields):
+    row = rows[offset]
+    entity = {'id': row['id']}
+    for f in fields:
+        entity[f] = vectors[f][offset].tolist() if f in vectors else row.get(f)
+    return entity
+
+
+# ---------------------------------------------------------------- 向量索引
+
+class _HnswIndex:
+    """hnswlib索引，标签为行号"""
+
+    def __init__(self, dim, metric, params):
+        hnswlib = _hnswlib()
+        self.metric = metric
+        self.index = hnswlib.Index(space=_HNSW_SPACES[metric], dim=dim)
+        self.index.init_index(max_elements=1024, ef_construction=int(params.get('efConstruction', 200)),
+                              M=int(params.get('M', 16)))
+
+    def add(self, vectors, offsets):
+        if len(offsets) == 0:
+            return
+        required = self.index.get_current_count() + len(offsets)
+        if required > self.index.get_max_elements():
+            self.index.resize_index(max(required, self.index.get_max_elements() * 2))
+        self.index.add_items(np.asarray(vectors, dtype=np.float32), np.asarray(offsets))
+
+    def mark_deleted(self, offsets):
+        for offset in offsets:
+            self.index.mark_deleted(int(offset))
+
+    def search(self, queries, limit, ef, allowed):
+        """返回(行号矩阵, 分数矩阵)；过滤后可返回的结果不足limit条时hnswlib抛出RuntimeError"""
+        self.index.set_ef(max(int(ef), limit))
+        labels, distances = self.index.knn_query(queries, k=limit, filter=lambda label: bool(allowed[label]))
+        scores = distances if self.metric == 'L2' else 1.0 - distances
+        return labels, scores
+
+
+def _exact_search(vectors, norms, offsets, queries, limit, metric):
+    """在offsets指定的行中精确检索，返回每个查询的[(行号, 分数)]"""
+    matrix = np.asarray(vectors[offsets] if len(offsets) < len(vectors) else vectors, dtype=np.float32)
+    if metric == 'L2':
+        scores = (np.sum(queries ** 2, axis=1, keepdims=True) - 2 * queries @ matrix.T
+                  + np.sum(matrix ** 2, axis=1)[None, :])
+        order_scores = scores
+    else:
+        scores = queries @ matrix.T
+        if metric == 'COSINE':
+            row_norms = norms[offsets] if len(offsets) < len(norms) else norms
+            scores = scores / np.clip(np.linalg.norm(queries, axis=1, keepdims=True) * row_norms[None, :], 1e-12, None)
+        order_scores = -scores
+    limit = min(limit, len(offsets))
+    results = []
+    for query_scores, query_order_scores in zip(scores, order_scores):
+        if limit == 0:
+            results.append([])
+            continue
+        top = np.argpartition(query_order_scores, limit - 1)[:limit]
+        top = top[np.argsort(query_order_scores[top], kind='stable')]
+        results.append([(int(offsets[i]), float(query_scores[i])) for i in top])
+    return results
+
+
+# ---------------------------------------------------------------- collection
+
+class LocalCollection:
+    """进程内collection，向量内存映射读取，写入即落盘；同一目录在进程内只应有一个实例（由LocalCollectionRegistry保证）"""
+
+    def __init__(self, name, path, brute_force_threshold=20000, compact_ratio=0.3):
+        self.name = name
+        self.path = path
+        self.brute_force_threshold = brute_force_threshold
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.schema = CollectionSchema(fields=[_field_from_dict(item) for item in meta['fields']])
+        self._index_params = meta.get('indexes', {})
+        self._generation = meta.get('generation', 0)
+        self._next_id = meta.get('next_id', 1)
+        self._pk = self.schema.primary_field
+        self._vector_fields = {f.name: f.params['dim'] for f in self.schema.fields if f.dtype in VECTOR_TYPES}
+        self._field_types = {f.name: f.dtype for f in self.schema.fields}
+        self._hnsw = {}
+        self._loaded = False
+        self._open_segment()
+
+    @classmethod
+    def create(cls, path, name, schema, **kwargs):
+        """按pymilvus的CollectionSchema创建collection目录，向量字段统一以float32存储"""
+        if getattr(schema, 'functions', None) or any(f.dtype == DataType.SPARSE_FLOAT_VECTOR for f in schema.fields):
+            raise ValueError(f"本地后端不支持BM25函数及稀疏向量字段，collection[{name}]请使用不带稀疏向量的schema")
+        if schema.primary_field is None or schema.primary_field.name != 'id' or \
+                schema.primary_field.dtype != DataType.INT64:
+            raise ValueError(f"本地后端只支持名为id的INT64主键，collection[{name}]")
+        fields = []
+        for f in schema.fields:
+            item = _field_to_dict(f)
+            if f.dtype in VECTOR_TYPES and f.dtype != DataType.FLOAT_VECTOR:
+                logger.info(f"本地后端以float32存储向量，collection[{name}]的字段[{f.name}]由{f.dtype.name}改为FLOAT_VECTOR")
+                item['dtype'] = DataType.FLOAT_VECTOR.name
+            fields.append(item)
+        os.makedirs(path, exist_ok=True)
+        # 自增主键从毫秒时间戳开始，删除重建后的主键不与旧数据（如持久化的BM25索引）重复
+        _write_json(os.path.join(path, 'meta.json'), {'fields': fields, 'indexes': {}, 'generation': 0,
+                                                      'next_id': int(time.time() * 1000) << 16})
+        logger.info(f"本地后端collection[{name}]创建成功: {path}")
+        return cls(name, path, **kwargs)
+
+    # ------------------------------------------------------------ 文件
+
+    def _file(self, kind, generation=None):
+        generation = self._generation if generation is None else generation
+        if kind in self._vector_fields:
+            return os.path.join(self.path, f"{kind}.{generation}.f32")
+        return os.path.join(self.path, f"{kind}.{generation}.{'jsonl' if kind == 'rows' else 'log'}")
+
+    def _save_meta(self):
+        _write_json(os.path.join(self.path, 'meta.json'), {
+            'fields': [_field_to_dict(f) for f in self.schema.fields], 'indexes': self._index_params,
+            'generation': self._generation, 'next_id': self._next_id})
+
+    def _open_segment(self):
+        """读取当前代的数据文件；进程中断导致各文件行数不一致时截断到完整写入的行数"""
+        rows = []
+        rows_path = self._file('rows')
+        if os.path.exists(rows_path):
+            with open(rows_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    rows.append(json.loads(line))
+        count = len(rows)
+        for field, dim in self._vector_fields.items():
+            vector_path = self._file(field)
+            size = os.path.getsize(vector_path) if os.path.exists(vector_path) else 0
+            count = min(count, size // (4 * dim))
+        if count < len(rows) or any(os.path.exists(self._file(f)) and os.path.getsize(self._file(f)) != count * 4 * d
+                                    for f, d in self._vector_fields.items()):
+            logger.warning(f"本地后端collection[{self.name}]的数据文件不完整，截断到{count}行")
+            rows = rows[:count]
+            with open(rows_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+            for field, dim in self._vector_fields.items():
+                with open(self._file(field), 'ab') as f:
+                    f.truncate(count * 4 * dim)
+        self._rows = rows
+        self._count = count
+        self._alive = np.ones(count, dtype=bool)
+        deleted_path = self._file('deleted')
+        if os.path.exists(deleted_path):
+            with open(deleted_path, 'r', encoding='utf-8') as f:
+                deleted = [int(line) for line in f if line.strip()]
+            self._alive[[i for i in deleted if i < count]] = False
+        if rows:
+            self._next_id = max(self._next_id, max(row['id'] for row in rows) + 1)
+        self._vectors = {}
+        self._norms = {}
+        for field in self._vector_fields:
+            self._map_vectors(field)
+            self._norms[field] = _row_norms(self._vectors[field])
+        self._columns = {}
+
+    def _map_vectors(self, field):
+        dim = self._vector_fields[field]
+        if self._count == 0:
+            self._vectors[field] = np.empty((0, dim), dtype=np.float32)
+        else:
+            self._vectors[field] = np.memmap(self._file(field), dtype=np.float32, mode='r', shape=(self._count, dim))
+
+    def _column(self, field):
+        column = self._columns.get(field)
+        if column is None:
+            if field not in self._field_types and field != 'id':
+                raise ValueError(f"collection[{self.name}]没有字段[{field}]")
+            dtype = self._field_types.get(field, DataType.INT64)
+            values = (row.get(field) for row in self._rows)
+            if dtype in INT_TYPES:
+                column = np.fromiter(values, dtype=np.int64, count=len(self._rows))
+            elif dtype in FLOAT_TYPES:
+                column = np.fromiter(values, dtype=np.float64, count=len(self._rows))
+            elif dtype == DataType.BOOL:
+                column = np.fromiter(values, dtype=bool, count=len(self._rows))
+            else:
+                column = np.empty(len(self._rows), dtype=object)
+                for i, value in enumerate(values):
+                    column[i] = value
+            self._columns[field] = column
+        return column
+
+    def _match(self, expr):
+        """返回满足expr且未删除的行的掩码"""
+        with self._lock:
+            alive = self._alive.copy()
+            if not expr:
+                return alive
+            return alive & compile_filter(expr)(self._column)
+
+    # ------------------------------------------------------------ 写入
+
+    def _normalize_rows(self, data):
+        if data and isinstance(data[0], dict):
+            return list(data)
+        names = [f.name for f in self.schema.fields if not (f.is_primary and f.auto_id)]
+        if len(data) != len(names):
+            raise ValueError(f"collection[{self.name}]写入数据的列数{len(data)}与字段{names}不一致")
+        lengths = {len(column) for column in data}
+        if len(lengths) > 1:
+            raise ValueError(f"collection[{self.name}]写入数据各列的行数不一致: {sorted(lengths)}")
+        return [dict(zip(names, values)) for values in zip(*data)]
+
+    def insert(self, data, **kwargs):
+        rows = self._normalize_rows(data)
+        if not rows:
+            return LocalMutationResult()
+        scalar_fields = [f.name for f in self.schema.fields if f.name not in self._vector_fields and not f.is_primary]
+        vectors = {}
+        for field, dim in self._vector_fields.items():
+            matrix = np.asarray([np.asarray(row[field], dtype=np.float32) for row in rows], dtype=np.float32)
+            if matrix.shape != (len(rows), dim):
+                raise ValueError(f"collection[{self.name}]字段[{field}]的向量维度应为{dim}，实际为{matrix.shape[1:]}")
+            vectors[field] = matrix
+        with self._lock:
+            if self._pk.auto_id:
+                ids = list(range(self._next_id, self._next_id + len(rows)))
+            else:
+                ids = [int(row[self._pk.name]) for row in rows]
+            self._next_id = max(self._next_id, max(ids) + 1)
+            for field, matrix in vectors.items():
+                with open(self._file(field), 'ab') as f:
+                    f.write(matrix.tobytes())
+            new_rows = [dict({'id': pk}, **{f: row.get(f) for f in scalar_fields}) for pk, row in zip(ids, rows)]
+            with open(self._file('rows'), 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in new_rows)
+            start = self._count
+            self._rows.extend(new_rows)
+            self._count += len(new_rows)
+            self._alive = np.concatenate([self._alive, np.ones(len(new_rows), dtype=bool)])
+            for field, matrix in vectors.items():
+                self._map_vectors(field)
+                self._norms[field] = np.concatenate([self._norms[field], _row_norms(matrix)])
+                if field in self._hnsw:
+                    self._hnsw[field].add(matrix, np.arange(start, self._count))
+            self._columns = {}
+        return LocalMutationResult(primary_keys=ids)
+
+    def delete(self, expr, **kwargs):
+        with self._lock:
+            offsets = np.flatnonzero(self._match(expr))
+            if len(offsets):
+                with open(self._file('deleted'), 'a', encoding='utf-8') as f:
+                    f.writelines(f"{i}\n" for i in offsets)
+                self._alive[offsets] = False
+                for index in self._hnsw.values():
+                    index.mark_deleted(offsets)
+        return LocalMutationResult(delete_count=len(offsets))
+
+    def flush(self, **kwargs):
+        """数据写入时已落盘；已删除的行数超过compact_ratio时重写为新一代文件"""
+        with self._lock:
+            deleted = self._count - int(self._alive.sum())
+            if deleted and deleted >= self._count * self.compact_ratio:
+                self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive)
+        old_generation = self._generation
+        generation = old_generation + 1
+        for field in self._vector_fields:
+            np.asarray(self._vectors[field][keep], dtype=np.float32).tofile(self._file(field, generation))
+        with open(self._file('rows', generation), 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(self._rows[i], ensure_ascii=False) + '\n' for i in keep)
+        self._generation = generation
+        self._save_meta()
+        self._open_segment()
+        if self._loaded:
+            self._build_indexes()
+        for kind in list(self._vector_fields) + ['rows', 'deleted']:
+            try:
+                os.remove(self._file(kind, old_generation))
+            except OSError:
+                # 旧文件可能仍被内存映射（如正在进行的检索），下次压缩时不再引用
+                pass
+        logger.info(f"本地后端collection[{self.name}]压缩完成，保留{len(keep)}行，数据代数{generation}")
+
+    @property
+    def num_entities(self):
+        return int(self._alive.sum())
+
+    # ------------------------------------------------------------ 索引
+
+    @property
+    def indexes(self):
+        return [LocalIndex(field, params) for field, params in self._index_params.items()]
+
+    def has_index(self, index_name=None, **kwargs):
+        return bool(self._index_params) if index_name is None else index_name in self._index_params
+
+    def create_index(self, field_name, index_params=None, **kwargs):
+        with self._lock:
+            self._index_params[field_name] = dict(index_params or {})
+            self._save_meta()
+            if self._loaded and field_name in self._vector_fields:
+                self._build_indexes()
+
+    def drop_index(self, index_name=None, **kwargs):
+        with self._lock:
+            for field in [index_name] if index_name else list(self._index_params):
+                self._index_params.pop(field, None)
+                self._hnsw.pop(field, None)
+            self._save_meta()
+
+    def _build_indexes(self):
+        self._hnsw = {}
+        for field, params in self._index_params.items():
+            if field not in self._vector_fields or params.get('index_type') != 'HNSW':
+                continue
+            start = time.perf_counter()
+            index = _HnswIndex(self._vector_fields[field], params.get('metric_type', 'COSINE'),
+                               params.get('params') or {})
+            alive = np.flatnonzero(self._alive)
+            for begin in range(0, len(alive), 10000):
+                batch = alive[begin:begin + 10000]
+                index.add(self._vectors[field][batch], batch)
+            self._hnsw[field] = index
+            logger.info(f"本地后端collection[{self.name}]字段[{field}]的HNSW索引构建完成，{len(alive)}行，"
+                        f"耗时{time.perf_counter() - start:.2f}秒")
+
+    def load(self, **kwargs):
+        with self._lock:
+            if not self._loaded:
+                self._build_indexes()
+                self._loaded = True
+
+    def release(self, **kwargs):
+        with self._lock:
+            self._hnsw = {}
+            self._loaded = False
+
+    # ------------------------------------------------------------ 读取
+
+    def _output_fields(self, output_fields):
+        if not output_fields:
+            return []
+        if '*' in output_fields:
+            return [f.name for f in self.schema.fields if not f.is_primary and f.name not in self._vector_fields]
+        unknown = [f for f in output_fields if f not in self._field_types]
+        if unknown:
+            raise ValueError(f"collection[{self.name}]没有字段{unknown}")
+        return [f for f in output_fields if f != self._pk.name]
+
+    def query(self, expr='', output_fields=None, limit=-1, offset=0, **kwargs):
+        if output_fields and 'count(*)' in output_fields:
+            return [{'count(*)': int(self._match(expr).sum())}]
+        fields = self._output_fields(output_fields)
+        with self._lock:
+            offsets = np.flatnonzero(self._match(expr))
+            offsets = offsets[offset:] if limit is None or limit < 0 else offsets[offset:offset + limit]
+            return [_entity(self._rows, self._vectors, i, fields) for i in offsets]
+
+    def query_iterator(self, batch_size=1000, limit=-1, expr=None, output_fields=None, **kwargs):
+        fields = self._output_fields(output_fields)
+        with self._lock:
+            offsets = np.flatnonzero(self._match(expr))
+            if limit is not None and limit >= 0:
+                offsets = offsets[:limit]
+            return _LocalQueryIterator(self._rows, offsets, dict(self._vectors), fields, max(1, int(batch_size)))
+
+    def search(self, data, anns_field, param=None, limit=10, expr=None, output_fields=None, **kwargs):
+        """向量检索，返回与pymilvus相同结构的结果：每个查询一个LocalHits，按相似度从高到低排列"""
+        if anns_field not in self._vector_fields:
+            raise ValueError(f"collection[{self.name}]没有向量字段[{anns_field}]")
+        param = param or {}
+        queries = np.asarray([np.asarray(v, dtype=np.float32) for v in data], dtype=np.float32)
+        fields = self._output_fields(output_fields)
+        index_params = self._index_params.get(anns_field, {})
+        metric = param.get('metric_type') or index_params.get('metric_type', 'COSINE')
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            rows, vectors, norms = self._rows, dict(self._vectors), self._norms[anns_field]
+            allowed = self._match(expr)
+            hnsw = self._hnsw.get(anns_field)
+            offsets = np.flatnonzero(allowed)
+            results = None
+            if hnsw is not None and len(offsets) > self.brute_force_threshold and metric == hnsw.metric:
+                try:
+                    ef = (param.get('params') or {}).get('ef', 64)
+                    labels, scores = hnsw.search(queries, min(limit, len(offsets)), ef, allowed)
+                    results = [[(int(label), float(score)) for label, score in zip(query_labels, query_scores)]
+                               for query_labels, query_scores in zip(labels, scores)]
+                except RuntimeError as e:
+                    logger.debug(f"HNSW过滤检索结果不足，改为精确检索: {e}")
+        if results is None:
+            results = _exact_search(vectors[anns_field], norms, offsets, queries, limit, metric)
+        return [LocalHits(LocalHit(rows[i]['id'], score, _entity(rows, vectors, i, fields)) for i, score in query_results)
+                for query_results in results]
+
+    def drop(self, **kwargs):
+        with self._lock:
+            self._hnsw = {}
+            self._vectors = {}
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _row_norms(matrix):
+    if len(matrix) == 0:
+        return np.empty(0, dtype=np.float32)
+    return np.concatenate([np.linalg.norm(np.asarray(matrix[start:start + 10000], dtype=np.float32), axis=1)
+                           for start in range(0, len(matrix), 10000)]).astype(np.float32)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# ---------------------------------------------------------------- 注册表
+
+class LocalCollectionRegistry:
+    """进程内向量库的collection注册表，接口与MilvusCollectionRegistry一致
+
+    collection实例即数据本身，每个collection在进程内只创建一个实例；invalidate/reconnect无需清除任何状态
+    """
+
+    def __init__(self, local_config):
+        self.data_dir = local_config.get('data_dir', './data/local_vector_db')
+        self.collection_options = {
+            'brute_force_threshold': local_config.get('brute_force_threshold', 20000),
+            'compact_ratio': local_config.get('compact_ratio', 0.3)
+        }
+        self._lock = threading.RLock()
+        self._collections = {}
+        logger.info(f"使用进程内向量库后端，数据目录: {os.path.abspath(self.data_dir)}")
+
+    @staticmethod
+    def alias_of(db_name=None):
+        return f"vector_db_{db_name}" if db_name else "vector_db_default"
+
+    def _db_dir(self, db_name):
+        return os.path.join(self.data_dir, db_name or 'default')
+
+    def connect(self, db_name=None):
+        os.makedirs(self._db_dir(db_name), exist_ok=True)
+        return self.alias_of(db_name)
+
+    def ensure_database(self, db_name):
+        """数据库不存在时创建，返回是否新建"""
+        exists = os.path.isdir(self._db_dir(db_name))
+        self.connect(db_name)
+        return not exists
+
+    def list_collections(self, db_name=None):
+        db_dir = self._db_dir(db_name)
+        if not os.path.isdir(db_dir):
+            return set()
+        return {name for name in os.listdir(db_dir) if os.path.exists(os.path.join(db_dir, name, 'meta.json'))}
+
+    def has_collection(self, db_name, collection_name):
+        return collection_name in self.list_collections(db_name)
+
+    def get_collection(self, db_name, collection_name, ensure_loaded=True):
+        """获取collection实例，collection不存在时返回None"""
+        key = (self.alias_of(db_name), collection_name)
+        collection = self._collections.get(key)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(key)
+                if collection is None:
+                    if not self.has_collection(db_name, collection_name):
+                        return None
+                    collection = LocalCollection(collection_name, os.path.join(self._db_dir(db_name), collection_name),
+                                                 **self.collection_options)
+                    self._collections[key] = collection
+        if ensure_loaded:
+            collection.load()
+        return collection
+
+    def open_collection(self, db_name, collection_name):
+        """获取collection实例（不加载），collection不存在时抛出异常"""
+        collection = self.get_collection(db_name, collection_name, ensure_loaded=False)
+        if collection is None:
+            raise ValueError(f"collection[{collection_name}]不存在")
+        return collection
+
+    def create_collection(self, db_name, collection_name, schema, **kwargs):
+        """按schema新建collection；num_partitions等Milvus参数忽略（tenant_code过滤直接按列计算）"""
+        with self._lock:
+            key = (self.alias_of(db_name), collection_name)
+            collection = LocalCollection.create(os.path.join(self._db_dir(db_name), collection_name), collection_name,
+                                                schema, **self.collection_options)
+            self._collections[key] = collection
+            return collection
+
+    def drop_collection(self, db_name, collection_name):
+        with self._lock:
+            collection = self.get_collection(db_name, collection_name, ensure_loaded=False)
+            if collection is not None:
+                collection.drop()
+            self._collections.pop((self.alias_of(db_name), collection_name), None)
+
+    def field_names(self, db_name, collection_name, exclude=('embedding', 'embedding_coarse')):
+        collection = self.get_collection(db_name, collection_name, ensure_loaded=False)
+        if collection is None:
+            return []
+        return [f.name for f in collection.schema.fields if f.name not in exclude]
+
+    def sparse_field(self, db_name, collection_name):
+        return None
+
+    def partition_key_field(self, db_name, collection_name):
+        collection = self.get_collection(db_name, collection_name, ensure_loaded=False)
+        if collection is None or collection.schema.partition_key_field is None:
+            return None
+        return collection.schema.partition_key_field.name
+
+    def invalidate(self, db_name=None, collection_name=None):
+        logger.debug(f"本地后端无需清除collection缓存，db_name={db_name}, collection_name={collection_name}")
+
+    def reconnect(self, db_name=None):
+        logger.debug(f"本地后端无需重建连接，db_name={db_name}")
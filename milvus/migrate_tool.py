@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+素材库collection迁移工具
+按当前代码中的schema新建collection，把旧collection的数据（含向量）分批复制过去，
+校验行数一致后通过重命名完成切换，旧collection保留为备份
+
+命令行用法（迁移期间请暂停写入接口）:
+    python -m milvus.migrate_tool sparse [--type ALL|QA|DOC] [--batch-size 1000] [--drop-backup]
+        为QA的question、DOC的content增加BM25稀疏向量字段，用于hybrid_search.mode=milvus
+    python -m milvus.migrate_tool partition_key [--type ALL|QA|DOC] [--batch-size 1000] [--drop-backup]
+        以tenant_code作为partition key重建collection，检索按租户自动路由到对应分区
+    python -m milvus.migrate_tool reindex [--type ALL|QA|DOC] [--batch-size 1000] [--drop-backup]
+        按config['index_params']在线重建向量索引（可先用 python -m milvus.index_benchmark 选择索引参数）
+    python -m milvus.migrate_tool vector_dtype [--type ALL|QA|DOC] [--batch-size 1000] [--drop-backup]
+        按config['vector_storage']['dtype']转换向量存储类型（可先用 python -m milvus.index_benchmark dtype 评估召回率）
+    python -m milvus.migrate_tool coarse [--type ALL|QA|DOC] [--refit] [--batch-size 1000] [--drop-backup]
+        按config['coarse_search']拟合降维投影（新版本），增加/重算低维向量字段后切换投影版本，用于两级检索；
+        已有可用投影时跳过，--refit强制重新拟合（可先用 python -m milvus.index_benchmark coarse 评估）
+
+只适用于Milvus后端；vector_backend为local时各collection的索引在加载时按配置重建，无需迁移。
+迁移后主键重新生成，已运行的服务进程中常驻的BM25索引和检索结果缓存仍使用旧主键，迁移完成后需重启服务
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import logging
+import traceback
+
+from pymilvus import Collection, utility
+
+from milvus.corpus_loader import iter_collection_batches
+from milvus.vector_storage import convert_vectors, decode_vector, SUPPORTED_INDEX_TYPES
+from milvus.projection import Projection, COARSE_FIELD
+from milvus.index_benchmark import sample_collection_vectors
+from milvus import miluvs_helper as helper
+
+logger = logging.getLogger('vector_db')
+
+
+def _count(collection):
+    return collection.query(expr='', output_fields=['count(*)'])[0]['count(*)']
+
+
+def copy_collection(src, dst, batch_size=1000, transform=None):
+    """把src的全部数据复制到dst（主键重新生成，函数生成的字段由dst自动计算），返回复制行数
+
+    向量按dst的存储类型转换；transform不为None时对每批行数据（dict列表）调用，用于计算dst新增的字段
+    """
+    dst_fields = {f.name for f in dst.schema.fields if not f.is_primary and not f.is_function_output}
+    output_fields = [f.name for f in src.schema.fields
+                     if not f.is_primary and not f.is_function_output and f.name in dst_fields]
+    src_mode, dst_mode = helper.embedding_mode(src), helper.embedding_mode(dst)
+    total = 0
+    for rows in iter_collection_batches(src, output_fields=output_fields, batch_size=batch_size):
+        embeddings = convert_vectors([row['embedding'] for row in rows], src_mode, dst_mode)
+        rows = [dict({field: row[field] for field in output_fields}, embedding=embedding)
+                for row, embedding in zip(rows, embeddings)]
+        dst.insert(transform(rows) if transform else rows)
+        total += len(rows)
+        logger.info(f"已复制{total}行: {src.name} -> {dst.name}")
+    dst.flush()
+    return total
+
+
+def migrate_collection(alias, name, schema, create_indexes=None, batch_size=1000, drop_backup=False, transform=None):
+    """用新schema（及索引）重建collection，复制期间旧collection照常提供检索
+
+    Args:
+        create_indexes: 为新collection创建索引的函数，参数为collection，默认使用当前配置的索引
+        transform: 复制时对每批行数据的转换函数，见copy_collection
+
+    Returns:
+        (is_succ, msg)
+    """
+    if not utility.has_collection(name, using=alias):
+        return False, f"collection[{name}]不存在"
+    src = Collection(name, using=alias)
+    src.load()
+
+    tmp_name = f"{name}__migrating"
+    if utility.has_collection(tmp_name, using=alias):
+        logger.info(f"删除上次未完成迁移遗留的collection[{tmp_name}]")
+        utility.drop_collection(tmp_name, using=alias)
+    dst = Collection(tmp_name, schema=schema, using=alias, **helper.collection_create_kwargs(schema))
+    (create_indexes or helper.create_collection_indexes)(dst)
+    dst.load()
+
+    copied = copy_collection(src, dst, batch_size, transform)
+    src_count, dst_count = _count(src), _count(dst)
+    if src_count != dst_count:
+        return False, f"collection[{name}]迁移后行数不一致: 原{src_count}行，新{dst_count}行（复制{copied}行），未切换"
+
+    backup_name = f"{name}__backup_{time.strftime('%Y%m%d%H%M%S')}"
+    utility.rename_collection(name, backup_name, using=alias)
+    utility.rename_collection(tmp_name, name, using=alias)
+    if drop_backup:
+        utility.drop_collection(backup_name, using=alias)
+        return True, f"collection[{name}]迁移完成，共{dst_count}行，已删除旧collection"
+    return True, f"collection[{name}]迁移完成，共{dst_count}行，旧collection保留为[{backup_name}]"
+
+
+def clear_bm25_persist_files():
+    """迁移后主键重新生成，删除持久化的BM25索引文件"""
+    persist_dir = helper.config.get('bm25_index', {}).get('persist_dir', '')
+    if not persist_dir:
+        return
+    for path in glob.glob(os.path.join(persist_dir, 'bm25_*.pkl')):
+        os.unlink(path)
+        logger.info(f"已删除BM25索引文件: {path}")
+
+
+def _target_collections(collection_type):
+    _, qa_name, doc_name = helper.get_global_collections()
+    targets = []
+    if collection_type in ('ALL', 'QA'):
+        targets.append((qa_name, helper.qa_collection_schema))
+    if collection_type in ('ALL', 'DOC'):
+        targets.append((doc_name, helper.doc_collection_schema))
+    return targets
+
+
+def _schema_like(db_name, name, schema_fn, **overrides):
+    """按collection现有的稀疏向量、partition key、向量存储类型及低维向量字段设置生成schema，overrides中的设置除外"""
+    collection = helper.collection_registry.get_collection(db_name, name, ensure_loaded=False)
+    coarse_field = next((f for f in collection.schema.fields if f.name == COARSE_FIELD), None)
+    settings = {
+        'with_sparse': helper.collection_registry.sparse_field(db_name, name) is not None,
+        'with_partition_key': helper.collection_registry.partition_key_field(db_name, name) is not None,
+        'vector_dtype': helper.embedding_mode(collection),
+        'coarse_dim': coarse_field.params['dim'] if coarse_field is not None else None
+    }
+    settings.update(overrides)
+    return schema_fn(**settings)
+
+
+def migrate_sparse(collection_type='ALL', batch_size=1000, drop_backup=False):
+    """为QA/DOC collection增加BM25稀疏向量字段（保留其他设置）"""
+    db_name = helper.get_global_collections()[0]
+    alias = helper.collection_registry.connect(db_name)
+    results = []
+    for name, schema_fn in _target_collections(collection_type):
+        if helper.collection_registry.sparse_field(db_name, name):
+            results.append((True, f"collection[{name}]已包含稀疏向量字段，无需迁移"))
+            continue
+        results.append(migrate_collection(alias, name, _schema_like(db_name, name, schema_fn, with_sparse=True),
+                                          batch_size=batch_size, drop_backup=drop_backup))
+    helper.collection_registry.invalidate(db_name)
+    clear_bm25_persist_files()
+    return results
+
+
+def migrate_partition_key(collection_type='ALL', batch_size=1000, drop_backup=False):
+    """以tenant_code作为partition key重建QA/DOC collection（保留其他设置）"""
+    db_name = helper.get_global_collections()[0]
+    alias = helper.collection_registry.connect(db_name)
+    results = []
+    for name, schema_fn in _target_collections(collection_type):
+        if helper.collection_registry.partition_key_field(db_name, name):
+            results.append((True, f"collection[{name}]已使用partition key，无需迁移"))
+            continue
+        results.append(migrate_collection(alias, name, _schema_like(db_name, name, schema_fn, with_partition_key=True),
+                                          batch_size=batch_size, drop_backup=drop_backup))
+    helper.collection_registry.invalidate(db_name)
+    clear_bm25_persist_files()
+    return results
+
+
+def reindex(collection_type='ALL', batch_size=1000, drop_backup=False):
+    """按config['index_params']重建QA/DOC collection的向量索引，索引未变化的跳过"""
+    db_name = helper.get_global_collections()[0]
+    alias = helper.collection_registry.connect(db_name)
+    index_params = helper.config['index_params']
+    results = []
+    for name, _ in _target_collections(collection_type):
+        if not utility.has_collection(name, using=alias):
+            results.append((False, f"collection[{name}]不存在"))
+            continue
+        current = helper.get_embedding_index_params(Collection(name, using=alias))
+        if not helper.index_params_changed(current, index_params):
+            results.append((True, f"collection[{name}]的向量索引与配置一致，无需重建"))
+            continue
+        results.append(migrate_collection(
+            alias, name, Collection(name, using=alias).schema,
+            create_indexes=lambda collection: helper.create_collection_indexes(collection, index_params),
+            batch_size=batch_size, drop_backup=drop_backup))
+    helper.collection_registry.invalidate(db_name)
+    clear_bm25_persist_files()
+    return results
+
+
+def migrate_vector_dtype(collection_type='ALL', batch_size=1000, drop_backup=False):
+    """按config['vector_storage']['dtype']转换QA/DOC collection的向量存储类型（保留其他设置）"""
+    db_name = helper.get_global_collections()[0]
+    alias = helper.collection_registry.connect(db_name)
+    mode = helper.vector_storage_mode()
+    supported_index_types = SUPPORTED_INDEX_TYPES.get(mode)
+    index_type = helper.config['index_params'].get('index_type')
+    if supported_index_types and index_type not in supported_index_types:
+        return [(False, f"向量存储类型{mode}只支持{sorted(supported_index_types)}索引，请先修改index_params（当前为{index_type}）")]
+    results = []
+    for name, schema_fn in _target_collections(collection_type):
+        if not utility.has_collection(name, using=alias):
+            results.append((False, f"collection[{name}]不存在"))
+            continue
+        current = helper.embedding_mode(Collection(name, using=alias))
+        if current == mode:
+            results.append((True, f"collection[{name}]的向量存储类型已是{mode}，无需迁移"))
+            continue
+        if current != 'FLOAT':
+            logger.warning(f"collection[{name}]的向量存储类型为{current}，转换为{mode}后精度不会高于{current}")
+        results.append(migrate_collection(alias, name, _schema_like(db_name, name, schema_fn, vector_dtype=mode),
+                                          batch_size=batch_size, drop_backup=drop_backup))
+    helper.collection_registry.invalidate(db_name)
+    clear_bm25_persist_files()
+    return results
+
+
+def fit_coarse(collection_type='ALL', refit=False, batch_size=1000, drop_backup=False):
+    """拟合降维投影并为QA/DOC collection增加（或按新投影重算）低维向量字段，迁移成功后切换投影版本"""
+    db_name = helper.get_global_collections()[0]
+    alias = helper.collection_registry.connect(db_name)
+    coarse_config = helper.config.get('coarse_search', {})
+    method, dim = coarse_config.get('method', 'pca'), coarse_config.get('dim', 256)
+    results = []
+    for name, schema_fn in _target_collections(collection_type):
+        if not utility.has_collection(name, using=alias):
+            results.append((False, f"collection[{name}]不存在"))
+            continue
+        collection = Collection(name, using=alias)
+        has_coarse = any(f.name == COARSE_FIELD for f in collection.schema.fields)
+        if has_coarse and not refit and helper.projection_store.active(name) is not None:
+            results.append((True, f"collection[{name}]已有可用的投影，无需拟合（重新拟合请使用--refit）"))
+            continue
+        try:
+            if method == 'random':
+                input_dim = next(f.params['dim'] for f in collection.schema.fields if f.name == 'embedding')
+                projection = Projection.random(input_dim, dim)
+            else:
+                projection = Projection.fit(sample_collection_vectors(helper.collection_registry, db_name, name,
+                                                                      coarse_config.get('fit_sample', 20000),
+                                                                      batch_size), dim)
+        except ValueError as e:
+            results.append((False, f"collection[{name}]拟合投影失败: {e}"))
+            continue
+        version = helper.projection_store.save(name, projection)
+
+        def add_coarse(rows, projection=projection, mode=helper.embedding_mode(collection)):
+            coarse_vectors = projection.project([decode_vector(row['embedding'], mode) for row in rows])
+            return [dict(row, **{COARSE_FIELD: vector.tolist()}) for row, vector in zip(rows, coarse_vectors)]
+
+        is_succ, msg = migrate_collection(alias, name, _schema_like(db_name, name, schema_fn, coarse_dim=projection.dim),
+                                          batch_size=batch_size, drop_backup=drop_backup, transform=add_coarse)
+        if is_succ:
+            helper.projection_store.activate(name, version)
+            msg = f"{msg}，投影版本{version}（{method}，{dim}维，解释方差{projection.explained_variance}）"
+        results.append((is_succ, msg))
+    helper.collection_registry.invalidate(db_name)
+    clear_bm25_persist_files()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='素材库collection迁移工具')
+    parser.add_argument('command', choices=['sparse', 'partition_key', 'reindex', 'vector_dtype', 'coarse'])
+    parser.add_argument('--type', default='ALL', choices=['ALL', 'QA', 'DOC'])
+    parser.add_argument('--batch-size', type=int,
+                        default=helper.config.get('corpus_loader', {}).get('batch_size', 1000))
+    parser.add_argument('--drop-backup', action='store_true', help='迁移成功后删除旧collection')
+    parser.add_argument('--refit', action='store_true', help='coarse命令：已有投影时也重新拟合')
+    args = parser.parse_args()
+    if helper.use_local_backend():
+        print("vector_backend为local，迁移工具只适用于Milvus后端")
+        return 1
+
+    try:
+        if args.command == 'coarse':
+            results = fit_coarse(args.type, args.refit, args.batch_size, args.drop_backup)
+        elif args.command == 'vector_dtype':
+            results = migrate_vector_dtype(args.type, args.batch_size, args.drop_backup)
+        elif args.command == 'reindex':
+            results = reindex(args.type, args.batch_size, args.drop_backup)
+        elif args.command == 'partition_key':
+            results = migrate_partition_key(args.type, args.batch_size, args.drop_backup)
+        else:
+            results = migrate_sparse(args.type, args.batch_size, args.drop_backup)
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        print(traceback.format_exc())
+        return 1
+    for is_succ, msg in results:
+        print(('成功: ' if is_succ else '失败: ') + msg)
+    if any(is_succ for is_succ, _ in results):
+        print("迁移后主键已重新生成，请重启已运行的素材库服务，使常驻的BM25索引和检索结果缓存重新加载")
+    return 0 if all(is_succ for is_succ, _ in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
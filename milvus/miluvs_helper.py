@@ -1,12 +1,30 @@
-from pymilvus import connections, utility, FieldSchema, CollectionSchema, DataType, Collection, db,SearchResult,Hits,Hit
+from pymilvus import FieldSchema, CollectionSchema, DataType, Collection
+from pymilvus import Function, FunctionType, AnnSearchRequest, RRFRanker, WeightedRanker
+from pymilvus.exceptions import MilvusUnavailableException
+import os
 import json
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-import torch
 from config.log_config import setup_vector_db_logging
-from rank_bm25 import BM25Okapi
 import jieba
-from collections import defaultdict
+import hashlib
+import time
+import functools
+import threading
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from milvus.bm25_index import BM25IndexManager
+from milvus.token_cache import TokenCache, CorpusTokenizer, set_jieba_cache_file
+from milvus.corpus_loader import iter_collection_batches
+from milvus.collection_registry import MilvusCollectionRegistry
+from milvus.local_backend import LocalCollectionRegistry
+from milvus.ingest_pipeline import iter_doc_chunks, run_ingest_pipeline
+from embedding_utils.query_cache import QueryEmbeddingCache
+from milvus.result_cache import SearchResultCache
+from milvus.vector_storage import (milvus_dtype, mode_of, encode_vectors, decode_vector, rescore_hits,
+                                   SUPPORTED_INDEX_TYPES)
+from milvus.projection import ProjectionStore, COARSE_FIELD
+from milvus.chunk_dedup import ChunkDedupManager, DedupRefStore
+from embedding_utils.backends import build_embedding_model
 
 import logging
 setup_vector_db_logging()
@@ -16,25 +34,180 @@ logger = logging.getLogger('vector_db')
 with open('./config/config.json', 'r', encoding='utf-8') as f:
     config = json.load(f)
 
-# 检测CUDA是否可用
-try:
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    logger.info(f"检测到设备: {device}")
-except ImportError:
-    device = 'cpu'
-    logger.warning("未安装torch，使用CPU设备")
+def use_local_backend():
+    """是否使用进程内向量库后端（config['vector_backend']为local，见milvus/local_backend.py）"""
+    return config.get('vector_backend', 'milvus') == 'local'
 
 
-embedding_model = HuggingFaceBgeEmbeddings(
-    model_name=config['embedding_model_path'],
-    # model_name="BAAI/bge-large-zh-v1.5",
-    model_kwargs = {'device': device},
-    encode_kwargs={'normalize_embeddings': True}  # set True to compute cosine similarity
-)
+# 进程级Milvus连接与collection句柄缓存；使用进程内后端时接口相同，collection数据保存在local_backend.data_dir
+collection_registry = LocalCollectionRegistry(config.get('local_backend', {})) if use_local_backend() \
+    else MilvusCollectionRegistry(config['milvus'])
+
+
+# 向量模型后端由config['embedding_backend']选择（torch/onnx/remote），输出维度与归一化方式一致，
+# 并按配置包装动态合批与持久化向量缓存
+embedding_model, embedding_model_id = build_embedding_model(config)
+
+# 查询向量进程内缓存：重复的查询直接复用向量，不再调用模型
+query_cache_config = config.get('query_cache', {})
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=query_cache_config.get('max_entries', 10000),
+    ttl_seconds=query_cache_config.get('ttl_seconds', 3600)
+) if query_cache_config.get('enabled', False) else None
+
+
+# 检索结果进程内缓存：相同参数的检索直接返回结果，写入/删除后按租户/组织的写入版本号失效
+result_cache_config = config.get('result_cache', {})
+search_result_cache = SearchResultCache(
+    max_entries=result_cache_config.get('max_entries', 2000),
+    max_bytes=int(result_cache_config.get('max_size_mb', 256)) * 1024 * 1024,
+    ttl_seconds=result_cache_config.get('ttl_seconds', 600)
+) if result_cache_config.get('enabled', False) else None
+
+
+def _bump_write_version(func):
+    """写入/删除数据的函数执行后（无论成功与否）递增该租户/组织的写入版本号，使相关检索结果缓存失效
+
+    只装饰实际执行写入的函数，insert_*只是转调upsert_*，不再重复装饰
+    """
+    @functools.wraps(func)
+    def wrapper(tenant_code=None, org_code=None, *args, **kwargs):
+        try:
+            return func(tenant_code, org_code, *args, **kwargs)
+        finally:
+            if search_result_cache is not None:
+                search_result_cache.bump(tenant_code, org_code)
+    return wrapper
+
+
+def get_result_cache_stats():
+    """返回检索结果缓存的命中统计，未启用时返回None"""
+    if search_result_cache is None:
+        return None
+    return search_result_cache.stats()
+
+
+def embed_queries(query_list):
+    """生成查询向量，启用查询缓存时先读缓存"""
+    if query_embedding_cache is None:
+        return embedding_model.embed_documents(query_list)
+    return query_embedding_cache.embed(query_list, embedding_model.embed_documents)
+
+
+def get_query_cache_stats():
+    """返回查询向量缓存的命中统计，未启用时返回None"""
+    if query_embedding_cache is None:
+        return None
+    return query_embedding_cache.stats()
+
+
+# 稀疏向量字段名及其索引参数（Milvus内置BM25函数由文本字段自动生成，检索时在服务端完成BM25打分）
+SPARSE_FIELD = 'sparse'
+SPARSE_INDEX_PARAMS = {'index_type': 'SPARSE_INVERTED_INDEX', 'metric_type': 'BM25'}
+
+
+def use_milvus_hybrid():
+    """是否使用Milvus服务端混合检索（稀疏向量 + 稠密向量 + 服务端RRF融合），进程内后端不支持"""
+    return config.get('hybrid_search', {}).get('mode', 'client') == 'milvus' and not use_local_backend()
+
+
+def use_partition_key():
+    """新建collection时是否以tenant_code作为partition key（按租户自动分区，检索只扫描对应租户的分区）"""
+    return config.get('collection_layout', {}).get('partition_key', False)
+
+
+def vector_storage_mode():
+    """新建collection时embedding字段的存储类型：FLOAT/FLOAT16/BFLOAT16/INT8"""
+    return config.get('vector_storage', {}).get('dtype', 'FLOAT')
+
+
+def embedding_mode(collection):
+    """collection中embedding字段实际的存储类型（迁移前可能与配置不同）"""
+    return mode_of(next(f.dtype for f in collection.schema.fields if f.name == 'embedding'))
+
+
+def rescore_oversample(mode):
+    """低精度存储且开启精排时返回候选集的扩大倍数，否则返回0"""
+    storage_config = config.get('vector_storage', {})
+    if mode == 'FLOAT' or not storage_config.get('rescore', True):
+        return 0
+    return max(1, int(storage_config.get('rescore_oversample', 4)))
+
+
+# 两级检索：低维向量召回候选，完整向量精排
+coarse_config = config.get('coarse_search', {})
+projection_store = ProjectionStore(coarse_config.get('projection_dir', './data/projection'))
+
+
+def coarse_index_params():
+    """低维向量字段的索引参数，未配置时与embedding字段相同"""
+    return config.get('coarse_search', {}).get('index_params') or config['index_params']
 
 
-def qa_collection_schema():
-    """全局QA collection的schema，包含tenant_code和org_code字段"""
+def has_coarse_field(collection):
+    return any(f.name == COARSE_FIELD for f in collection.schema.fields)
+
+
+def coarse_projection(collection):
+    """collection带低维向量字段时返回当前使用的投影，没有字段或没有可用投影时返回None"""
+    if not has_coarse_field(collection):
+        return None
+    projection = projection_store.active(collection.name)
+    if projection is None:
+        logger.warning(f"collection[{collection.name}]带有{COARSE_FIELD}字段，但没有可用的投影，"
+                       f"请使用 python -m milvus.migrate_tool coarse --refit 重新拟合")
+    return projection
+
+
+def _coarse_vectors(collection, embeddings):
+    """按collection当前的投影计算低维向量，collection不带低维向量字段时返回None"""
+    if not has_coarse_field(collection):
+        return None
+    projection = coarse_projection(collection)
+    if projection is None:
+        raise ValueError(f"collection[{collection.name}]没有可用的投影，无法写入{COARSE_FIELD}字段")
+    return projection.project(list(embeddings)).tolist()
+
+
+def collection_create_kwargs(schema):
+    """创建collection时的额外参数：schema带partition key时指定分区数"""
+    if schema.partition_key_field is None:
+        return {}
+    return {'num_partitions': config.get('collection_layout', {}).get('num_partitions', 64)}
+
+
+def _collection_schema(fields, text_field, with_sparse, with_partition_key, coarse_dim=None):
+    """构建schema
+
+    with_sparse为True时为text_field开启分词并增加由BM25函数生成的稀疏向量字段；
+    with_partition_key为True时以tenant_code作为partition key；
+    coarse_dim不为None时增加该维度的低维向量字段（两级检索）
+    """
+    if with_partition_key:
+        fields = [FieldSchema(name=f.name, dtype=DataType.VARCHAR, max_length=f.params['max_length'],
+                              is_partition_key=True) if f.name == 'tenant_code' else f for f in fields]
+    if coarse_dim:
+        fields = fields + [FieldSchema(name=COARSE_FIELD, dtype=DataType.FLOAT_VECTOR, dim=coarse_dim)]
+    if not with_sparse:
+        return CollectionSchema(fields=fields)
+    analyzer_params = config.get('hybrid_search', {}).get('analyzer_params', {'tokenizer': 'jieba'})
+    fields = [FieldSchema(name=f.name, dtype=DataType.VARCHAR, max_length=f.params['max_length'], enable_analyzer=True,
+                          analyzer_params=analyzer_params) if f.name == text_field else f for f in fields]
+    fields.append(FieldSchema(name=SPARSE_FIELD, dtype=DataType.SPARSE_FLOAT_VECTOR))
+    bm25_function = Function(name=f'{text_field}_bm25', function_type=FunctionType.BM25,
+                             input_field_names=[text_field], output_field_names=[SPARSE_FIELD])
+    return CollectionSchema(fields=fields, functions=[bm25_function])
+
+
+def qa_collection_schema(with_sparse=None, with_partition_key=None, vector_dtype=None, coarse_dim=None):
+    """全局QA collection的schema，包含tenant_code和org_code字段
+
+    Args:
+        with_sparse: 是否包含question的BM25稀疏向量字段，为None时根据hybrid_search.mode决定
+        with_partition_key: 是否以tenant_code作为partition key，为None时根据collection_layout.partition_key决定
+        vector_dtype: embedding字段的存储类型，为None时根据vector_storage.dtype决定
+        coarse_dim: 两级检索低维向量字段的维度，为None时不包含（需先拟合投影，见migrate_tool coarse）
+    """
     fields = [
         FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
         FieldSchema(name='question', dtype=DataType.VARCHAR, max_length=2000),
@@ -42,14 +215,22 @@ def qa_collection_schema():
         FieldSchema(name='source', dtype=DataType.VARCHAR, max_length=2000),
         FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=200),
         FieldSchema(name='org_code', dtype=DataType.VARCHAR, max_length=200),
-        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=1024),
+        FieldSchema(name='embedding', dtype=milvus_dtype(vector_dtype or vector_storage_mode()), dim=1024),
         FieldSchema(name='metadata', dtype=DataType.JSON, max_length=2000)
     ]
-    return CollectionSchema(fields=fields)
+    return _collection_schema(fields, 'question', use_milvus_hybrid() if with_sparse is None else with_sparse,
+                              use_partition_key() if with_partition_key is None else with_partition_key, coarse_dim)
+
 
+def doc_collection_schema(with_sparse=None, with_partition_key=None, vector_dtype=None, coarse_dim=None):
+    """全局DOC collection的schema，包含tenant_code和org_code字段
 
-def doc_collection_schema():
-    """全局DOC collection的schema，包含tenant_code和org_code字段"""
+    Args:
+        with_sparse: 是否包含content的BM25稀疏向量字段，为None时根据hybrid_search.mode决定
+        with_partition_key: 是否以tenant_code作为partition key，为None时根据collection_layout.partition_key决定
+        vector_dtype: embedding字段的存储类型，为None时根据vector_storage.dtype决定
+        coarse_dim: 两级检索低维向量字段的维度，为None时不包含（需先拟合投影，见migrate_tool coarse）
+    """
     fields = [
         FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
         FieldSchema(name='file_name', dtype=DataType.VARCHAR, max_length=2000),
@@ -58,10 +239,119 @@ def doc_collection_schema():
         FieldSchema(name='source', dtype=DataType.VARCHAR, max_length=2000),
         FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=200),
         FieldSchema(name='org_code', dtype=DataType.VARCHAR, max_length=200),
-        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=1024),
+        FieldSchema(name='embedding', dtype=milvus_dtype(vector_dtype or vector_storage_mode()), dim=1024),
         FieldSchema(name='metadata', dtype=DataType.JSON, max_length=2000)
     ]
-    return CollectionSchema(fields=fields)
+    return _collection_schema(fields, 'content', use_milvus_hybrid() if with_sparse is None else with_sparse,
+                              use_partition_key() if with_partition_key is None else with_partition_key, coarse_dim)
+
+
+def create_collection_indexes(collection, index_params=None):
+    """为collection创建向量索引、tenant_code/org_code的VARCHAR索引及稀疏向量索引（已存在的跳过）
+
+    Args:
+        index_params: 向量索引参数，为None时使用config['index_params']
+    """
+    ensure_index_exists(collection, "embedding", index_params or config['index_params'])
+    varchar_index_params = config.get('varchar_index_params', {'index_type': 'INVERTED'})
+    ensure_index_exists(collection, "tenant_code", varchar_index_params)
+    ensure_index_exists(collection, "org_code", varchar_index_params)
+    if any(f.name == SPARSE_FIELD for f in collection.schema.fields):
+        ensure_index_exists(collection, SPARSE_FIELD, SPARSE_INDEX_PARAMS)
+    if any(f.name == COARSE_FIELD for f in collection.schema.fields):
+        ensure_index_exists(collection, COARSE_FIELD, coarse_index_params())
+
+
+def vector_search_params(index_type=None):
+    """返回向量检索参数：search_params_by_index中配置了当前索引类型时使用对应参数，否则使用search_params
+
+    HNSW使用ef，IVF系列使用nprobe，FLAT无需参数；切换索引类型后只需修改index_params
+    """
+    index_params = config['index_params']
+    index_type = index_type or index_params.get('index_type', 'FLAT')
+    by_index = config.get('search_params_by_index', {})
+    if index_type in by_index:
+        return {'metric_type': index_params.get('metric_type', 'COSINE'), 'params': dict(by_index[index_type])}
+    return config['search_params']
+
+
+def get_embedding_index_params(collection):
+    """返回collection中embedding字段当前的索引参数，没有索引时返回None"""
+    for index in collection.indexes:
+        if index.field_name == 'embedding':
+            params = dict(index.params)
+            if isinstance(params.get('params'), str):
+                params['params'] = json.loads(params['params'])
+            return params
+    return None
+
+
+def index_params_changed(current, expected):
+    """比较现有向量索引与配置的索引类型、度量方式及构建参数"""
+    if current is None:
+        return False
+    if current.get('index_type') != expected.get('index_type') or current.get('metric_type') != expected.get('metric_type'):
+        return True
+    # FLAT没有构建参数，配置中多余的参数（如nlist）不视为变化
+    if expected.get('index_type') == 'FLAT':
+        return False
+    current_build = {k: str(v) for k, v in (current.get('params') or {}).items()}
+    expected_build = {k: str(v) for k, v in (expected.get('params') or {}).items()}
+    return current_build != expected_build
+
+
+def rebuild_embedding_index(alias, collection_name, index_params=None):
+    """在线重建向量索引：按新索引参数创建新collection并复制数据，校验行数后重命名切换
+
+    复制期间旧collection照常提供检索，切换前后的写入请暂停；旧collection保留为备份
+
+    Returns:
+        (is_succ, msg)
+    """
+    # 迁移工具依赖本模块，在函数内导入避免循环引用
+    from milvus.migrate_tool import migrate_collection, clear_bm25_persist_files
+
+    index_params = index_params or config['index_params']
+    rebuild_config = config.get('index_rebuild', {})
+    schema = Collection(collection_name, using=alias).schema
+    logger.info(f"开始在线重建素材库[{collection_name}]的向量索引: {index_params}")
+    is_succ, msg = migrate_collection(
+        alias, collection_name, schema,
+        create_indexes=lambda collection: create_collection_indexes(collection, index_params),
+        batch_size=rebuild_config.get('batch_size', 1000),
+        drop_backup=rebuild_config.get('drop_backup', False)
+    )
+    if is_succ:
+        # 复制后主键重新生成，持久化的和进程内常驻的BM25索引、检索结果缓存都失效
+        clear_bm25_persist_files()
+        bm25_index_manager.drop(collection_name)
+        if search_result_cache is not None:
+            search_result_cache.clear()
+    logger.info(f"在线重建向量索引{'成功' if is_succ else '失败'}: {msg}")
+    return is_succ, msg
+
+
+def _check_embedding_index(db_name, collection_name):
+    """已存在的collection向量索引与config['index_params']不一致时，按index_rebuild.mode告警或在线重建
+
+    进程内后端的索引加载时在内存中构建，直接按新参数重建
+    """
+    collection = collection_registry.open_collection(db_name, collection_name)
+    current = get_embedding_index_params(collection)
+    if not index_params_changed(current, config['index_params']):
+        return
+    if use_local_backend():
+        logger.info(f"素材库[{collection_name}]的向量索引{current}与配置{config['index_params']}不一致，按配置重建")
+        collection.drop_index(index_name='embedding')
+        create_collection_indexes(collection)
+        return
+    if config.get('index_rebuild', {}).get('mode', 'none') != 'online':
+        logger.warning(f"素材库[{collection_name}]的向量索引{current}与配置{config['index_params']}不一致，"
+                       f"将index_rebuild.mode设为online后重新初始化，或使用 python -m milvus.migrate_tool reindex 重建")
+        return
+    is_succ, msg = rebuild_embedding_index(collection_registry.connect(db_name), collection_name)
+    if not is_succ:
+        logger.error(f"素材库[{collection_name}]在线重建向量索引失败，继续使用原索引: {msg}")
 
 
 def get_global_collections():
@@ -97,77 +387,96 @@ def create_collection():
     """创建全局素材库和两个全局collection（如果不存在）"""
     logger.info(f"调用方法:create_collection，创建全局素材库和collection")
 
-    config_milvus_dic = config['milvus']
-    index_params = config['index_params']
-    varchar_index_params = config.get('varchar_index_params', {'index_type': 'INVERTED'})
-    
     global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
 
     # 连接并创建全局数据库（如果不存在）
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'])
-    if global_db_name not in db.list_database():
-        db.create_database(global_db_name)
+    if collection_registry.ensure_database(global_db_name):
         logger.info(f"全局数据库[{global_db_name}]创建成功")
     
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
+    # 连接到全局数据库，创建前清除缓存，保证以Milvus中的实际状态为准
+    collection_registry.invalidate(global_db_name)
+    exist_collection_list = collection_registry.list_collections(global_db_name)
     
     # 创建全局QA collection（如果不存在）
     if global_collection_qa_name not in exist_collection_list:
-        collection = Collection(global_collection_qa_name, schema=qa_collection_schema())
-        # 为embedding字段创建向量索引
-        collection.create_index(field_name="embedding", index_params=index_params)
-        # 为tenant_code和org_code字段创建VARCHAR索引
-        collection.create_index(field_name="tenant_code", index_params=varchar_index_params)
-        collection.create_index(field_name="org_code", index_params=varchar_index_params)
+        schema = qa_collection_schema()
+        collection = collection_registry.create_collection(global_db_name, global_collection_qa_name, schema,
+                                                           **collection_create_kwargs(schema))
+        # 为embedding、tenant_code、org_code（及稀疏向量）字段创建索引
+        create_collection_indexes(collection)
         collection.load()
         logger.info(f"全局素材库[{global_collection_qa_name}]创建成功，已为embedding、tenant_code、org_code字段创建索引")
     else:
         # collection已存在，检查并创建缺失的索引
-        collection = Collection(global_collection_qa_name)
-        ensure_index_exists(collection, "embedding", index_params)
-        ensure_index_exists(collection, "tenant_code", varchar_index_params)
-        ensure_index_exists(collection, "org_code", varchar_index_params)
+        collection = collection_registry.open_collection(global_db_name, global_collection_qa_name)
+        create_collection_indexes(collection)
+        _check_embedding_index(global_db_name, global_collection_qa_name)
         logger.info(f"全局素材库[{global_collection_qa_name}]已存在，已确保所有索引存在")
     
     # 创建全局DOC collection（如果不存在）
     if global_collection_doc_name not in exist_collection_list:
-        collection = Collection(global_collection_doc_name, schema=doc_collection_schema())
-        # 为embedding字段创建向量索引
-        collection.create_index(field_name="embedding", index_params=index_params)
-        # 为tenant_code和org_code字段创建VARCHAR索引
-        collection.create_index(field_name="tenant_code", index_params=varchar_index_params)
-        collection.create_index(field_name="org_code", index_params=varchar_index_params)
+        schema = doc_collection_schema()
+        collection = collection_registry.create_collection(global_db_name, global_collection_doc_name, schema,
+                                                           **collection_create_kwargs(schema))
+        # 为embedding、tenant_code、org_code（及稀疏向量）字段创建索引
+        create_collection_indexes(collection)
         collection.load()
         logger.info(f"全局素材库[{global_collection_doc_name}]创建成功，已为embedding、tenant_code、org_code字段创建索引")
     else:
         # collection已存在，检查并创建缺失的索引
-        collection = Collection(global_collection_doc_name)
-        ensure_index_exists(collection, "embedding", index_params)
-        ensure_index_exists(collection, "tenant_code", varchar_index_params)
-        ensure_index_exists(collection, "org_code", varchar_index_params)
+        collection = collection_registry.open_collection(global_db_name, global_collection_doc_name)
+        create_collection_indexes(collection)
+        _check_embedding_index(global_db_name, global_collection_doc_name)
         logger.info(f"全局素材库[{global_collection_doc_name}]已存在，已确保所有索引存在")
 
+    if use_milvus_hybrid():
+        for name in (global_collection_qa_name, global_collection_doc_name):
+            if SPARSE_FIELD not in [f.name for f in collection_registry.open_collection(global_db_name, name).schema.fields]:
+                logger.warning(f"hybrid_search.mode为milvus，但素材库[{name}]没有稀疏向量字段，混合检索将回退到进程内BM25，"
+                               f"请使用 python -m milvus.migrate_tool sparse 迁移")
+    if use_partition_key():
+        for name in (global_collection_qa_name, global_collection_doc_name):
+            if collection_registry.open_collection(global_db_name, name).schema.partition_key_field is None:
+                logger.warning(f"collection_layout.partition_key已开启，但素材库[{name}]未以tenant_code作为partition key，"
+                               f"检索仍会扫描全部租户的数据，请使用 python -m milvus.migrate_tool partition_key 迁移")
+    for name in (global_collection_qa_name, global_collection_doc_name):
+        mode = embedding_mode(collection_registry.open_collection(global_db_name, name))
+        # 进程内后端统一以float32存储向量
+        if mode != vector_storage_mode() and not use_local_backend():
+            logger.warning(f"vector_storage.dtype为{vector_storage_mode()}，但素材库[{name}]的向量存储类型为{mode}，"
+                           f"请使用 python -m milvus.migrate_tool vector_dtype 迁移")
+    if config.get('coarse_search', {}).get('enabled', False):
+        for name in (global_collection_qa_name, global_collection_doc_name):
+            if not has_coarse_field(collection_registry.open_collection(global_db_name, name)):
+                logger.warning(f"coarse_search已开启，但素材库[{name}]没有低维向量字段，检索仍使用单级向量检索，"
+                               f"请使用 python -m milvus.migrate_tool coarse 拟合投影并迁移")
+    supported_index_types = SUPPORTED_INDEX_TYPES.get(vector_storage_mode())
+    if supported_index_types and config['index_params'].get('index_type') not in supported_index_types:
+        logger.warning(f"向量存储类型{vector_storage_mode()}只支持{sorted(supported_index_types)}索引，"
+                       f"当前index_params为{config['index_params']}")
+
+    # collection可能新建或重建，清除缓存让后续请求重新获取句柄、重新检索
+    collection_registry.invalidate(global_db_name)
+    if search_result_cache is not None:
+        search_result_cache.clear()
     logger.info(f"全局素材库和collection初始化完成")
     return True, f"全局素材库和collection初始化完成"
 
 
+@_bump_write_version
 def delete_collection(tenant_code=None, org_code=None):
     """删除全局collection中的数据（根据tenant_code和org_code过滤）"""
     logger.info(f"调用方法:delete_collection，参数为:tenant_code={tenant_code}, org_code={org_code}")
 
-    config_milvus_dic = config['milvus']
     global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
 
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-
-    if global_collection_qa_name not in exist_collection_list:
+    qa_collection = collection_registry.get_collection(global_db_name, global_collection_qa_name)
+    if qa_collection is None:
         logger.error(f"全局素材库[{global_collection_qa_name}]不存在")
         return False, f"全局素材库[{global_collection_qa_name}]不存在"
 
-    if global_collection_doc_name not in exist_collection_list:
+    doc_collection = collection_registry.get_collection(global_db_name, global_collection_doc_name)
+    if doc_collection is None:
         logger.error(f"全局素材库[{global_collection_doc_name}]不存在")
         return False, f"全局素材库[{global_collection_doc_name}]不存在"
 
@@ -183,16 +492,22 @@ def delete_collection(tenant_code=None, org_code=None):
     deleted_count = 0
     if filter_expr:
         # 删除QA collection中的数据
-        qa_collection = Collection(global_collection_qa_name)
         qa_collection.delete(filter_expr)
         qa_collection.flush()
         logger.info(f"从全局QA素材库删除数据，过滤条件: {filter_expr}")
 
         # 删除DOC collection中的数据
-        doc_collection = Collection(global_collection_doc_name)
         doc_collection.delete(filter_expr)
         doc_collection.flush()
         logger.info(f"从全局DOC素材库删除数据，过滤条件: {filter_expr}")
+
+        # 同步删除已加载BM25索引中的数据
+        conditions = _bm25_delete_conditions(tenant_code, org_code)
+        bm25_index_manager.on_delete(global_collection_qa_name, conditions)
+        bm25_index_manager.on_delete(global_collection_doc_name, conditions)
+        if chunk_dedup_manager is not None:
+            chunk_dedup_manager.invalidate(global_collection_doc_name, tenant_code, org_code)
+            chunk_dedup_manager.ref_store.remove_scope(global_collection_doc_name, tenant_code, org_code)
     else:
         logger.warning("未提供tenant_code或org_code，无法删除数据")
 
@@ -200,58 +515,368 @@ def delete_collection(tenant_code=None, org_code=None):
     return True, f"从全局素材库删除数据成功"
 
 
+def _escape_expr_value(value):
+    """转义Milvus表达式中的字符串值"""
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def _scope_filter_parts(tenant_code, org_code, exact=False):
+    """构建租户/组织过滤条件
+
+    Args:
+        exact: 为True时即使tenant_code/org_code为空也加入条件（只匹配完全相同的范围）
+    """
+    filter_parts = []
+    if tenant_code or exact:
+        filter_parts.append(f"tenant_code == '{_escape_expr_value(tenant_code or '')}'")
+    if org_code or exact:
+        filter_parts.append(f"org_code == '{_escape_expr_value(org_code or '')}'")
+    return filter_parts
+
+
+def _key_batches(keys):
+    """将去重后的键值按配置的批次大小分组，用于构建 in [...] 表达式"""
+    batch_size = config.get('ingest', {}).get('expr_batch_size', 500)
+    unique_keys = list(dict.fromkeys(str(k) for k in keys))
+    for start in range(0, len(unique_keys), batch_size):
+        yield unique_keys[start:start + batch_size]
+
+
+def _in_expr(key_field, keys, scope_parts):
+    """构建 key_field in [...] && 范围条件 的表达式"""
+    values = ", ".join(f"'{_escape_expr_value(k)}'" for k in keys)
+    return " && ".join([f"{key_field} in [{values}]"] + scope_parts)
+
+
+def _find_existing_keys(collection, key_field, keys, scope_parts):
+    """分批用 in [...] 表达式检查哪些键值已存在，返回已存在键值的集合"""
+    batch_size = config.get('corpus_loader', {}).get('batch_size', 1000)
+    existing = set()
+    for key_batch in _key_batches(keys):
+        expr = _in_expr(key_field, key_batch, scope_parts)
+        for rows in iter_collection_batches(collection, expr=expr, output_fields=[key_field], batch_size=batch_size):
+            existing.update(row.get(key_field) for row in rows)
+    return existing
+
+
+def _delete_by_keys(collection, key_field, keys, scope_parts):
+    """分批用 in [...] 表达式删除数据，调用方负责flush"""
+    batch_count = 0
+    for key_batch in _key_batches(keys):
+        collection.delete(_in_expr(key_field, key_batch, scope_parts))
+        batch_count += 1
+    return batch_count
+
+
+def _id_batches(ids):
+    """将主键按配置的批次大小分组，用于构建 id in [...] 表达式"""
+    batch_size = config.get('ingest', {}).get('expr_batch_size', 500)
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    for start in range(0, len(ids), batch_size):
+        yield ids[start:start + batch_size]
+
+
+def _delete_by_ids(collection, ids):
+    """按主键分批删除，调用方负责flush"""
+    for id_batch in _id_batches(ids):
+        collection.delete(f"id in [{', '.join(str(i) for i in id_batch)}]")
+
+
+def _fetch_embeddings(collection, ids):
+    """按主键分批读取已存储的向量，返回{id: embedding}"""
+    mode = embedding_mode(collection)
+    embeddings = {}
+    for id_batch in _id_batches(ids):
+        rows = collection.query(expr=f"id in [{', '.join(str(i) for i in id_batch)}]",
+                                output_fields=['id', 'embedding'])
+        for row in rows:
+            embeddings[row['id']] = list(row['embedding']) if mode == 'FLOAT' else decode_vector(row['embedding'], mode)
+    return embeddings
+
+
+def _chunk_hash(content):
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def _diff_doc_chunks(stored_rows, new_chunks):
+    """比较已存储分块与新分块，返回(保持不变的分块, 需要复用向量重新写入的(旧id, 新分块), 新增分块, 需删除的旧id)
+
+    分块按内容哈希匹配，优先匹配block_id相同的旧分块；内容未变但block_id、source或metadata变化的分块
+    复用已存储的向量重新写入，只有新增内容需要向量化
+    """
+    by_hash = defaultdict(list)
+    for row in sorted(stored_rows, key=lambda r: r.get('block_id', 0)):
+        by_hash[_chunk_hash(row.get('content'))].append(row)
+
+    kept, moved, added = [], [], []
+    unmatched = []
+    for chunk in new_chunks:
+        candidates = by_hash.get(_chunk_hash(chunk['content']))
+        match = None
+        if candidates:
+            for i, row in enumerate(candidates):
+                if row.get('block_id') == chunk['block_id']:
+                    match = candidates.pop(i)
+                    break
+        if match is None:
+            unmatched.append(chunk)
+        elif match.get('source') == chunk['source'] and _without_dedup_link(match.get('metadata')) == chunk['metadata']:
+            kept.append(chunk)
+        else:
+            moved.append((match['id'], chunk))
+    # block_id变化的分块在第二轮匹配，避免抢占block_id相同的旧分块
+    for chunk in unmatched:
+        candidates = by_hash.get(_chunk_hash(chunk['content']))
+        if candidates:
+            moved.append((candidates.pop(0)['id'], chunk))
+        else:
+            added.append(chunk)
+    removed_ids = [row['id'] for rows in by_hash.values() for row in rows]
+    return kept, moved, added, removed_ids
+
+
+# 入库近重复分块检测：与同一租户/组织下其他文件的分块相似度达到阈值的分块跳过或链接到已有分块，
+# 对应关系记录在ref_db中，来源分块删除或替换时由重复分块接替
+dedup_config = config.get('chunk_dedup', {})
+chunk_dedup_manager = ChunkDedupManager(
+    threshold=dedup_config.get('threshold', 0.95),
+    ngram=dedup_config.get('ngram', 3),
+    max_scopes=dedup_config.get('max_scopes', 64),
+    ref_store=DedupRefStore(dedup_config.get('ref_db') or './data/chunk_dedup/refs.sqlite')
+) if dedup_config.get('enabled', False) else None
+
+
+def get_dedup_stats():
+    """返回近重复分块检测的统计（检查的分块数、重复分块数、去重比例），未启用时返回None"""
+    if chunk_dedup_manager is None:
+        return None
+    return dict(chunk_dedup_manager.stats(), mode=dedup_config.get('mode', 'skip'))
+
+
+def _get_dedup_scope(collection, collection_name, tenant_code, org_code, scope_parts):
+    """获取租户/组织范围内的近重复检测索引，首次访问该范围时从collection加载已存储分块的签名"""
+    batch_size = config.get('corpus_loader', {}).get('batch_size', 1000)
+    return chunk_dedup_manager.get_scope(
+        collection_name, tenant_code, org_code,
+        row_loader=lambda: iter_collection_batches(collection, expr=" && ".join(scope_parts), batch_size=batch_size,
+                                                   output_fields=['file_name', 'block_id', 'content', 'metadata'])
+    )
+
+
+def _link_metadata(metadata, canonical_key, similarity):
+    """链接模式下在重复分块的metadata中记录对应的已有分块，metadata不是字典时保持不变"""
+    if not isinstance(metadata, dict):
+        return metadata
+    return dict(metadata, duplicate_of={'file_name': canonical_key[0], 'block_id': canonical_key[1],
+                                        'similarity': round(similarity, 4)})
+
+
+def _without_dedup_link(metadata):
+    """去掉链接模式写入的duplicate_of，用于比较分块的metadata是否变化"""
+    if isinstance(metadata, dict) and 'duplicate_of' in metadata:
+        return {k: v for k, v in metadata.items() if k != 'duplicate_of'}
+    return metadata
+
+
+def _query_chunks_by_keys(collection, scope_parts, keys, output_fields):
+    """按(file_name, block_id)分批查询范围内已存储的分块"""
+    block_ids_by_file = defaultdict(list)
+    for file_name, block_id in keys:
+        block_ids_by_file[file_name].append(block_id)
+    for file_name, block_ids in block_ids_by_file.items():
+        for id_batch in _id_batches(block_ids):
+            expr = " && ".join([f"file_name == '{_escape_expr_value(file_name)}'",
+                                f"block_id in [{', '.join(str(i) for i in id_batch)}]"] + scope_parts)
+            # 分块可能是本次请求刚写入的，需要强一致读取
+            yield from collection.query(expr=expr, output_fields=output_fields, consistency_level='Strong')
+
+
+def _fetch_chunk_embeddings(collection, scope_parts, keys):
+    """按(file_name, block_id)读取范围内已存储分块的向量，返回{(file_name, block_id): embedding}"""
+    mode = embedding_mode(collection)
+    embeddings = {}
+    for row in _query_chunks_by_keys(collection, scope_parts, keys, ['file_name', 'block_id', 'embedding']):
+        embedding = row['embedding']
+        embeddings[(row['file_name'], row['block_id'])] = \
+            list(embedding) if mode == 'FLOAT' else decode_vector(embedding, mode)
+    return embeddings
+
+
+def _insert_doc_chunks(collection, collection_name, tenant_code, org_code, chunks, block_embeddings):
+    """写入文档分块并增量更新已加载的BM25索引，调用方负责flush"""
+    # 准备数据：file_name, block_id, content, source, tenant_code, org_code, embedding, metadata
+    data = [[c['file_name'] for c in chunks], [c['block_id'] for c in chunks], [c['content'] for c in chunks],
+            [c['source'] for c in chunks], [tenant_code] * len(chunks), [org_code] * len(chunks),
+            encode_vectors(block_embeddings, embedding_mode(collection)), [c['metadata'] for c in chunks]]
+    coarse_vectors = _coarse_vectors(collection, block_embeddings)
+    if coarse_vectors is not None:
+        data.append(coarse_vectors)
+    mutation_result = collection.insert(data=data)
+
+    # 增量更新已加载的BM25索引
+    bm25_entities = [dict(c, id=pk, tenant_code=tenant_code, org_code=org_code)
+                     for pk, c in zip(mutation_result.primary_keys, chunks)]
+    bm25_index_manager.on_insert(collection_name, tenant_code, org_code, bm25_entities,
+                                 tokens=_ingest_tokens([c['content'] for c in chunks]))
+
+
+def _relink_doc_chunks(collection, collection_name, tenant_code, org_code, scope_parts, targets):
+    """重写link模式分块metadata中的duplicate_of，targets为{(file_name, block_id): 新的来源分块键，为None时去掉}
+
+    标量字段不能原地修改，按主键删除后复用已存储的向量重新写入，调用方负责flush；返回重新写入的分块
+    """
+    mode = embedding_mode(collection)
+    rows = list(_query_chunks_by_keys(collection, scope_parts, targets.keys(),
+                                      ['id', 'file_name', 'block_id', 'content', 'source', 'metadata', 'embedding']))
+    if not rows:
+        return []
+    chunks, embeddings = [], []
+    for row in rows:
+        link = row['metadata'].get('duplicate_of') if isinstance(row['metadata'], dict) else None
+        metadata = _without_dedup_link(row['metadata'])
+        new_key = targets[(row['file_name'], row['block_id'])]
+        if new_key is not None:
+            metadata = _link_metadata(metadata, new_key, (link or {}).get('similarity', 1.0))
+        chunks.append({'file_name': row['file_name'], 'block_id': row['block_id'], 'content': row['content'],
+                       'source': row['source'], 'metadata': metadata})
+        embeddings.append(list(row['embedding']) if mode == 'FLOAT' else decode_vector(row['embedding'], mode))
+    ids = [row['id'] for row in rows]
+    _delete_by_ids(collection, ids)
+    bm25_index_manager.on_delete(collection_name, {'id': ids})
+    _insert_doc_chunks(collection, collection_name, tenant_code, org_code, chunks, embeddings)
+    return chunks
+
+
+def _release_dedup_originals(collection, collection_name, tenant_code, org_code, file_names=None, keys=None,
+                             exact=False, exclude_files=None):
+    """删除或替换分块前调用：被其他文件的重复分块引用的来源分块即将删除时，每个来源提升一个重复分块为新的来源，
+    其余重复分块改为引用它。skip模式的分块用来源分块的向量写回collection，link模式的分块去掉duplicate_of，
+    调用方负责flush
+
+    Args:
+        file_names/keys: 即将删除的文件名或(file_name, block_id)
+        exact: 与_scope_filter_parts相同，为False时为空的tenant_code/org_code不限制范围
+        exclude_files: 随后会整体重新写入的文件，其中的重复分块不提升
+    """
+    if chunk_dedup_manager is None:
+        return
+    ref_store = chunk_dedup_manager.ref_store
+    deleted_files = set(file_names or []) | set(exclude_files or [])
+    refs_by_scope = defaultdict(lambda: defaultdict(list))
+    for ref in ref_store.dependents(collection_name, tenant_code, org_code, file_names=file_names, keys=keys,
+                                    exact=exact):
+        # 同时被删除的文件中的重复分块不需要提升
+        if ref['file_name'] not in deleted_files:
+            refs_by_scope[(ref['tenant_code'], ref['org_code'])][(ref['dup_file'], ref['dup_block'])].append(ref)
+
+    for (scope_tenant, scope_org), refs_by_source in refs_by_scope.items():
+        scope_parts = _scope_filter_parts(scope_tenant, scope_org, exact=True)
+        promoted = {source: min(refs, key=lambda r: (r['file_name'], r['block_id']))
+                    for source, refs in refs_by_source.items()}
+
+        # skip模式：未写入的重复分块复用来源分块的向量写回，读不到来源分块的向量时重新向量化
+        skipped = [(source, ref) for source, ref in promoted.items() if ref['chunk'] is not None]
+        if skipped:
+            source_embeddings = _fetch_chunk_embeddings(collection, scope_parts, [source for source, _ in skipped])
+            chunks = [dict(ref['chunk'], file_name=ref['file_name'], block_id=ref['block_id']) for _, ref in skipped]
+            pending = [i for i, (source, _) in enumerate(skipped) if source not in source_embeddings]
+            if pending:
+                logger.warning(f"{len(pending)}个重复分块未读取到来源分块的向量，重新向量化")
+                pending_embeddings = embedding_model.embed_documents([chunks[i]['content'] for i in pending])
+                source_embeddings.update((skipped[i][0], e) for i, e in zip(pending, pending_embeddings))
+            _insert_doc_chunks(collection, collection_name, scope_tenant, scope_org, chunks,
+                               [source_embeddings[source] for source, _ in skipped])
+            for chunk in chunks:
+                chunk_dedup_manager.register(collection_name, scope_tenant, scope_org,
+                                             (chunk['file_name'], chunk['block_id']), chunk['content'])
+
+        # link模式：提升的分块去掉duplicate_of，其余已写入的重复分块改为引用提升的分块
+        targets = {}
+        for source, refs in refs_by_source.items():
+            new_key = (promoted[source]['file_name'], promoted[source]['block_id'])
+            for ref in refs:
+                if ref['chunk'] is None:
+                    targets[(ref['file_name'], ref['block_id'])] = None if ref is promoted[source] else new_key
+        if targets:
+            for chunk in _relink_doc_chunks(collection, collection_name, scope_tenant, scope_org, scope_parts,
+                                            targets):
+                if targets[(chunk['file_name'], chunk['block_id'])] is None:
+                    chunk_dedup_manager.register(collection_name, scope_tenant, scope_org,
+                                                 (chunk['file_name'], chunk['block_id']), chunk['content'])
+
+        for source, ref in promoted.items():
+            new_key = (ref['file_name'], ref['block_id'])
+            ref_store.remove(collection_name, scope_tenant, scope_org, keys=[new_key], exact=True)
+            ref_store.repoint(collection_name, scope_tenant, scope_org, source, new_key)
+        logger.info(f"近重复检测：{len(promoted)}个来源分块即将删除，已由重复分块接替（skip模式写回{len(skipped)}个），"
+                    f"范围: ({scope_tenant}, {scope_org})")
+
+
+def _insert_linked_chunks(collection, scope_parts, linked, target_embeddings, insert_batch, ingest_config):
+    """写入链接模式下的重复分块：复用已有分块的向量，读不到已有分块时重新向量化，返回写入的分块数"""
+    embeddings = dict(target_embeddings)
+    missing = {key for _, key in linked if key not in embeddings}
+    if missing:
+        collection.flush()
+        embeddings.update(_fetch_chunk_embeddings(collection, scope_parts, missing))
+    pairs = [(chunk, embeddings[key]) for chunk, key in linked if key in embeddings]
+    pending = [chunk for chunk, key in linked if key not in embeddings]
+    if pending:
+        logger.warning(f"{len(pending)}个重复分块未读取到已有分块的向量，重新向量化")
+        pairs.extend(zip(pending, embedding_model.embed_documents([c['content'] for c in pending])))
+
+    embed_batch_size = ingest_config.get('embed_batch_size', 32)
+    for start in range(0, len(pairs), embed_batch_size):
+        batch = pairs[start:start + embed_batch_size]
+        insert_batch([chunk for chunk, _ in batch], [embedding for _, embedding in batch])
+    return len(pairs)
+
+
 def insert_qa_to_collection(tenant_code, org_code, question_list, answer_list, source_list, metadata_list):
     """插入QA到全局collection，org_code就是org_code"""
-    logger.info(f"调用方法:insert_qa_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 问答对数量={len(question_list)}")
+    is_succ, msg, _ = upsert_qa_to_collection(tenant_code, org_code, question_list, answer_list, source_list,
+                                              metadata_list)
+    return is_succ, msg
+
+
+@_bump_write_version
+def upsert_qa_to_collection(tenant_code, org_code, question_list, answer_list, source_list, metadata_list):
+    """批量插入QA到全局collection，已存在的问题先删除再插入
+
+    Returns:
+        (is_succ, msg, outcomes)，outcomes为每个问题的处理结果：
+        [{'question': 问题, 'status': 'inserted'或'replaced'}]
+    """
+    logger.info(f"调用方法:upsert_qa_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 问答对数量={len(question_list)}")
     
-    config_milvus_dic = config['milvus']
     global_db_name, global_collection_qa_name, _ = get_global_collections()
 
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_qa_name not in exist_collection_list:
+    collection = collection_registry.get_collection(global_db_name, global_collection_qa_name)
+    if collection is None:
         logger.error(f"全局素材库[{global_collection_qa_name}]不存在，请先创建")
-        return False, f"全局素材库[{global_collection_qa_name}]不存在，请先创建"
-
-    collection = Collection(name=global_collection_qa_name)
+        return False, f"全局素材库[{global_collection_qa_name}]不存在，请先创建", []
 
     # org_code就是org_code
     org_code = org_code
 
-    # 检查已存在的问题，如果存在则先删除
-    exist_quest_count = 0
-    to_delete_questions = []
-    for i in range(len(question_list)):
-        q = question_list[i]
-        escaped_question = q.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"question == '{escaped_question}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        res = collection.query(expr=filter_expr)
-        if len(res) > 0:
-            exist_quest_count += 1
-            to_delete_questions.append(q)
-            logger.info(f'新增问答对：问题=[{q}] 已经存在，将先删除再插入')
-
-    # 如果存在相同的问题，先删除
-    if len(to_delete_questions) > 0:
-        logger.info(f'检测到{len(to_delete_questions)}个已存在的问题，开始删除: {to_delete_questions}')
-        for question in to_delete_questions:
-            escaped_question = question.replace("'", "\\'")
-            filter_expr = f"question == '{escaped_question}' && tenant_code == '{tenant_code}' && org_code == '{org_code}'"
-            collection.delete(filter_expr)
-        collection.flush()
-        logger.info(f'已删除{len(to_delete_questions)}个已存在的问题')
-
     if len(question_list) == 0:
         logger.info(f'新增问答对0条')
-        return True, f'新增问答对0条'
+        return True, f'新增问答对0条', []
+
+    # 分批检查已存在的问题（只匹配相同的tenant_code和org_code），如果存在则先删除
+    scope_parts = _scope_filter_parts(tenant_code, org_code, exact=True)
+    existing_questions = _find_existing_keys(collection, 'question', question_list, scope_parts)
+    to_delete_questions = [q for q in dict.fromkeys(question_list) if q in existing_questions]
+    exist_quest_count = len(to_delete_questions)
+
+    # 如果存在相同的问题，分批删除
+    if len(to_delete_questions) > 0:
+        logger.info(f'检测到{len(to_delete_questions)}个已存在的问题，将先删除再插入: {to_delete_questions}')
+        batch_count = _delete_by_keys(collection, 'question', to_delete_questions, scope_parts)
+        collection.flush()
+        bm25_index_manager.on_delete(global_collection_qa_name, {'question': to_delete_questions,
+                                                                 'tenant_code': [tenant_code], 'org_code': [org_code]})
+        logger.info(f'已删除{len(to_delete_questions)}个已存在的问题，共{batch_count}次删除请求')
 
     question_embeddings = embedding_model.embed_documents(question_list)
     
@@ -260,75 +885,104 @@ def insert_qa_to_collection(tenant_code, org_code, question_list, answer_list, s
     org_code_list = [org_code] * len(question_list)
     
     data = [question_list, answer_list, source_list, 
-            tenant_code_list, org_code_list, question_embeddings, metadata_list]
-    collection.insert(data=data)
+            tenant_code_list, org_code_list, encode_vectors(question_embeddings, embedding_mode(collection)),
+            metadata_list]
+    coarse_vectors = _coarse_vectors(collection, question_embeddings)
+    if coarse_vectors is not None:
+        data.append(coarse_vectors)
+    mutation_result = collection.insert(data=data)
     collection.flush()
+
+    # 增量更新已加载的BM25索引
+    bm25_entities = [
+        {'id': pk, 'question': q, 'answer': a, 'source': src, 'tenant_code': tenant_code, 'org_code': org_code, 'metadata': m}
+        for pk, q, a, src, m in zip(mutation_result.primary_keys, question_list, answer_list, source_list, metadata_list)
+    ]
+    bm25_index_manager.on_insert(global_collection_qa_name, tenant_code, org_code, bm25_entities,
+                                 tokens=_ingest_tokens(question_list))
     logger.info(f'插入全局素材库[{global_collection_qa_name}]成功，新增问答对{len(question_list)}条，其中{exist_quest_count}条是删除后重新插入的')
 
-    return True, f"插入全局素材库成功，新增问答对{len(question_list)}条，其中{exist_quest_count}条是删除后重新插入的"
+    outcomes = [{'question': q, 'status': 'replaced' if q in existing_questions else 'inserted'} for q in question_list]
+    return True, f"插入全局素材库成功，新增问答对{len(question_list)}条，其中{exist_quest_count}条是删除后重新插入的", outcomes
 
 
 def insert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_list, source_list,
                               metadata_list):
     """插入文档到全局collection，org_code就是org_code"""
-    logger.info(f"调用方法:insert_docs_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 文档数量={len(doc_name_list)}")
+    is_succ, msg, _ = upsert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_list, source_list,
+                                                metadata_list)
+    return is_succ, msg
+
+
+@_bump_write_version
+def upsert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_list, source_list,
+                              metadata_list):
+    """批量插入文档到全局collection，同名文档先删除再插入
+
+    开启ingest.chunk_diff时，已存在的同名文档按分块内容哈希做增量更新：只删除被移除的分块、
+    只向量化新增的分块，内容未变但位置变化的分块复用已存储的向量重新写入以修正block_id
+
+    开启chunk_dedup时，与同一租户/组织下其他文件已有分块近重复（SimHash相似度达到阈值）的分块：
+    mode为skip时不写入；mode为link时复用已有分块的向量写入，并在metadata中记录duplicate_of。
+    两种模式都记录重复分块引用的来源分块，来源分块被删除或替换时由重复分块接替（见_release_dedup_originals）
+
+    Returns:
+        (is_succ, msg, outcomes)，outcomes为每个文档的处理结果：
+        [{'doc_name': 文档名, 'status': 'inserted'或'replaced', 'chunks': 分块数}]，
+        增量更新的文档额外包含'diff': {'kept', 'moved', 'added', 'removed'}，
+        开启近重复检测时额外包含'deduplicated': 判定为重复的分块数
+    """
+    logger.info(f"调用方法:upsert_docs_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 文档数量={len(doc_name_list)}")
     
-    config_milvus_dic = config['milvus']
     global_db_name, _, global_collection_doc_name = get_global_collections()
 
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_doc_name not in exist_collection_list:
+    collection = collection_registry.get_collection(global_db_name, global_collection_doc_name)
+    if collection is None:
         logger.error(f"全局素材库[{global_collection_doc_name}]不存在，请先创建")
-        return False, f"全局素材库[{global_collection_doc_name}]不存在，请先创建"
-
-    collection = Collection(name=global_collection_doc_name)
+        return False, f"全局素材库[{global_collection_doc_name}]不存在，请先创建", []
 
     # org_code就是org_code
     org_code = org_code
 
-    # 检查已存在的文档，如果存在则先删除
-    exist_doc_count = 0
-    to_delete_file_names = []
-    for i in range(len(doc_name_list)):
-        dname = doc_name_list[i]
-        escaped_dname = dname.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"file_name == '{escaped_dname}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        res = collection.query(expr=filter_expr)
-        if len(res) > 0:
-            exist_doc_count += 1
-            to_delete_file_names.append(dname)
-            logger.info(f'新增文档：file_name=[{dname}] 已经存在，将先删除再插入')
-
-    # 如果存在同名文件，先删除
-    if len(to_delete_file_names) > 0:
-        logger.info(f'检测到{len(to_delete_file_names)}个已存在的文档，开始删除: {to_delete_file_names}')
-        for file_name in to_delete_file_names:
-            escaped_file_name = file_name.replace("'", "\\'")
-            filter_expr = f"file_name == '{escaped_file_name}' && tenant_code == '{tenant_code}' && org_code == '{org_code}'"
-            collection.delete(filter_expr)
-        collection.flush()
-        logger.info(f'已删除{len(to_delete_file_names)}个已存在的文档')
-
     if len(doc_name_list) == 0:
-        logger.info(f'新增文档0条，已经存在而无需新增的文档{exist_doc_count}条')
-        return True, f'新增文档0条，已经存在而无需新增的文档{exist_doc_count}条'
-
-    # 文档分块
-    new_doc_name_list = []
-    new_doc_block_id_list = []
-    new_doc_content_block_list = []
-    new_source_list = []
-    new_metadata_list = []
+        logger.info(f'新增文档0条，已经存在而无需新增的文档0条')
+        return True, f'新增文档0条，已经存在而无需新增的文档0条', []
+
+    ingest_config = config.get('ingest', {})
+
+    # 分批检查已存在的文档（只匹配相同的tenant_code和org_code）
+    scope_parts = _scope_filter_parts(tenant_code, org_code, exact=True)
+    existing_file_names = _find_existing_keys(collection, 'file_name', doc_name_list, scope_parts)
+    existing_doc_names = [d for d in dict.fromkeys(doc_name_list) if d in existing_file_names]
+    exist_doc_count = len(existing_doc_names)
+
+    # 增量模式只处理本次请求中只出现一次的已存在文档，其余已存在文档先整体删除再插入
+    # 增量模式下按内容定义的边界先切段再分块，局部修改只影响附近的分块
+    if ingest_config.get('chunk_diff', False):
+        name_counts = Counter(doc_name_list)
+        diff_doc_names = {d for d in existing_doc_names if name_counts[d] == 1}
+        segment_chars = ingest_config.get('chunk_diff_segment_chars', 6000)
+    else:
+        diff_doc_names = set()
+        segment_chars = 0
+    to_delete_file_names = [d for d in existing_doc_names if d not in diff_doc_names]
 
+    # 如果存在同名文件，分批删除
+    if len(to_delete_file_names) > 0:
+        logger.info(f'检测到{len(to_delete_file_names)}个已存在的文档，将先删除再插入: {to_delete_file_names}')
+        _release_dedup_originals(collection, global_collection_doc_name, tenant_code, org_code,
+                                 file_names=to_delete_file_names, exact=True,
+                                 exclude_files=[d for d in doc_name_list if d not in diff_doc_names])
+        batch_count = _delete_by_keys(collection, 'file_name', to_delete_file_names, scope_parts)
+        collection.flush()
+        bm25_index_manager.on_delete(global_collection_doc_name, {'file_name': to_delete_file_names,
+                                                                  'tenant_code': [tenant_code], 'org_code': [org_code]})
+        if chunk_dedup_manager is not None:
+            chunk_dedup_manager.on_delete(global_collection_doc_name, tenant_code, org_code,
+                                          file_names=to_delete_file_names)
+        logger.info(f'已删除{len(to_delete_file_names)}个已存在的文档，共{batch_count}次删除请求')
+
+    # 流式入库：分块、向量化、写入三个阶段并行，内存中只保留少量批次
     CHUNK_LEN = config['split']['chunk_size']
     OVERLAP = config['split']['overlap']
 
@@ -336,103 +990,211 @@ def insert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_
         chunk_size=CHUNK_LEN, chunk_overlap=OVERLAP,
         length_function=len, keep_separator=False
     )
-    for i in range(len(doc_content_list)):
-        cnt = doc_content_list[i]
-        dname = doc_name_list[i]
-        dsource = source_list[i]
-        metadata = metadata_list[i]
-
-        blocks = text_spliter.split_text(cnt)
-        for k in range(len(blocks)):
-            new_doc_name_list.append(dname)
-            new_doc_block_id_list.append(k)
-            new_doc_content_block_list.append(blocks[k])
-            new_source_list.append(dsource)
-            new_metadata_list.append(metadata)
-
-    block_embeddings = embedding_model.embed_documents(new_doc_content_block_list)
-    logger.info(f"文档分块完成，共{len(new_doc_content_block_list)}个块，开始生成向量嵌入")
-    
-    # 准备数据：file_name, block_id, content, source, tenant_code, org_code, embedding, metadata
-    tenant_code_list = [tenant_code] * len(new_doc_content_block_list)
-    org_code_list = [org_code] * len(new_doc_content_block_list)
-    
-    data = [new_doc_name_list, new_doc_block_id_list, new_doc_content_block_list, new_source_list,
-            tenant_code_list, org_code_list, block_embeddings, new_metadata_list]
-    collection.insert(data=data)
+    chunk_counts = defaultdict(int)
+
+    # 近重复检测：非重复的分块在分块阶段即加入索引，同一请求中后续文档的分块也会与之比较；
+    # 重复分块与来源分块的对应关系在全部写入成功后记录
+    dedup_mode = dedup_config.get('mode', 'skip')
+    dedup_scope = None
+    if chunk_dedup_manager is not None:
+        dedup_scope = _get_dedup_scope(collection, global_collection_doc_name, tenant_code, org_code, scope_parts)
+        # 整体写入的文档重新检测，清除其上次作为重复分块的记录
+        chunk_dedup_manager.ref_store.remove(global_collection_doc_name, tenant_code, org_code, exact=True,
+                                             file_names=[d for d in doc_name_list if d not in diff_doc_names])
+    dedup_counts = defaultdict(int)
+    duplicates = []
+    link_targets = set()
+    target_embeddings = {}
+
+    def on_duplicate(chunk, canonical_key, similarity):
+        dedup_counts[chunk['file_name']] += 1
+        duplicates.append((chunk, canonical_key, similarity))
+        if dedup_mode == 'link':
+            link_targets.add(canonical_key)
+
+    def dedup_filter(chunks):
+        if dedup_scope is None:
+            return chunks
+        return chunk_dedup_manager.filter_chunks(dedup_scope, chunks, on_duplicate)
+
+    def insert_batch(chunks, block_embeddings):
+        _insert_doc_chunks(collection, global_collection_doc_name, tenant_code, org_code, chunks, block_embeddings)
+        for c, embedding in zip(chunks, block_embeddings):
+            chunk_counts[c['file_name']] += 1
+            # 链接模式下保留被重复分块引用的已有分块的向量，写入重复分块时直接复用
+            if (c['file_name'], c['block_id']) in link_targets:
+                target_embeddings[(c['file_name'], c['block_id'])] = embedding
+
+    full_docs = [(d, cnt, src, meta) for d, cnt, src, meta in
+                 zip(doc_name_list, doc_content_list, source_list, metadata_list) if d not in diff_doc_names]
+    chunks = iter_doc_chunks(text_spliter, [d[0] for d in full_docs], [d[1] for d in full_docs],
+                             [d[2] for d in full_docs], [d[3] for d in full_docs], segment_chars=segment_chars)
+    diff_stats = {}
+    try:
+        total_chunks = run_ingest_pipeline(dedup_filter(chunks), embedding_model.embed_documents, insert_batch,
+                                           batch_size=ingest_config.get('embed_batch_size', 32),
+                                           queue_size=ingest_config.get('queue_size', 2))
+
+        for dname, cnt, dsource, metadata in zip(doc_name_list, doc_content_list, source_list, metadata_list):
+            if dname not in diff_doc_names:
+                continue
+            diff_stats[dname] = _upsert_doc_chunk_diff(collection, global_collection_doc_name, text_spliter,
+                                                       scope_parts, dname, cnt, dsource, metadata, insert_batch,
+                                                       ingest_config, segment_chars, dedup_scope, dedup_filter)
+            chunk_counts[dname] += diff_stats[dname]['kept']
+            total_chunks += diff_stats[dname]['moved'] + diff_stats[dname]['added']
+
+        if duplicates and dedup_mode == 'link':
+            linked = [(dict(chunk, metadata=_link_metadata(chunk['metadata'], key, similarity)), key)
+                      for chunk, key, similarity in duplicates]
+            total_chunks += _insert_linked_chunks(collection, scope_parts, linked, target_embeddings, insert_batch,
+                                                  ingest_config)
+        if duplicates:
+            # skip模式的分块未写入collection，同时保存分块内容，来源分块删除时写回
+            chunk_dedup_manager.ref_store.add(global_collection_doc_name, tenant_code, org_code,
+                                              [(chunk, key, similarity, dedup_mode != 'link')
+                                               for chunk, key, similarity in duplicates])
+    except Exception:
+        # 写入失败时索引中可能有未写入的分块，使该范围失效，下次访问时重新加载
+        if chunk_dedup_manager is not None:
+            chunk_dedup_manager.invalidate(global_collection_doc_name, tenant_code, org_code)
+        raise
+
+    # 所有批次写入完成后统一flush一次
     collection.flush()
-    logger.info(f"插入docs到全局素材库[{global_collection_doc_name}]成功,新增文档{len(doc_name_list)}条，已经存在而无需新增的文档{exist_doc_count}条，共插入{len(new_doc_content_block_list)}个文档块")
-    
-    return True, f"插入docs到全局素材库成功,新增文档{len(doc_name_list)}条，已经存在而无需新增的文档{exist_doc_count}条"
+    logger.info(f"插入docs到全局素材库[{global_collection_doc_name}]成功,新增文档{len(doc_name_list)}条，已经存在而无需新增的文档{exist_doc_count}条，共插入{total_chunks}个文档块")
+
+    msg = f"插入docs到全局素材库成功,新增文档{len(doc_name_list)}条，已经存在而无需新增的文档{exist_doc_count}条"
+    if dedup_scope is not None:
+        dedup_total = sum(dedup_counts.values())
+        action = '链接到已有分块' if dedup_mode == 'link' else '跳过'
+        logger.info(f"近重复检测：共{dedup_total}个文档块与其他文件的分块重复，已{action}")
+        msg += f"，{dedup_total}个文档块与其他文件重复已{action}"
+
+    outcomes = []
+    for d in doc_name_list:
+        outcome = {'doc_name': d, 'status': 'replaced' if d in existing_file_names else 'inserted',
+                   'chunks': chunk_counts[d]}
+        if d in diff_stats:
+            outcome['diff'] = diff_stats[d]
+        if dedup_scope is not None:
+            outcome['deduplicated'] = dedup_counts[d]
+        outcomes.append(outcome)
+    return True, msg, outcomes
+
+
+def _upsert_doc_chunk_diff(collection, collection_name, text_spliter, scope_parts, doc_name, content, source, metadata,
+                           insert_batch, ingest_config, segment_chars=0, dedup_scope=None, chunk_filter=None):
+    """按分块内容哈希增量更新单个已存在的文档，调用方负责flush
 
+    Args:
+        dedup_scope: 近重复检测索引，删除/重新写入的分块同步更新索引和重复分块记录
+        chunk_filter: 新增分块的近重复过滤（见upsert_docs_to_collection）
 
+    Returns:
+        {'kept': 未变分块数, 'moved': 复用向量重新写入的分块数, 'added': 新增分块数, 'removed': 删除分块数}
+    """
+    batch_size = config.get('corpus_loader', {}).get('batch_size', 1000)
+    expr = " && ".join([f"file_name == '{_escape_expr_value(doc_name)}'"] + scope_parts)
+    stored_rows = []
+    for rows in iter_collection_batches(collection, expr=expr, batch_size=batch_size,
+                                        output_fields=['id', 'block_id', 'content', 'source', 'metadata']):
+        stored_rows.extend(rows)
+
+    new_chunks = list(iter_doc_chunks(text_spliter, [doc_name], [content], [source], [metadata],
+                                      segment_chars=segment_chars))
+    kept, moved, added, removed_ids = _diff_doc_chunks(stored_rows, new_chunks)
+    if dedup_scope is not None:
+        # skip模式未写入的分块作为新增分块重新检测
+        chunk_dedup_manager.ref_store.remove(collection_name, dedup_scope.tenant_code, dedup_scope.org_code,
+                                             file_names=[doc_name], exact=True, skipped_only=True)
+
+    # 先读出需要重新写入的分块的向量，再删除旧数据
+    moved_embeddings = _fetch_embeddings(collection, [old_id for old_id, _ in moved]) if moved else {}
+    delete_ids = removed_ids + [old_id for old_id, _ in moved]
+    if delete_ids:
+        if dedup_scope is not None:
+            block_ids = {row['id']: row.get('block_id') for row in stored_rows}
+            delete_keys = [(doc_name, block_ids[i]) for i in delete_ids]
+            _release_dedup_originals(collection, collection_name, dedup_scope.tenant_code, dedup_scope.org_code,
+                                     keys=delete_keys, exact=True)
+            chunk_dedup_manager.ref_store.remove(collection_name, dedup_scope.tenant_code, dedup_scope.org_code,
+                                                 keys=delete_keys, exact=True)
+            dedup_scope.remove(keys=delete_keys)
+        _delete_by_ids(collection, delete_ids)
+        bm25_index_manager.on_delete(collection_name, {'id': delete_ids})
+
+    embed_batch_size = ingest_config.get('embed_batch_size', 32)
+    for start in range(0, len(moved), embed_batch_size):
+        batch = moved[start:start + embed_batch_size]
+        insert_batch([chunk for _, chunk in batch], [moved_embeddings[old_id] for old_id, _ in batch])
+        if dedup_scope is not None:
+            for _, chunk in batch:
+                dedup_scope.add((doc_name, chunk['block_id']), chunk_dedup_manager.signature(chunk['content']))
+    added_count = 0
+    if added:
+        added_count = run_ingest_pipeline(chunk_filter(iter(added)) if chunk_filter else iter(added),
+                                          embedding_model.embed_documents, insert_batch,
+                                          batch_size=embed_batch_size, queue_size=ingest_config.get('queue_size', 2))
+
+    stats = {'kept': len(kept), 'moved': len(moved), 'added': added_count, 'removed': len(removed_ids)}
+    logger.info(f"文档[{doc_name}]增量更新：未变{stats['kept']}块，复用向量重写{stats['moved']}块，"
+                f"新增{stats['added']}块，删除{stats['removed']}块")
+    return stats
+
+
+@_bump_write_version
 def delete_qa_from_collection(tenant_code, org_code, question_list):
     """从全局collection删除QA，org_code就是org_code"""
     logger.info(f"调用方法:delete_qa_from_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 待删除问题数量={len(question_list)}")
     logger.info(f'待删除的问题列表: {question_list}')
 
-    config_milvus_dic = config['milvus']
     global_db_name, global_collection_qa_name, _ = get_global_collections()
 
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_qa_name not in exist_collection_list:
+    collection = collection_registry.get_collection(global_db_name, global_collection_qa_name)
+    if collection is None:
         logger.error(f"全局素材库[{global_collection_qa_name}]不存在")
         return False, f"全局素材库[{global_collection_qa_name}]不存在"
-
-    collection = Collection(global_collection_qa_name)
     
     # org_code就是org_code
     org_code = org_code
 
-    for question in question_list:
-        escaped_question = question.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"question == '{escaped_question}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        collection.delete(filter_expr)
+    # 分批删除，只有当tenant_code和org_code不为空时才加入条件
+    _delete_by_keys(collection, 'question', question_list, _scope_filter_parts(tenant_code, org_code))
     collection.flush()
+    bm25_index_manager.on_delete(global_collection_qa_name, _bm25_delete_conditions(tenant_code, org_code, 'question', question_list))
 
     logger.info(f"从全局素材库[{global_collection_qa_name}]删除问答对成功，共删除{len(question_list)}条")
     return True, f"从全局素材库删除问答对成功"
 
 
+@_bump_write_version
 def delete_docs_from_collection(tenant_code, org_code, doc_name_list):
     """从全局collection删除文档，org_code就是org_code"""
     logger.info(f"调用方法:delete_docs_from_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 待删除文档数量={len(doc_name_list)}")
     logger.info(f'待删除的文档列表: {doc_name_list}')
 
-    config_milvus_dic = config['milvus']
     global_db_name, _, global_collection_doc_name = get_global_collections()
 
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_doc_name not in exist_collection_list:
+    collection = collection_registry.get_collection(global_db_name, global_collection_doc_name)
+    if collection is None:
         logger.error(f"全局素材库[{global_collection_doc_name}]不存在")
         return False, f"全局素材库[{global_collection_doc_name}]不存在"
-
-    collection = Collection(global_collection_doc_name)
     
     # org_code就是org_code
     org_code = org_code
 
-    for file_name in doc_name_list:
-        escaped_file_name = file_name.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"file_name == '{escaped_file_name}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        collection.delete(filter_expr)
+    # 被其他文件引用的重复来源分块由重复分块接替
+    _release_dedup_originals(collection, global_collection_doc_name, tenant_code, org_code, file_names=doc_name_list)
+
+    # 分批删除，只有当tenant_code和org_code不为空时才加入条件
+    _delete_by_keys(collection, 'file_name', doc_name_list, _scope_filter_parts(tenant_code, org_code))
     collection.flush()
+    bm25_index_manager.on_delete(global_collection_doc_name, _bm25_delete_conditions(tenant_code, org_code, 'file_name', doc_name_list))
+    if chunk_dedup_manager is not None:
+        chunk_dedup_manager.on_delete(global_collection_doc_name, tenant_code, org_code, file_names=doc_name_list)
+        chunk_dedup_manager.ref_store.remove(global_collection_doc_name, tenant_code, org_code,
+                                             file_names=doc_name_list)
 
     logger.info(f"从全局素材库[{global_collection_doc_name}]删除文档成功，共删除{len(doc_name_list)}个文档")
     return True, f"从全局素材库删除文档成功"
@@ -443,89 +1205,214 @@ def _tokenize_chinese(text):
     return list(jieba.cut(text))
 
 
-def _build_bm25_index(collection, final_filter, collection_type):
-    """从Milvus collection构建BM25索引"""
-    logger.info(f"开始构建BM25索引，collection_type={collection_type}, filter={final_filter}")
+bm25_index_config = config.get('bm25_index', {})
+# jieba词典序列化缓存文件，启动时由main预加载
+set_jieba_cache_file(bm25_index_config.get('jieba_cache_file', ''))
+# 语料批量分词：入库时把分词结果写入分词缓存（与BM25索引文件放在同一目录），构建BM25索引时直接读取，
+# 未命中的大批量文本在进程池中并行分词
+corpus_tokenizer = CorpusTokenizer(
+    cache=TokenCache(os.path.join(bm25_index_config.get('persist_dir') or './cache/bm25', 'token_cache.sqlite'))
+    if bm25_index_config.get('token_cache', False) else None,
+    workers=bm25_index_config.get('tokenize_workers', 0),
+    parallel_threshold=bm25_index_config.get('parallel_tokenize_threshold', 2000),
+    jieba_cache_file=bm25_index_config.get('jieba_cache_file', '')
+)
+bm25_index_manager = BM25IndexManager(
+    tokenizer=_tokenize_chinese,
+    max_scopes=bm25_index_config.get('max_scopes', 64),
+    persist_dir=bm25_index_config.get('persist_dir', ''),
+    batch_tokenizer=corpus_tokenizer.tokenize_many,
+    save_interval=bm25_index_config.get('save_interval', 60)
+)
+
+
+def _ingest_tokens(texts):
+    """启用分词缓存时在入库阶段完成分词并写入缓存，之后构建BM25索引时不再分词"""
+    if corpus_tokenizer.cache is None:
+        return None
+    return corpus_tokenizer.tokenize_many(texts)
+
+
+def _bm25_delete_conditions(tenant_code, org_code, key_field=None, key_values=None):
+    """构建BM25索引的删除条件，与Milvus删除表达式保持一致：tenant_code和org_code为空时不加入条件"""
+    conditions = {}
+    if key_field:
+        conditions[key_field] = key_values
+    if tenant_code:
+        conditions['tenant_code'] = [tenant_code]
+    if org_code:
+        conditions['org_code'] = [org_code]
+    return conditions
+
+
+def _load_bm25_corpus(collection, final_filter, collection_type):
+    """从Milvus collection分批加载构建BM25索引所需的语料，返回(entities, tokenized_texts)"""
+    batch_size = config.get('corpus_loader', {}).get('batch_size', 1000)
+    logger.info(f"开始从Milvus加载BM25语料，collection_type={collection_type}, filter={final_filter}, batch_size={batch_size}")
     
     # 确定要检索的文本字段
-    if collection_type == 'QA':
-        text_field = 'question'
-    else:
-        text_field = 'content'
+    text_field = _bm25_text_field(collection_type)
     
     # 从Milvus获取所有文档
-    fields = [f.name for f in collection.schema.fields if f.name != 'embedding']
+    fields = [f.name for f in collection.schema.fields if f.name not in ('embedding', SPARSE_FIELD, COARSE_FIELD)]
     try:
-        # 查询所有符合条件的文档
-        # expr参数是必需的，如果final_filter为空，使用主键id >= 0查询所有数据
-        if final_filter:
-            query_params = {
-                'expr': final_filter,
-                'output_fields': fields,
-                'limit': 16384  # Milvus默认最大查询数量
-            }
-        else:
-            # 当没有过滤条件时，使用主键id >= 0来查询所有数据
-            query_params = {
-                'expr': 'id >= 0',
-                'output_fields': fields,
-                'limit': 16384  # Milvus默认最大查询数量
-            }
-        
-        query_result = collection.query(**query_params)
-        
-        if len(query_result) == 0:
-            logger.warning("没有找到符合条件的文档用于构建BM25索引")
-            return None, []
-        
-        # 提取文本和对应的实体信息
-        texts = []
+        # 分批读取，不受单次query最多16384行的限制
         entities = []
-        for item in query_result:
-            text = item.get(text_field, '')
-            if text:
-                texts.append(text)
-                entities.append(item)
+        for batch in iter_collection_batches(collection, expr=final_filter, output_fields=fields, batch_size=batch_size):
+            for item in batch:
+                if item.get(text_field, ''):
+                    entities.append(item)
+        # 批量分词：优先读取入库时写入的分词缓存
+        tokenized_texts = corpus_tokenizer.tokenize_many([item[text_field] for item in entities])
         
-        if len(texts) == 0:
+        if len(entities) == 0:
             logger.warning("没有找到有效的文本内容用于构建BM25索引")
-            return None, []
-        
-        # 对文本进行分词
-        tokenized_texts = [_tokenize_chinese(text) for text in texts]
-        
-        # 构建BM25索引
-        bm25 = BM25Okapi(tokenized_texts)
-        logger.info(f"BM25索引构建完成，共{len(texts)}个文档")
-        
-        return bm25, entities
+        return entities, tokenized_texts
     except Exception as e:
         import traceback
         logger.error(f"构建BM25索引时出错: {traceback.format_exc()}")
-        return None, []
+        raise
 
 
-def _bm25_search(bm25, entities, query, limit):
+def _bm25_text_field(collection_type):
+    """BM25检索使用的文本字段"""
+    return 'question' if collection_type == 'QA' else 'content'
+
+
+# BM25索引构建（首次访问范围时从Milvus加载语料）使用独立的小线程池：检索超时后仍在进行的构建不占用混合检索线程池，
+# 同一范围同时只提交一次构建
+bm25_build_executor = ThreadPoolExecutor(max_workers=config.get('hybrid_search', {}).get('build_workers', 2),
+                                         thread_name_prefix='bm25_build')
+_bm25_builds = {}
+_bm25_builds_lock = threading.Lock()
+
+
+def _get_bm25_index(collection, collection_name, collection_type, tenant_code, org_code, filter_expr, final_filter,
+                    timeout=None):
+    """获取常驻的BM25索引，首次访问该范围时才从Milvus加载语料
+
+    Args:
+        timeout: 等待索引构建的最长秒数，超时抛出concurrent.futures.TimeoutError，构建在后台继续进行
+    """
+    bm25_index = bm25_index_manager.get_loaded(collection_name, tenant_code, org_code, filter_expr)
+    if bm25_index is not None:
+        return bm25_index
+
+    def count_loader():
+        res = collection.query(expr=final_filter if final_filter else 'id >= 0', output_fields=['count(*)'])
+        return res[0]['count(*)'] if res else 0
+
+    def build():
+        return bm25_index_manager.get_index(
+            collection_name, _bm25_text_field(collection_type), tenant_code, org_code, filter_expr,
+            corpus_loader=lambda: _load_bm25_corpus(collection, final_filter, collection_type),
+            count_loader=count_loader
+        )
+
+    build_key = (collection_name, tenant_code or '', org_code or '', filter_expr or '')
+    with _bm25_builds_lock:
+        future = _bm25_builds.get(build_key)
+        submitted = future is None
+        if submitted:
+            future = bm25_build_executor.submit(build)
+            _bm25_builds[build_key] = future
+
+    if submitted:
+        def on_done(done_future):
+            with _bm25_builds_lock:
+                if _bm25_builds.get(build_key) is done_future:
+                    del _bm25_builds[build_key]
+        future.add_done_callback(on_done)
+    return future.result(timeout=timeout)
+
+
+def _bm25_search(bm25_index, query, limit):
     """使用BM25进行检索"""
-    if bm25 is None or len(entities) == 0:
+    if bm25_index is None or len(bm25_index) == 0:
         return []
     
-    # 对查询进行分词
+    # 对查询进行分词，语料已在索引中分好词
     tokenized_query = _tokenize_chinese(query)
-    
-    # BM25检索
-    scores = bm25.get_scores(tokenized_query)
-    
-    # 获取top-k结果
-    top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:limit]
-    
-    results = []
-    for idx in top_indices:
-        result = entities[idx].copy()
-        result['bm25_score'] = scores[idx]
-        results.append(result)
-    
-    return results
+    return bm25_index.search(tokenized_query, limit)
+
+
+# 混合检索共享线程池：向量检索（向量化 + Milvus RPC）与BM25检索（构建/读取常驻索引 + 打分）并行执行
+hybrid_executor = ThreadPoolExecutor(max_workers=config.get('hybrid_search', {}).get('executor_workers', 8),
+                                     thread_name_prefix='hybrid_search')
+
+
+def _run_hybrid_legs(dense_leg, lexical_leg, deadline=None, degraded_reasons=None):
+    """在共享线程池上并行执行向量检索与BM25检索两路，返回(向量检索结果, BM25检索结果)
+
+    每路按hybrid_search中的dense_timeout_seconds/lexical_timeout_seconds等待（从提交时刻起算），
+    设置了deadline（time.monotonic()时间点）时不超过deadline；超时的一路返回None并记入degraded_reasons，
+    由另一路结果单独参与融合。两路都超时时：未设置deadline则抛出TimeoutError，否则返回(None, None)。
+    超时的一路尚未开始执行时取消，不再占用线程池。
+    向量检索的异常（如连接不可用）直接抛出，由调用方处理
+    """
+    hybrid_config = config.get('hybrid_search', {})
+    degraded_reasons = degraded_reasons if degraded_reasons is not None else []
+    start = time.monotonic()
+    dense_future = hybrid_executor.submit(dense_leg)
+    lexical_future = hybrid_executor.submit(lexical_leg)
+
+    def wait(future, timeout, leg_name, reason):
+        end = start + timeout if deadline is None else min(start + timeout, deadline)
+        try:
+            return future.result(timeout=max(0.0, end - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning(f"混合检索的{leg_name}超时（已等待{(time.monotonic() - start) * 1000:.0f}ms），"
+                           f"本次只使用另一路结果融合")
+            degraded_reasons.append(reason)
+            return None
+
+    dense_result = wait(dense_future, hybrid_config.get('dense_timeout_seconds', 10), '向量检索', 'dense_timeout')
+    lexical_result = wait(lexical_future, hybrid_config.get('lexical_timeout_seconds', 10), 'BM25检索',
+                          'lexical_timeout')
+    if dense_result is None and lexical_result is None and deadline is None:
+        raise TimeoutError("混合检索的向量检索和BM25检索均超时")
+    logger.info(f"混合检索两路完成，耗时{(time.monotonic() - start) * 1000:.1f}ms")
+    return dense_result, lexical_result
+
+
+def _run_with_deadline(fn, deadline, reason, degraded_reasons):
+    """在共享线程池中执行fn，超过deadline时把reason记入degraded_reasons并返回None；未设置deadline时直接执行"""
+    if deadline is None:
+        return fn()
+    future = hybrid_executor.submit(fn)
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        future.cancel()
+        logger.warning(f"检索超出时间预算，降级返回已有结果: {reason}")
+        degraded_reasons.append(reason)
+        return None
+
+
+# 检索降级统计
+_retrieval_stats_lock = threading.Lock()
+_retrieval_stats = {'requests': 0, 'degraded': 0, 'reasons': Counter()}
+
+
+def _record_retrieval(degraded_reasons):
+    with _retrieval_stats_lock:
+        _retrieval_stats['requests'] += 1
+        if degraded_reasons:
+            _retrieval_stats['degraded'] += 1
+            _retrieval_stats['reasons'].update(degraded_reasons)
+
+
+def get_retrieval_stats():
+    """返回检索请求数、降级次数及各降级原因的次数"""
+    with _retrieval_stats_lock:
+        requests = _retrieval_stats['requests']
+        return {
+            'requests': requests,
+            'degraded': _retrieval_stats['degraded'],
+            'degraded_rate': round(_retrieval_stats['degraded'] / requests, 4) if requests else 0.0,
+            'reasons': dict(_retrieval_stats['reasons'])
+        }
 
 
 def _reciprocal_rank_fusion(vector_results, bm25_results, k=60, bm25_weight=1.2):
@@ -597,7 +1484,137 @@ def _reciprocal_rank_fusion(vector_results, bm25_results, k=60, bm25_weight=1.2)
     return fused_results
 
 
-def search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr='', limit=5, use_hybrid=False, vector_similarity_threshold=None, rrf_similarity_threshold=None):
+def _resolve_output_fields(all_fields, output_fields):
+    """校验调用方指定的输出字段，为None时返回全部字段；id始终返回，顺序与schema一致"""
+    if output_fields is None:
+        return list(all_fields)
+    unknown = [f for f in output_fields if f not in all_fields]
+    if unknown:
+        logger.warning(f"忽略不存在的输出字段: {unknown}")
+    return ['id'] + [f for f in all_fields if f != 'id' and f in output_fields]
+
+
+def _hydrate_entities(collection, entities, fields, all_fields, deadline=None, degraded_reasons=None):
+    """两阶段检索的第二阶段：最终top-k中缺少字段的结果通过query(id in [...])一次补齐，并按fields裁剪输出
+
+    BM25常驻索引中的结果已包含全部字段，无需再查询；超过deadline时未补齐的字段为None，并记入degraded_reasons
+    """
+    detail_fields = [f for f in fields if f != 'id']
+    missing_ids = [ent['id'] for query_entities in entities for ent in query_entities
+                   if any(f not in ent for f in detail_fields)]
+
+    def fetch_rows():
+        fetched = {}
+        for batch in _id_batches(missing_ids):
+            for row in collection.query(expr=f"id in {batch}", output_fields=detail_fields):
+                fetched[row['id']] = row
+        return fetched
+
+    rows = {}
+    if detail_fields and missing_ids:
+        rows = _run_with_deadline(fetch_rows, deadline, 'hydration_timeout', degraded_reasons) or {}
+        logger.info(f"两阶段检索补齐字段，结果{len(missing_ids)}条，补齐{len(rows)}条，输出字段: {detail_fields}")
+    for query_entities in entities:
+        for i, ent in enumerate(query_entities):
+            row = rows.get(ent['id'], ent)
+            hydrated = {'id': ent['id']}
+            hydrated.update({f: row.get(f) for f in detail_fields})
+            # 保留分数、排名等非schema字段
+            hydrated.update({k: v for k, v in ent.items() if k not in all_fields})
+            query_entities[i] = hydrated
+    return entities
+
+
+def _dense_search(collection, query_embeddings, limit, output_fields, final_filter):
+    """向量检索，查询向量按collection的存储类型编码
+
+    低精度存储且开启精排时召回limit * rescore_oversample条候选，用float32查询向量重新打分后保留前limit条；
+    开启coarse_search且collection带低维向量字段时，先在低维向量上召回coarse_search.candidates条候选，再用完整向量精排
+    """
+    mode = embedding_mode(collection)
+    projection = coarse_projection(collection) if config.get('coarse_search', {}).get('enabled', False) else None
+    if projection is not None:
+        search_params = {
+            'data': projection.project(query_embeddings).tolist(),
+            'anns_field': COARSE_FIELD,
+            'param': vector_search_params(coarse_index_params().get('index_type')),
+            'limit': max(limit, config['coarse_search'].get('candidates', 100)),
+            'output_fields': output_fields + ['embedding']
+        }
+        if final_filter:
+            search_params['expr'] = final_filter
+        res = collection.search(**search_params)
+        return [rescore_hits(hits, query_embedding, mode, limit) for hits, query_embedding in zip(res, query_embeddings)]
+    oversample = rescore_oversample(mode)
+    search_params = {
+        'data': encode_vectors(query_embeddings, mode),
+        'anns_field': "embedding",
+        'param': vector_search_params(),
+        'limit': limit * oversample if oversample else limit,
+        'output_fields': output_fields + ['embedding'] if oversample else output_fields
+    }
+    if final_filter:
+        search_params['expr'] = final_filter
+    res = collection.search(**search_params)
+    if not oversample:
+        return res
+    return [rescore_hits(hits, query_embedding, mode, limit) for hits, query_embedding in zip(res, query_embeddings)]
+
+
+def _milvus_hybrid_search(collection, sparse_field, query_list, fields, final_filter, limit, rrf_similarity_threshold):
+    """Milvus服务端混合检索：稠密向量与BM25稀疏向量各一个AnnSearchRequest，一次hybrid_search完成融合
+
+    融合方式由hybrid_search配置决定：默认RRFRanker(rrf_k)；配置了milvus_weights([稠密权重, 稀疏权重])时使用WeightedRanker
+    """
+    logger.info("使用Milvus服务端混合检索模式（稠密向量 + BM25稀疏向量）")
+    hybrid_config = config.get('hybrid_search', {})
+    query_embeddings = embed_queries(query_list)
+
+    candidate_limit = limit * 5  # 每路召回更多结果用于融合
+    dense_request = AnnSearchRequest(data=encode_vectors(query_embeddings, embedding_mode(collection)),
+                                     anns_field='embedding', param=vector_search_params(),
+                                     limit=candidate_limit, expr=final_filter or None)
+    sparse_request = AnnSearchRequest(data=list(query_list), anns_field=sparse_field,
+                                      param={'metric_type': 'BM25'}, limit=candidate_limit, expr=final_filter or None)
+    weights = hybrid_config.get('milvus_weights')
+    ranker = WeightedRanker(*weights) if weights else RRFRanker(hybrid_config.get('rrf_k', 60))
+    res = collection.hybrid_search([dense_request, sparse_request], rerank=ranker, limit=limit, output_fields=fields)
+
+    ids = []
+    distances = []
+    entities = []
+    for hits in res:
+        query_ids = []
+        query_distances = []
+        query_entities = []
+        for hit in hits:
+            if rrf_similarity_threshold is not None and hit.score < rrf_similarity_threshold:
+                continue
+            ent = {'id': hit.id}
+            for f in fields:
+                if f != 'id':
+                    ent[f] = hit.get(f)
+            ent['rrf_score'] = hit.score
+            query_ids.append(hit.id)
+            query_distances.append(hit.score)
+            query_entities.append(ent)
+        if rrf_similarity_threshold is not None:
+            logger.info(f"服务端融合后共{len(hits)}条结果，阈值过滤后剩余{len(query_entities)}条（阈值={rrf_similarity_threshold}）")
+        ids.append(query_ids)
+        distances.append(query_distances)
+        entities.append(query_entities)
+
+    ret_dic = {
+        "ids": ids,
+        "distances": distances,
+        "entities": entities
+    }
+    total_results = sum(len(e) for e in entities)
+    logger.info(f'Milvus服务端混合检索完成，{len(ids)}个查询，共返回{total_results}条结果')
+    return ret_dic
+
+
+def search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr='', limit=5, use_hybrid=False, vector_similarity_threshold=None, rrf_similarity_threshold=None, output_fields=None, time_budget_ms=None):
     """从全局collection搜索
     
     Args:
@@ -610,33 +1627,68 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
         use_hybrid: 是否使用混合检索（向量+BM25），默认False
         vector_similarity_threshold: 向量相似度阈值，默认从配置文件读取
         rrf_similarity_threshold: RRF相似度阈值，默认从配置文件读取
+        output_fields: 结果中返回的字段列表，默认返回除向量外的全部字段；传['id']时只返回id和分数
+        time_budget_ms: 检索时间预算（毫秒），超出时返回已有结果（如只有向量检索结果）并标记降级，默认不限制
     
     Returns:
-        检索结果字典，包含ids、distances、entities
+        检索结果字典，包含ids、distances、entities，以及degraded（是否降级）和degraded_reasons（降级原因）
     """
     # 如果参数是None，则不进行阈值过滤；如果不是None，则使用该值进行过滤
     logger.info(f"调用方法:search_from_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, collection_type={collection_type}, 查询数量={len(query_list)}, limit={limit}, use_hybrid={use_hybrid}, vector_similarity_threshold={vector_similarity_threshold}, rrf_similarity_threshold={rrf_similarity_threshold}")
     logger.info(f"查询内容: {query_list}, 过滤条件: {filter_expr}")
     
-    config_milvus_dic = config['milvus']
     global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
 
     assert collection_type in ('QA', 'DOC'), 'collection_type必须是[QA,DOC]之一'
 
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
+    cache_key = None
+    if search_result_cache is not None:
+        cache_key = (collection_type, tenant_code or '', org_code or '', tuple(query_list), filter_expr or '', limit,
+                     bool(use_hybrid), vector_similarity_threshold, rrf_similarity_threshold,
+                     tuple(output_fields) if output_fields is not None else None)
+        # 先读取版本号再检索，检索期间发生写入时本次结果在下次读取时即过期
+        version = search_result_cache.versions.version(tenant_code, org_code)
+        cached = search_result_cache.get(cache_key, tenant_code, org_code)
+        if cached is not None:
+            logger.info(f"命中检索结果缓存，直接返回")
+            _record_retrieval(cached['degraded_reasons'])
+            return cached
+
+    deadline = time.monotonic() + time_budget_ms / 1000.0 if time_budget_ms else None
+    try:
+        res = _search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr, limit,
+                                      use_hybrid, vector_similarity_threshold, rrf_similarity_threshold,
+                                      output_fields, deadline)
+    except MilvusUnavailableException:
+        # 连接失效（如Milvus重启）时重建连接并重试一次
+        logger.warning(f"Milvus连接不可用，重建连接后重试检索")
+        collection_registry.reconnect(global_db_name)
+        res = _search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr, limit,
+                                      use_hybrid, vector_similarity_threshold, rrf_similarity_threshold,
+                                      output_fields, deadline)
+    if isinstance(res, dict):
+        _record_retrieval(res['degraded_reasons'])
+        # 降级的结果不缓存
+        if cache_key is not None and not res['degraded']:
+            search_result_cache.put(cache_key, version, res)
+    return res
+
+
+def _search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr, limit,
+                            use_hybrid, vector_similarity_threshold, rrf_similarity_threshold, output_fields=None,
+                            deadline=None):
+    """search_from_collection的实现，collection句柄与字段列表均从注册表缓存中获取
+
+    启用two_phase_search时分两阶段：候选集只取id和分数，融合/截断后的top-k再一次query补齐输出字段。
+    设置deadline时，检索阶段最多使用预算的(1 - retrieval_budget.hydration_share)，其余留给补齐字段
+    """
+    global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    collection_name = global_collection_qa_name if collection_type == 'QA' else global_collection_doc_name
 
-    if collection_type == 'QA':
-        if global_collection_qa_name not in exist_collection_list:
-            logger.error(f"全局素材库[{global_collection_qa_name}]不存在")
-            return False, f"全局素材库[{global_collection_qa_name}]不存在"
-        collection = Collection(global_collection_qa_name)
-    else:
-        if global_collection_doc_name not in exist_collection_list:
-            logger.error(f"全局素材库[{global_collection_doc_name}]不存在")
-            return False, f"全局素材库[{global_collection_doc_name}]不存在"
-        collection = Collection(global_collection_doc_name)
+    collection = collection_registry.get_collection(global_db_name, collection_name)
+    if collection is None:
+        logger.error(f"全局素材库[{collection_name}]不存在")
+        return False, f"全局素材库[{collection_name}]不存在"
 
     # 构建过滤表达式
     base_filter = ""
@@ -647,6 +1699,16 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
     elif org_code:
         base_filter = f"org_code == '{org_code}'"
     
+    # tenant_code为partition key时，Milvus根据过滤条件中的tenant_code == 自动只检索该租户所在分区
+    if collection_registry.partition_key_field(global_db_name, collection_name) == 'tenant_code':
+        if tenant_code:
+            logger.info(f"按partition key路由检索，tenant_code={tenant_code}")
+        else:
+            logger.info(f"未指定tenant_code，将检索素材库[{collection_name}]的全部分区")
+
+    # 调用方传入的过滤条件与租户/组织条件相同时视为无额外过滤，便于复用同一范围的BM25索引
+    scope_filter_expr = '' if filter_expr == base_filter else filter_expr
+
     # 合并用户提供的过滤表达式
     if filter_expr:
         if base_filter:
@@ -656,50 +1718,95 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
     else:
         final_filter = base_filter
 
-    fields = [f.name for f in collection.schema.fields if f.name != 'embedding']
+    all_fields = collection_registry.field_names(global_db_name, collection_name)
+    fields = _resolve_output_fields(all_fields, output_fields)
+    # 两阶段检索时候选集不取标量字段，只返回id和分数
+    candidate_fields = [] if config.get('two_phase_search', {}).get('enabled', False) else fields
+
+    # 检索阶段的截止时间，剩余预算留给补齐字段
+    degraded_reasons = []
+    legs_deadline = None
+    if deadline is not None:
+        hydration_share = config.get('retrieval_budget', {}).get('hydration_share', 0.2)
+        legs_deadline = deadline - (deadline - time.monotonic()) * hydration_share
     
     # 如果使用混合检索
     if use_hybrid:
+        # 集合带有BM25稀疏向量字段时，由Milvus服务端完成稀疏检索和RRF融合
+        sparse_field = collection_registry.sparse_field(global_db_name, collection_name) if use_milvus_hybrid() else None
+        if sparse_field:
+            ret_dic = _run_with_deadline(
+                lambda: _milvus_hybrid_search(collection, sparse_field, query_list, candidate_fields, final_filter,
+                                              limit, rrf_similarity_threshold),
+                legs_deadline, 'hybrid_timeout', degraded_reasons
+            ) or {'ids': [[] for _ in query_list], 'distances': [[] for _ in query_list],
+                  'entities': [[] for _ in query_list]}
+            _hydrate_entities(collection, ret_dic['entities'], fields, all_fields, deadline, degraded_reasons)
+            ret_dic['degraded'] = bool(degraded_reasons)
+            ret_dic['degraded_reasons'] = degraded_reasons
+            return ret_dic
+
         logger.info("使用混合检索模式（向量检索 + BM25检索）")
-        
-        # 构建BM25索引
-        bm25, bm25_entities = _build_bm25_index(collection, final_filter, collection_type)
+
+        def dense_leg():
+            # 所有查询一次向量化、一次多向量检索
+            logger.info(f"开始向量检索，查询数量={len(query_list)}")
+            query_embeddings = embed_queries(query_list)
+            return _dense_search(collection, query_embeddings, limit * 5,  # 获取更多结果用于融合
+                                 candidate_fields, final_filter)
+
+        # BM25这一路等待索引构建的截止时间，与_run_hybrid_legs的等待时间一致
+        lexical_end = time.monotonic() + config.get('hybrid_search', {}).get('lexical_timeout_seconds', 10)
+        if legs_deadline is not None:
+            lexical_end = min(lexical_end, legs_deadline)
+
+        def lexical_leg():
+            # 获取常驻BM25索引（首次访问时在构建线程池中构建，之后由写入/删除接口增量维护）；
+            # 返回(检索结果, 降级原因)，降级原因由调用方记录，避免工作线程在请求返回后修改结果
+            degraded_reason = None
+            try:
+                bm25_index = _get_bm25_index(collection, collection_name, collection_type, tenant_code, org_code,
+                                             scope_filter_expr, final_filter,
+                                             timeout=max(0.0, lexical_end - time.monotonic()))
+            except FutureTimeoutError:
+                logger.warning("BM25索引仍在构建中，本次只使用向量检索结果")
+                degraded_reason = 'lexical_timeout'
+                bm25_index = None
+            except Exception:
+                # BM25索引不可用时退化为只用向量检索结果，记入降级原因
+                import traceback
+                logger.error(f"获取BM25索引时出错，本次只使用向量检索结果: {traceback.format_exc()}")
+                degraded_reason = 'lexical_error'
+                bm25_index = None
+            logger.info(f"开始BM25检索，查询数量={len(query_list)}")
+            return [_bm25_search(bm25_index, query, limit * 5) for query in query_list], degraded_reason
+
+        # 向量检索与BM25检索并行执行，耗时取两路中较慢的一路
+        vector_res, lexical_res = _run_hybrid_legs(dense_leg, lexical_leg, legs_deadline, degraded_reasons)
+        if vector_res is None:
+            vector_res = [[] for _ in query_list]
+        bm25_res = [[] for _ in query_list]
+        if lexical_res is not None:
+            bm25_res, lexical_reason = lexical_res
+            if lexical_reason:
+                degraded_reasons.append(lexical_reason)
         
         ids = []
         distances = []
         entities = []
-        
-        # 对每个查询进行混合检索
-        for query in query_list:
-            # 向量检索
-            logger.info(f"开始向量检索，查询: {query}")
-            query_embeddings = embedding_model.embed_documents([query])
-            search_params = {
-                'data': query_embeddings,
-                'anns_field': "embedding",
-                'param': config['search_params'],
-                'limit': limit * 5,  # 获取更多结果用于融合
-                'output_fields': fields
-            }
-            if final_filter:
-                search_params['expr'] = final_filter
-            vector_res = collection.search(**search_params)
-            
+
+        # 对每个查询分别进行RRF融合
+        for query, hits, bm25_results in zip(query_list, vector_res, bm25_res):
             vector_results = []
-            for hits in vector_res:
-                for hit in hits:
-                    ent = {}
-                    # 确保包含id字段（Milvus的Hit对象有id属性）
-                    ent['id'] = hit.id
-                    for f in fields:
-                        if f != 'id':  # id已经单独处理
-                            ent[f] = hit.get(f)
-                    ent['score'] = hit.score
-                    vector_results.append(ent)
-            
-            # BM25检索
-            logger.info(f"开始BM25检索，查询: {query}")
-            bm25_results = _bm25_search(bm25, bm25_entities, query, limit * 5)
+            for hit in hits:
+                ent = {}
+                # 确保包含id字段（Milvus的Hit对象有id属性）
+                ent['id'] = hit.id
+                for f in candidate_fields:
+                    if f != 'id':  # id已经单独处理
+                        ent[f] = hit.get(f)
+                ent['score'] = hit.score
+                vector_results.append(ent)
             
             # RRF融合
             logger.info(f"开始RRF融合结果")
@@ -731,7 +1838,9 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
         ret_dic = {
             "ids": ids,
             "distances": distances,
-            "entities": entities
+            "entities": _hydrate_entities(collection, entities, fields, all_fields, deadline, degraded_reasons),
+            "degraded": bool(degraded_reasons),
+            "degraded_reasons": degraded_reasons
         }
         # 计算总结果数量
         total_results = sum(len(e) for e in entities)
@@ -741,20 +1850,16 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
     else:
         # 纯向量检索（原有逻辑）
         logger.info("使用纯向量检索模式")
-        logger.info(f"开始生成查询向量嵌入，查询数量={len(query_list)}")
-        query_embeddings = embedding_model.embed_documents(query_list)
-        logger.info(f"查询向量嵌入生成完成，开始搜索，过滤条件: {final_filter}")
 
-        search_params = {
-            'data': query_embeddings,
-            'anns_field': "embedding",
-            'param': config['search_params'],
-            'limit': limit,
-            'output_fields': fields
-        }
-        if final_filter:
-            search_params['expr'] = final_filter
-        res = collection.search(**search_params)
+        def dense_search():
+            logger.info(f"开始生成查询向量嵌入，查询数量={len(query_list)}")
+            query_embeddings = embed_queries(query_list)
+            logger.info(f"查询向量嵌入生成完成，开始搜索，过滤条件: {final_filter}")
+            return _dense_search(collection, query_embeddings, limit, candidate_fields, final_filter)
+
+        res = _run_with_deadline(dense_search, legs_deadline, 'dense_timeout', degraded_reasons)
+        if res is None:
+            res = [[] for _ in query_list]
 
         ids = []
         distances = []
@@ -768,9 +1873,10 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
             for rank, hit in enumerate(hits, start=1):
                 # 根据向量相似度阈值过滤结果（如果提供了阈值）
                 if vector_similarity_threshold is None or hit.score >= vector_similarity_threshold:
-                    ent = {}
-                    for f in fields:
-                        ent[f] = hit.get(f)
+                    ent = {'id': hit.id}
+                    for f in candidate_fields:
+                        if f != 'id':
+                            ent[f] = hit.get(f)
                     ent['score'] = hit.score  # 向量相似度分数
                     ent['vector_rank'] = rank  # 向量排名
                     ents.append(ent)
@@ -789,7 +1895,9 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
         ret_dic = {
             "ids": ids,
             "distances": distances,
-            "entities": entities
+            "entities": _hydrate_entities(collection, entities, fields, all_fields, deadline, degraded_reasons),
+            "degraded": bool(degraded_reasons),
+            "degraded_reasons": degraded_reasons
         }
         # 计算总结果数量
         total_results = sum(len(e) for e in entities)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+两级检索的降维投影
+每个collection拟合一个投影矩阵（PCA或随机正交投影，如1024→256），embedding_coarse字段存储投影并归一化后的
+低维向量用于召回候选，再用完整向量精排。
+投影按版本保存为{collection}_v{版本}.npz，{collection}.json记录collection当前使用的版本；
+重新拟合生成新版本，collection中的低维向量全部按新版本重算后才切换
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+COARSE_FIELD = 'embedding_coarse'
+
+
+class Projection:
+    """降维投影：y = normalize((x - mean) @ components.T)"""
+
+    def __init__(self, mean, components, method, version=0, fitted_at='', sample_size=0, explained_variance=None):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.method = method
+        self.version = version
+        self.fitted_at = fitted_at
+        self.sample_size = sample_size
+        self.explained_variance = explained_variance
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    def project(self, vectors):
+        """投影并L2归一化，返回float32矩阵"""
+        reduced = (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return reduced / np.clip(norms, 1e-12, None)
+
+    @staticmethod
+    def _check_dim(input_dim, dim):
+        if not 0 < dim < input_dim:
+            raise ValueError(f"投影维度{dim}必须在1到{input_dim - 1}之间")
+
+    @classmethod
+    def random(cls, input_dim, dim, seed=42):
+        """随机正交投影，与数据无关"""
+        cls._check_dim(input_dim, dim)
+        q, _ = np.linalg.qr(np.random.default_rng(seed).standard_normal((input_dim, dim)))
+        return cls(np.zeros(input_dim), q.T, 'random', fitted_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    @classmethod
+    def fit(cls, vectors, dim):
+        """按样本主成分拟合PCA投影，需要至少dim条样本"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        cls._check_dim(vectors.shape[1], dim)
+        if vectors.shape[0] < dim:
+            raise ValueError(f"PCA样本数{vectors.shape[0]}少于投影维度{dim}")
+        mean = vectors.mean(axis=0)
+        _, singular_values, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        variance = singular_values ** 2
+        explained = float(variance[:dim].sum() / max(variance.sum(), 1e-12))
+        return cls(mean, vt[:dim], 'pca', fitted_at=time.strftime('%Y-%m-%d %H:%M:%S'),
+                   sample_size=int(vectors.shape[0]), explained_variance=round(explained, 4))
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components,
+                 meta=json.dumps({'method': self.method, 'version': self.version, 'fitted_at': self.fitted_at,
+                                  'sample_size': self.sample_size, 'explained_variance': self.explained_variance}))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(data['mean'], data['components'], **meta)
+
+
+class ProjectionStore:
+    """按collection保存各版本的投影，并记录当前使用的版本（其他进程切换版本后按文件修改时间自动重新读取）"""
+
+    def __init__(self, projection_dir):
+        self.projection_dir = projection_dir
+        self._lock = threading.Lock()
+        self._projections = {}
+        self._active = {}
+
+    def _path(self, collection_name, version):
+        return os.path.join(self.projection_dir, f"{collection_name}_v{version}.npz")
+
+    def _pointer_path(self, collection_name):
+        return os.path.join(self.projection_dir, f"{collection_name}.json")
+
+    def versions(self, collection_name):
+        """已保存的版本号（升序）"""
+        if not os.path.isdir(self.projection_dir):
+            return []
+        prefix = f"{collection_name}_v"
+        return sorted(int(name[len(prefix):-4]) for name in os.listdir(self.projection_dir)
+                      if name.startswith(prefix) and name.endswith('.npz') and name[len(prefix):-4].isdigit())
+
+    def save(self, collection_name, projection):
+        """保存为新版本（不切换），返回版本号"""
+        os.makedirs(self.projection_dir, exist_ok=True)
+        with self._lock:
+            versions = self.versions(collection_name)
+            projection.version = versions[-1] + 1 if versions else 1
+            projection.save(self._path(collection_name, projection.version))
+        logger.info(f"collection[{collection_name}]的投影已保存为版本{projection.version}: method={projection.method}, "
+                    f"dim={projection.dim}, explained_variance={projection.explained_variance}")
+        return projection.version
+
+    def load(self, collection_name, version):
+        key = (collection_name, version)
+        projection = self._projections.get(key)
+        if projection is None:
+            projection = Projection.load(self._path(collection_name, version))
+            self._projections[key] = projection
+        return projection
+
+    def activate(self, collection_name, version):
+        """切换collection当前使用的投影版本"""
+        os.makedirs(self.projection_dir, exist_ok=True)
+        pointer_path = self._pointer_path(collection_name)
+        tmp_path = f"{pointer_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'activated_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+        os.replace(tmp_path, pointer_path)
+        logger.info(f"collection[{collection_name}]已切换到投影版本{version}")
+
+    def active(self, collection_name):
+        """返回collection当前使用的投影，没有时返回None"""
+        pointer_path = self._pointer_path(collection_name)
+        try:
+            mtime = os.path.getmtime(pointer_path)
+        except OSError:
+            return None
+        cached = self._active.get(collection_name)
+        if cached is None or cached[0] != mtime:
+            with open(pointer_path, 'r', encoding='utf-8') as f:
+                version = json.load(f)['version']
+            cached = (mtime, version)
+            self._active[collection_name] = cached
+        return self.load(collection_name, cached[1])
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+检索结果进程内缓存
+以完整检索参数为键缓存search_from_collection的结果，LRU按条数和估算字节数淘汰；
+每个租户/组织范围维护单调递增的写入版本号，写入/删除后版本号递增，缓存条目记录检索开始时的版本，
+读取时版本不一致即视为过期，保证不会返回写入前的旧结果
+"""
+import copy
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger('vector_db')
+
+
+class ScopeVersions:
+    """租户/组织范围的写入版本号
+
+    所有计数器共享一个全局递增序号，范围的版本号取影响该范围的各计数器的最大值；
+    写入范围中tenant_code或org_code为空时视为通配（如按租户删除全部组织的数据）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        # 精确范围及其泛化范围（检索范围）上最近一次写入的序号
+        self._scopes = defaultdict(int)
+        # tenant_code通配的写入，按org_code记录；org_code为空表示全部通配
+        self._wild_tenant = defaultdict(int)
+        self._wild_tenant_any = 0
+        # org_code通配的写入，按tenant_code记录
+        self._wild_org = defaultdict(int)
+        self._wild_org_any = 0
+
+    def bump(self, tenant_code, org_code):
+        """记录一次写入，使受影响范围的版本号递增"""
+        tenant_code, org_code = tenant_code or '', org_code or ''
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            for scope in {(tenant_code, org_code), (tenant_code, ''), ('', org_code), ('', '')}:
+                self._scopes[scope] = seq
+            if not tenant_code:
+                self._wild_tenant[org_code] = seq
+                self._wild_tenant_any = seq
+            if not org_code:
+                self._wild_org[tenant_code] = seq
+                self._wild_org_any = seq
+            return seq
+
+    def version(self, tenant_code, org_code):
+        """检索范围(tenant_code, org_code)当前的版本号，为空的字段表示不限"""
+        tenant_code, org_code = tenant_code or '', org_code or ''
+        with self._lock:
+            if not tenant_code and not org_code:
+                return self._seq
+            return max(self._scopes.get((tenant_code, org_code), 0),
+                       self._wild_tenant.get(org_code, 0) if org_code else self._wild_tenant_any,
+                       self._wild_tenant.get('', 0),
+                       self._wild_org.get(tenant_code, 0) if tenant_code else self._wild_org_any,
+                       self._wild_org.get('', 0))
+
+
+class SearchResultCache:
+    """线程安全的LRU/TTL检索结果缓存，带版本校验和命中统计"""
+
+    def __init__(self, max_entries=2000, max_bytes=256 * 1024 * 1024, ttl_seconds=600):
+        """
+        Args:
+            max_entries: 最多缓存的结果条数
+            max_bytes: 缓存结果的估算总字节数上限
+            ttl_seconds: 缓存有效期（秒），小于等于0表示不过期；用于兜底本进程之外（如迁移工具）的写入
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.versions = ScopeVersions()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at, now):
+        return self.ttl_seconds and self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def _drop(self, key):
+        _, _, _, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def get(self, key, tenant_code, org_code):
+        """读取缓存，未命中、已过期或写入版本已变化时返回None"""
+        version = self.versions.version(tenant_code, org_code)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] != version or self._expired(entry[2], now)):
+                self._drop(key)
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            result = entry[0]
+        # 返回副本，调用方修改结果不影响缓存
+        return copy.deepcopy(result)
+
+    def put(self, key, version, result):
+        """写入缓存
+
+        Args:
+            version: 检索开始前读取的范围版本号，检索期间发生写入时该条目在下次读取时即过期
+        """
+        size = len(json.dumps(result, ensure_ascii=False, default=str).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (copy.deepcopy(result), version, now, size)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._drop(oldest_key)
+                self.evictions += 1
+
+    def bump(self, tenant_code, org_code):
+        """写入/删除数据后调用，使该范围（及包含它的范围）的缓存失效"""
+        return self.versions.bump(tenant_code, org_code)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+BM25分词缓存
+以(分词器版本, 文本sha256)为键把jieba分词结果存入SQLite，入库时写入，构建BM25索引时直接读取；
+未命中的大批量文本在进程池中并行分词；jieba词典序列化缓存到指定文件，启动时预加载，
+避免首个检索请求承担词典加载开销
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import jieba
+
+logger = logging.getLogger('vector_db')
+
+# 分词器版本变化（升级jieba）后旧的分词结果自动失效
+TOKENIZER_ID = f"jieba-{jieba.__version__}"
+
+
+def set_jieba_cache_file(cache_file):
+    """指定jieba词典序列化缓存文件（只设置路径，不加载词典）"""
+    if not cache_file:
+        return
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    os.makedirs(cache_dir, exist_ok=True)
+    jieba.dt.tmp_dir = cache_dir
+    jieba.dt.cache_file = os.path.basename(cache_file)
+
+
+def preload_jieba(cache_file=''):
+    """预加载jieba词典
+
+    Args:
+        cache_file: 词典序列化缓存文件路径，不存在时首次加载后写入，之后直接反序列化加载
+    """
+    set_jieba_cache_file(cache_file)
+    start = time.perf_counter()
+    jieba.initialize()
+    logger.info(f"jieba词典加载完成，耗时{time.perf_counter() - start:.2f}秒，缓存文件: {cache_file or '系统临时目录'}")
+
+
+def tokenize(text):
+    """中文分词"""
+    return list(jieba.cut(text))
+
+
+def _tokenize_batch(texts):
+    return [tokenize(text) for text in texts]
+
+
+class TokenCache:
+    """基于SQLite的分词结果缓存，支持多线程访问"""
+
+    def __init__(self, path):
+        self.path = path
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS tokens ('
+            'tokenizer TEXT NOT NULL, text_hash TEXT NOT NULL, tokens TEXT NOT NULL, '
+            'PRIMARY KEY (tokenizer, text_hash))'
+        )
+        self._conn.commit()
+
+    def get_many(self, text_hashes):
+        """批量读取，返回{text_hash: 分词列表}"""
+        result = {}
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        with self._lock:
+            # SQLite单条语句变量数有限，分批查询
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f'SELECT text_hash, tokens FROM tokens WHERE tokenizer = ? '
+                    f'AND text_hash IN ({",".join("?" * len(batch))})', [TOKENIZER_ID] + batch
+                ).fetchall()
+                for text_hash, tokens in rows:
+                    result[text_hash] = json.loads(tokens)
+        return result
+
+    def put_many(self, items):
+        """批量写入，items为[(text_hash, 分词列表)]"""
+        if not items:
+            return
+        rows = [(TOKENIZER_ID, text_hash, json.dumps(tokens, ensure_ascii=False)) for text_hash, tokens in items]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)', rows)
+            self._conn.commit()
+
+
+class CorpusTokenizer:
+    """语料批量分词：先读分词缓存，未命中的文本数量较多时在进程池中并行分词，结果写回缓存"""
+
+    def __init__(self, cache=None, workers=0, parallel_threshold=2000, jieba_cache_file=''):
+        """
+        Args:
+            cache: TokenCache，为None时不缓存
+            workers: 进程池大小，小于2时不使用进程池
+            parallel_threshold: 未命中文本数量达到该值时才使用进程池
+            jieba_cache_file: 子进程预加载jieba词典使用的缓存文件
+        """
+        self.cache = cache
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.jieba_cache_file = jieba_cache_file
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # 进程池在首次使用时才创建，此时服务进程已有多个线程（检索线程池、批处理线程等），
+                # 直接fork可能继承被其他线程持有的锁导致子进程死锁；优先forkserver，不支持时用spawn。
+                # 子进程只导入本模块（不会加载向量模型），由initializer从缓存文件加载jieba词典
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                mp_context = multiprocessing.get_context(start_method)
+                if start_method == 'forkserver':
+                    mp_context.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context,
+                                                 initializer=preload_jieba, initargs=(self.jieba_cache_file,))
+                logger.info(f"分词进程池已创建，进程数={self.workers}，启动方式={start_method}")
+            return self._pool
+
+    def _tokenize_texts(self, texts):
+        if self.workers < 2 or len(texts) < self.parallel_threshold:
+            return _tokenize_batch(texts)
+        chunk_size = max(1, min(500, len(texts) // (self.workers * 4)))
+        batches = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+        start = time.perf_counter()
+        tokens = []
+        for batch_tokens in self._get_pool().map(_tokenize_batch, batches):
+            tokens.extend(batch_tokens)
+        logger.info(f"进程池并行分词完成，共{len(texts)}条文本，耗时{time.perf_counter() - start:.2f}秒")
+        return tokens
+
+    def tokenize_many(self, texts):
+        """批量分词，返回与texts一一对应的分词列表"""
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._tokenize_texts(texts)
+
+        hashes = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        try:
+            cached = self.cache.get_many(hashes)
+        except Exception as e:
+            logger.warning(f"读取分词缓存失败，直接分词: {e}")
+            cached = {}
+
+        # 未命中的文本去重后一次性分词
+        miss = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in miss:
+                miss[text_hash] = text
+        if miss:
+            new_items = list(zip(miss.keys(), self._tokenize_texts(list(miss.values()))))
+            cached.update(new_items)
+            try:
+                self.cache.put_many(new_items)
+            except Exception as e:
+                logger.warning(f"写入分词缓存失败: {e}")
+        logger.info(f"分词缓存：共{len(texts)}条文本，命中{len(texts) - len(miss)}条，新分词{len(miss)}条")
+        return [cached[h] for h in hashes]
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+向量存储精度
+config['vector_storage']['dtype']决定embedding字段的存储类型：
+    FLOAT:    FLOAT_VECTOR，每维4字节（默认）
+    FLOAT16:  FLOAT16_VECTOR，每维2字节
+    BFLOAT16: BFLOAT16_VECTOR，每维2字节，需要安装ml_dtypes
+    INT8:     INT8_VECTOR，每维1字节，按向量最大绝对值缩放到[-127, 127]（COSINE度量下缩放不影响相似度）
+低精度存储时可对候选集做精排：多召回oversample倍候选，用float32查询向量与候选的存储向量重新计算余弦相似度
+"""
+import logging
+
+import numpy as np
+from pymilvus import DataType
+
+logger = logging.getLogger('vector_db')
+
+VECTOR_DTYPES = {
+    'FLOAT': DataType.FLOAT_VECTOR,
+    'FLOAT16': DataType.FLOAT16_VECTOR,
+    'BFLOAT16': DataType.BFLOAT16_VECTOR,
+    'INT8': DataType.INT8_VECTOR,
+}
+
+BYTES_PER_DIM = {'FLOAT': 4, 'FLOAT16': 2, 'BFLOAT16': 2, 'INT8': 1}
+
+# 各存储类型支持的向量索引，未列出的类型不限制
+SUPPORTED_INDEX_TYPES = {'INT8': {'HNSW'}}
+
+
+def milvus_dtype(mode):
+    """存储类型名转换为pymilvus的DataType"""
+    if mode not in VECTOR_DTYPES:
+        raise ValueError(f"不支持的向量存储类型: {mode}，可选{list(VECTOR_DTYPES)}")
+    return VECTOR_DTYPES[mode]
+
+
+def mode_of(data_type):
+    """pymilvus的DataType转换为存储类型名"""
+    for mode, dtype in VECTOR_DTYPES.items():
+        if dtype == data_type:
+            return mode
+    raise ValueError(f"不支持的向量字段类型: {data_type}")
+
+
+def _bfloat16():
+    try:
+        import ml_dtypes
+    except ImportError:
+        raise ImportError("BFLOAT16向量存储需要安装ml_dtypes: pip install ml_dtypes")
+    return ml_dtypes.bfloat16
+
+
+def quantize_int8(vectors):
+    """按每个向量的最大绝对值缩放并量化为int8"""
+    scale = np.abs(vectors).max(axis=1, keepdims=True)
+    return np.clip(np.rint(vectors / np.clip(scale, 1e-12, None) * 127), -127, 127).astype(np.int8)
+
+
+def encode_vectors(vectors, mode):
+    """把float向量转换为存储类型对应的写入/检索格式
+
+    已是存储类型的numpy数组（如从collection中读出的向量）原样返回
+    """
+    if mode == 'FLOAT':
+        return [v.tolist() if isinstance(v, np.ndarray) else v for v in vectors]
+    vectors = list(vectors)
+    if not vectors:
+        return []
+    target = _bfloat16() if mode == 'BFLOAT16' else {'FLOAT16': np.float16, 'INT8': np.int8}[mode]
+    if all(isinstance(v, np.ndarray) and v.dtype == target for v in vectors):
+        return vectors
+    matrix = np.asarray([np.asarray(v, dtype=np.float32) for v in vectors])
+    if mode == 'INT8':
+        return list(quantize_int8(matrix))
+    return list(matrix.astype(target))
+
+
+def decode_vector(value, mode):
+    """把查询/检索结果中的向量（float列表、bytes或[bytes]）转换为float32数组"""
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], (bytes, bytearray)):
+        value = value[0]
+    if isinstance(value, (bytes, bytearray)):
+        if mode == 'FLOAT16':
+            return np.frombuffer(value, dtype=np.float16).astype(np.float32)
+        if mode == 'BFLOAT16':
+            # bfloat16即float32的高16位
+            return (np.frombuffer(value, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+        if mode == 'INT8':
+            return np.frombuffer(value, dtype=np.int8).astype(np.float32)
+        return np.frombuffer(value, dtype=np.float32).copy()
+    return np.asarray(value, dtype=np.float32)
+
+
+def convert_vectors(vectors, src_mode, dst_mode):
+    """在两种存储类型之间转换向量（迁移时使用）"""
+    if src_mode == dst_mode and src_mode == 'FLOAT':
+        return vectors
+    return encode_vectors([decode_vector(v, src_mode) for v in vectors], dst_mode)
+
+
+def simulate_storage(vectors, mode):
+    """返回float32向量按mode存储后再读出的结果（不依赖ml_dtypes，用于评估精度损失）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == 'FLOAT16':
+        return vectors.astype(np.float16).astype(np.float32)
+    if mode == 'BFLOAT16':
+        # 取float32高16位，按最近偶数舍入
+        bits = vectors.view(np.uint32)
+        rounded = (bits + 0x7FFF + ((bits >> 16) & 1)) & 0xFFFF0000
+        return rounded.astype(np.uint32).view(np.float32)
+    if mode == 'INT8':
+        return quantize_int8(vectors).astype(np.float32)
+    return vectors
+
+
+def cosine_scores(query_vector, candidate_vectors):
+    """float32查询向量与候选向量的余弦相似度"""
+    query = np.asarray(query_vector, dtype=np.float32)
+    matrix = np.asarray(candidate_vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+    return matrix @ query / np.clip(norms, 1e-12, None)
+
+
+class RescoredHit:
+    """精排后的检索结果，接口与pymilvus的Hit一致（id、score、get）"""
+
+    __slots__ = ('id', 'score', '_hit')
+
+    def __init__(self, hit, score):
+        self.id = hit.id
+        self.score = score
+        self._hit = hit
+
+    def get(self, field_name, default=None):
+        value = self._hit.get(field_name)
+        return default if value is None else value
+
+
+def rescore_hits(hits, query_vector, mode, limit, field_name='embedding'):
+    """用float32查询向量对候选集重新计算余弦相似度，按新分数排序后保留前limit条"""
+    hits = list(hits)
+    if not hits:
+        return []
+    scores = cosine_scores(query_vector, [decode_vector(hit.get(field_name), mode) for hit in hits])
+    order = np.argsort(-scores, kind='stable')[:limit]
+    return [RescoredHit(hits[i], float(scores[i])) for i in order]
@@ -8,7 +8,6 @@ logger = logging.getLogger('vector_db')
 import os
 import json
 import tempfile
-import requests
 from urllib.parse import urlparse
 from flask import Blueprint, request, jsonify, send_file
 from milvus.miluvs_helper import *
@@ -217,10 +216,22 @@ def search_from_vector_db():
     # 素材库服务接口可以传递阈值，如果不传则使用None（不进行阈值过滤）
     vector_similarity_threshold = data.get('vector_similarity_threshold', None)
     rrf_similarity_threshold = data.get('rrf_similarity_threshold', None)
+    # 只返回指定字段，不传时返回除向量外的全部字段
+    output_fields = data.get('output_fields', None)
+    # 检索时间预算（毫秒），超出时返回已有结果并标记降级，不传则不限制
+    time_budget_ms = data.get('time_budget_ms', None)
 
     if not query:
         return jsonify({'status': 'fail', 'msg': '搜索数据不能为空', 'code': 400, 'data': ''})
 
+    if output_fields is not None and (not isinstance(output_fields, list)
+                                      or not all(isinstance(f, str) for f in output_fields)):
+        return jsonify({'status': 'fail', 'msg': 'output_fields必须是字符串列表', 'code': 400, 'data': ''})
+
+    if time_budget_ms is not None and (isinstance(time_budget_ms, bool)
+                                       or not isinstance(time_budget_ms, (int, float)) or time_budget_ms <= 0):
+        return jsonify({'status': 'fail', 'msg': 'time_budget_ms必须是正数', 'code': 400, 'data': ''})
+
     if not collection_type:
         return jsonify({'status': 'fail', 'msg': 'collect_type不能为空', 'code': 400, 'data': ''})
 
@@ -236,7 +247,8 @@ def search_from_vector_db():
                                      collection_type=collection_type, query_list=[query], 
                                      filter_expr=filter_expr, limit=limit, use_hybrid=use_hybrid,
                                      vector_similarity_threshold=vector_similarity_threshold,
-                                     rrf_similarity_threshold=rrf_similarity_threshold)
+                                     rrf_similarity_threshold=rrf_similarity_threshold,
+                                     output_fields=output_fields, time_budget_ms=time_budget_ms)
 
         logger.info(f"从素材库[{collection_name}]查询成功，使用混合检索: {use_hybrid}")
     except Exception:
@@ -246,6 +258,36 @@ def search_from_vector_db():
     return jsonify({'status': 'success', 'code': 200, 'msg': '从素材库查询成功', 'data': res})
 
 
+@vector_db_bp.route('/vector_db_service/query_cache_stats', methods=['GET'])
+def query_cache_stats():
+    stats = get_query_cache_stats()
+    if stats is None:
+        return jsonify({'status': 'fail', 'msg': '未启用查询向量缓存', 'code': 400, 'data': ''})
+    return jsonify({'status': 'success', 'code': 200, 'msg': '获取查询向量缓存统计成功', 'data': stats})
+
+
+@vector_db_bp.route('/vector_db_service/result_cache_stats', methods=['GET'])
+def result_cache_stats():
+    stats = get_result_cache_stats()
+    if stats is None:
+        return jsonify({'status': 'fail', 'msg': '未启用检索结果缓存', 'code': 400, 'data': ''})
+    return jsonify({'status': 'success', 'code': 200, 'msg': '获取检索结果缓存统计成功', 'data': stats})
+
+
+@vector_db_bp.route('/vector_db_service/retrieval_stats', methods=['GET'])
+def retrieval_stats():
+    stats = get_retrieval_stats()
+    return jsonify({'status': 'success', 'code': 200, 'msg': '获取检索降级统计成功', 'data': stats})
+
+
+@vector_db_bp.route('/vector_db_service/dedup_stats', methods=['GET'])
+def dedup_stats():
+    stats = get_dedup_stats()
+    if stats is None:
+        return jsonify({'status': 'fail', 'msg': '未启用近重复分块检测', 'code': 400, 'data': ''})
+    return jsonify({'status': 'success', 'code': 200, 'msg': '获取近重复分块统计成功', 'data': stats})
+
+
 # ==================== 问答对相关接口 ====================
 
 @vector_db_bp.route('/vector_db_service/download_qa_template', methods=['GET'])
@@ -356,15 +398,18 @@ def add_qa_from_template():
         question_list, answers_list, source_list = load_qa_template(temp_file_path)
         metadata_list = [{} for q in question_list]
         
-        # 插入到素材库
-        is_succ, msg = insert_qa_to_collection(tenant_code, org_code, question_list=question_list,
-                                               answer_list=answers_list, source_list=source_list,
-                                               metadata_list=metadata_list)
+        # 批量插入到素材库，返回每条问答对的处理结果
+        is_succ, msg, outcomes = upsert_qa_to_collection(tenant_code, org_code, question_list=question_list,
+                                                         answer_list=answers_list, source_list=source_list,
+                                                         metadata_list=metadata_list)
         if not is_succ:
             return jsonify({'status': 'fail', 'msg': msg, 'code': 400, 'data': ''})
         
-        logger.info(f"成功从上传文件添加{len(question_list)}条问答对到素材库")
-        return jsonify({'status': 'success', 'code': 200, 'msg': f'成功插入{len(question_list)}条问答对到素材库', 'data': ''})
+        replaced_count = sum(1 for o in outcomes if o['status'] == 'replaced')
+        logger.info(f"成功从上传文件添加{len(question_list)}条问答对到素材库，其中{replaced_count}条是删除后重新插入的")
+        return jsonify({'status': 'success', 'code': 200, 'msg': f'成功插入{len(question_list)}条问答对到素材库',
+                        'data': {'inserted': len(outcomes) - replaced_count, 'replaced': replaced_count,
+                                 'outcomes': outcomes}})
         
     except Exception as e:
         import traceback